@@ -0,0 +1,319 @@
+"""
+Benchmark the HAL serialization against the core JSON serialization.
+
+Synthetic text stores of 1k, 10k and 100k tiddlers (spread across
+bags, with a recipe over them, and a tiddler with many revisions) are
+made in --store, one directory for each size, and kept between runs
+unless --rebuild is given. The collections benchmarked hold
+references to the tiddlers, as those made by the web handlers do, so
+tiddlers are loaded from the store as they are serialized. For each
+size list_tiddlers (plain and streamed), list_bags, list_recipes,
+tiddler_as, the revisions listing and the HAL root handler are timed,
+and the peak memory used by each is measured. The results are
+written as JSON so runs can be compared between releases.
+
+Run from the top of the repo:
+
+    python bench/bench_hal.py [--sizes 1000,10000] [--repeat 3]
+            [--store bench_store] [--rebuild] [--output results.json]
+"""
+
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, '.')
+import mangler
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+import resource
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Container, Tiddlers
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.serializations.json import Serialization as JSON
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal import init, emitter
+from tiddlywebplugins.hal.fixups import _hal_root
+from tiddlywebplugins.hal.serialization import Serialization as HAL
+
+
+SIZES = [1000, 10000, 100000]
+TIDDLERS_PER_BAG = 1000
+REVISIONS = 100
+
+
+def make_store(store, size):
+    """
+    Fill store with the synthetic store: bags of TIDDLERS_PER_BAG
+    tiddlers, a recipe of all the bags and REVISIONS revisions of
+    one tiddler.
+    """
+    bag_count = max(1, size // TIDDLERS_PER_BAG)
+    for i in range(bag_count):
+        bag = Bag('bag%s' % i)
+        bag.desc = 'bag number %s' % i
+        store.put(bag)
+    recipe = Recipe('recipe0')
+    recipe.set_recipe([('bag%s' % i, '') for i in range(bag_count)])
+    store.put(recipe)
+
+    for i in range(size):
+        tiddler = Tiddler(u'tiddler %s \xe9' % i, 'bag%s' % (i % bag_count))
+        tiddler.text = u'text of tiddler %s ' % i * 10
+        tiddler.tags = [u'tag%s' % (i % 10), u'all']
+        tiddler.fields = {u'field': u'value %s' % i}
+        tiddler.modifier = u'bench'
+        store.put(tiddler)
+
+    revised = Tiddler(u'tiddler 0 \xe9', 'bag0')
+    for i in range(REVISIONS - 1):
+        revised.text = u'revision %s' % i
+        store.put(revised)
+
+
+def prepare_store(root, size, rebuild):
+    """
+    The store for size, in its directory under root, made if it
+    is not there or rebuild is set.
+    """
+    store_root = os.path.join(root, str(size))
+    config['server_store'] = ['text', {'store_root': store_root}]
+    made_file = os.path.join(store_root, 'bench_size.json')
+    if rebuild or not os.path.exists(made_file):
+        shutil.rmtree(store_root, ignore_errors=True)
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        started = time.time()
+        store = get_store(config)
+        make_store(store, size)
+        with open(made_file, 'w') as made:
+            json.dump(size, made)
+        print >> sys.stderr, 'made store of %s in %.1fs' % (size,
+                time.time() - started)
+    return get_store(config)
+
+
+def collections(store):
+    """
+    The bags, recipes, tiddlers of every bag and revisions of the
+    revised tiddler in store, as the web handlers collect them.
+    """
+    bags = Container()
+    for bag in store.list_bags():
+        bags.add(bag)
+    recipes = Container()
+    for recipe in store.list_recipes():
+        recipes.add(recipe)
+
+    tiddlers = Tiddlers(bag='bag0', store=store)
+    for bag in bags:
+        for tiddler in store.list_bag_tiddlers(bag):
+            tiddlers.add(tiddler)
+
+    revisions = Tiddlers(bag='bag0', store=store)
+    revisions.is_revisions = True
+    revised = Tiddler(u'tiddler 0 \xe9', 'bag0')
+    for revision_id in store.list_tiddler_revisions(revised):
+        revision = Tiddler(revised.title, revised.bag)
+        revision.revision = revision_id
+        revisions.add(revision)
+
+    return bags, recipes, tiddlers, revisions
+
+
+def make_environ(store, route):
+    """
+    A minimal environ for serializing, routed as route.
+    """
+    return {
+        'tiddlyweb.config': config,
+        'tiddlyweb.store': store,
+        'tiddlyweb.query': {},
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'wsgiorg.routing_args': ((), route),
+    }
+
+
+def measure(func, repeat, baseline=0):
+    """
+    Time func, best of repeat, and its peak memory use in bytes.
+    With tracemalloc (Python 3) the peak is of the allocations
+    made by func, otherwise it is measured in a forked child, see
+    forked_peak, less baseline, the growth of a child which does
+    nothing.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        peak = forked_peak(func)
+        if peak is not None:
+            peak = max(0, peak - baseline)
+    return {'best': min(times), 'mean': sum(times) / len(times),
+            'peak_memory': peak}
+
+
+def forked_peak(func):
+    """
+    The growth of the resident set while func runs, in bytes. func
+    is run in a forked child, whose high water mark starts at the
+    size of the process when it is forked, so each case is measured
+    from where it starts, not from the largest case run before it.
+    This includes the pages the child copies on writing to them,
+    whatever func does, so see empty_peak. None where there is no
+    fork.
+    """
+    if not hasattr(os, 'fork'):
+        return None
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read_end)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            func()
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_end, str((after - before) * 1024))
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write_end)
+    try:
+        peak = os.read(read_end, 64)
+    finally:
+        os.close(read_end)
+        os.waitpid(pid, 0)
+    return int(peak) if peak else None
+
+
+def empty_peak():
+    """
+    The least forked_peak of a func which does nothing, out of a
+    few, the part of each forked_peak which is not func's.
+    """
+    if tracemalloc:
+        return 0
+    peaks = [forked_peak(lambda: None) for _ in range(3)]
+    if None in peaks:
+        return 0
+    return min(peaks)
+
+
+def run_size(size, repeat, root, rebuild):
+    """
+    Run every benchmark for one size of store.
+    """
+    store = prepare_store(root, size, rebuild)
+    bags, recipes, tiddlers, revisions = collections(store)
+    single = store.get(Tiddler(u'tiddler 0 \xe9', 'bag0'))
+
+    def start_response(status, headers):
+        pass
+
+    def stream(serialization, collection):
+        return ''.join(serialization._stream_tiddlers(collection))
+
+    bag_route = {'bag_name': 'bag0'}
+    revisions_route = {'bag_name': 'bag0', 'tiddler_name': u'tiddler 0 \xe9'}
+
+    def hal(route):
+        return HAL(make_environ(store, route))
+
+    def core(route):
+        return JSON(make_environ(store, route))
+
+    cases = {
+        'list_tiddlers': (
+            lambda: hal(bag_route).list_tiddlers(tiddlers),
+            lambda: core(bag_route).list_tiddlers(tiddlers)),
+        'list_tiddlers_stream': (
+            lambda: stream(hal(bag_route), tiddlers),
+            None),
+        'list_revisions': (
+            lambda: hal(revisions_route).list_tiddlers(revisions),
+            lambda: core(revisions_route).list_tiddlers(revisions)),
+        'list_bags': (
+            lambda: hal({}).list_bags(bags),
+            lambda: core({}).list_bags(bags)),
+        'list_recipes': (
+            lambda: hal({}).list_recipes(recipes),
+            lambda: core({}).list_recipes(recipes)),
+        'tiddler_as': (
+            lambda: hal(bag_route).tiddler_as(single),
+            lambda: core(bag_route).tiddler_as(single)),
+        'root': (
+            lambda: _hal_root(make_environ(store, {}), start_response),
+            None),
+    }
+
+    baseline = empty_peak()
+    results = {'memory_baseline': baseline}
+    for name in sorted(cases):
+        hal_func, json_func = cases[name]
+        results[name] = {'hal': measure(hal_func, repeat, baseline)}
+        if json_func:
+            results[name]['json'] = measure(json_func, repeat, baseline)
+    return results
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--sizes', default=','.join(str(size)
+        for size in SIZES), help='comma separated store sizes')
+    parser.add_option('--repeat', type='int', default=3,
+            help='runs per benchmark, the best is reported')
+    parser.add_option('--store', default='bench_store',
+            help='directory of the synthetic stores')
+    parser.add_option('--rebuild', action='store_true', default=False,
+            help='make the stores again even if they are there')
+    parser.add_option('--output', default=None,
+            help='file for the JSON results, default stdout')
+    options, _ = parser.parse_args()
+
+    config['log_level'] = 'WARNING'
+    init(config)
+    sizes = [int(size) for size in options.sizes.split(',')]
+    report = {
+        'python': platform.python_version(),
+        'encoder': emitter.ENCODER[0],
+        'repeat': options.repeat,
+        'memory': 'tracemalloc' if tracemalloc else 'rss',
+        'results': dict([(str(size), run_size(size, options.repeat,
+            options.store, options.rebuild)) for size in sizes]),
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as results:
+            results.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare the per-tiddler cost of tiddler_url with the memoized
+URL building in the HAL serialization, over a 100k tiddler
+collection spread across a few bags.
+
+Run from the top of the repo:
+
+    python bench/bench_urls.py
+"""
+
+import sys
+import time
+
+sys.path.insert(0, '.')
+import mangler
+
+from tiddlyweb.config import config
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.util import tiddler_url
+
+from tiddlywebplugins.hal.serialization import Serialization
+
+
+COUNT = 100000
+BAGS = 10
+
+
+def make_tiddlers():
+    return [Tiddler(u'tiddler %s' % i, u'bag %s' % (i % BAGS))
+            for i in range(COUNT)]
+
+
+def time_per_item(func, tiddlers):
+    start = time.time()
+    for tiddler in tiddlers:
+        func(tiddler)
+    return (time.time() - start) / len(tiddlers) * 1000000
+
+
+def main():
+    environ = {'tiddlyweb.config': config}
+    tiddlers = make_tiddlers()
+
+    uncached = time_per_item(
+            lambda tiddler: tiddler_url(environ, tiddler, full=True),
+            tiddlers)
+    serialization = Serialization(environ)
+    cached = time_per_item(serialization._tiddler_url, tiddlers)
+
+    print '%s tiddlers in %s bags' % (COUNT, BAGS)
+    print 'tiddler_url:          %.2f usec per tiddler' % uncached
+    print 'Serialization (memo): %.2f usec per tiddler' % cached
+
+
+if __name__ == '__main__':
+    main()
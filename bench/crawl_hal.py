@@ -0,0 +1,564 @@
+"""
+Crawl a synthetic store through the HAL link graph with concurrent
+workers, as a load generator, and report throughput and latency.
+
+Each worker starts at the root and walks the API as a hypermedia
+client would, as test/test_traverse.py does: it GETs a document then
+follows one of its links, or the self link of one of its embedded
+entities, chosen at random. It goes back to the root now and then,
+and at dead ends. Of the templated links, search is filled in with a
+word from the tiddlers and batch with tiddlers already seen; the
+others are left for the concrete links beside them. A tiddler has no
+link to its revisions, so the crawler makes one from its self link.
+
+Some tiddlers have revisions and some are binary, and hal.binary_links
+is on unless --set turns it off, so revisions and raw content are
+crawled too. Resource types that got no requests are warned of, and
+listed in the results as unvisited.
+
+The WSGI app is called in process, or with --socket served over a
+local socket by a threading wsgiref server. The store is a text
+store made in --store, which is kept between runs unless --rebuild
+is given or its shape options change. Plugin config can be set with
+--set, e.g. --set hal.cache_size=1000, to compare settings.
+
+Throughput and p50/p95/p99 latency are reported per link rel and per
+resource type, as a table or, with --output, as JSON so runs can be
+compared.
+
+Run from the top of the repo:
+
+    python bench/crawl_hal.py [--workers 8] [--requests 2000]
+            [--duration 0] [--socket] [--bags 10] [--tiddlers 100]
+            [--revisions 20] [--gzip] [--set name=value]
+            [--output results.json]
+"""
+
+import httplib
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import zlib
+
+from optparse import OptionParser
+from SocketServer import ThreadingMixIn
+from StringIO import StringIO
+from urllib import quote, unquote
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+sys.path.insert(0, '.')
+import mangler
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+ACCEPT = 'application/hal+json'
+
+# Chance of going back to the root after each request.
+RESTART = 0.1
+
+# One tiddler in this many has revisions.
+REVISED_EVERY = 10
+
+# One tiddler in this many is binary.
+BINARY_EVERY = 10
+
+# The binary content of those tiddlers: a 1x1 PNG and some padding.
+BINARY_TEXT = ('\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01'
+        '\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+        + '\x00' * 2048)
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot']
+
+# Rels not followed: the curie and profile are not resources of the
+# server, self and alternate are where the crawler already is.
+SKIPPED_RELS = ['curie', 'profile', 'self', 'alternate']
+
+# The resource type of a path, first match.
+RESOURCE_TYPES = [
+        ('root', re.compile(r'^/$')),
+        ('raw', re.compile(r'/raw$')),
+        ('bags', re.compile(r'^/bags$')),
+        ('bag', re.compile(r'^/bags/[^/]+$')),
+        ('recipes', re.compile(r'^/recipes$')),
+        ('recipe', re.compile(r'^/recipes/[^/]+$')),
+        ('tiddlers', re.compile(r'^/(bags|recipes)/[^/]+/tiddlers$')),
+        ('tiddler', re.compile(r'^/(bags|recipes)/[^/]+/tiddlers/[^/]+$')),
+        ('revisions', re.compile(r'/tiddlers/[^/]+/revisions$')),
+        ('revision', re.compile(r'/tiddlers/[^/]+/revisions/[^/]+$')),
+        ('search', re.compile(r'^/search$')),
+        ('batch', re.compile(r'^/batch$')),
+]
+
+
+class Budget(object):
+    """
+    The requests left to make, shared by the workers, until a
+    count or a deadline is reached.
+    """
+
+    def __init__(self, requests, duration):
+        self.left = requests
+        self.deadline = time.time() + duration if duration else None
+        self._lock = threading.Lock()
+
+    def take(self):
+        """
+        True if another request may be made.
+        """
+        if self.deadline and time.time() >= self.deadline:
+            return False
+        with self._lock:
+            if self.left is None:
+                return True
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+
+class InProcessClient(object):
+    """
+    GET paths by calling the WSGI app directly.
+    """
+
+    def __init__(self, app, host, port, headers):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.headers = headers
+
+    def get(self, path):
+        """
+        The status, headers and body of the response to GET path.
+        """
+        # Links come from parsed JSON, but a WSGI environ has
+        # bytes, as TiddlyWeb expects in QUERY_STRING.
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        path_info, _, query_string = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path_info),
+            'QUERY_STRING': query_string,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': '%s:%s' % (self.host, self.port),
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.input': StringIO(''),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in self.headers.items():
+            environ['HTTP_%s' % name.upper().replace('-', '_')] = value
+
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]), dict(
+                [(name.lower(), value) for name, value in headers])]
+
+        output = self.app(environ, start_response)
+        try:
+            body = ''.join(output)
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+        return response[0], response[1], body
+
+
+class SocketClient(object):
+    """
+    GET paths over HTTP from a local server.
+    """
+
+    def __init__(self, host, port, headers):
+        self.host = host
+        self.port = port
+        self.headers = headers
+
+    def get(self, path):
+        """
+        The status, headers and body of the response to GET path.
+        """
+        connection = httplib.HTTPConnection(self.host, self.port)
+        try:
+            connection.request('GET', path, headers=self.headers)
+            response = connection.getresponse()
+            return (response.status, dict(response.getheaders()),
+                    response.read())
+        finally:
+            connection.close()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def make_store(options):
+    """
+    Make the synthetic store: bags of tiddlers, some with
+    revisions and some binary, and recipes over them.
+    """
+    store = get_store(config)
+    for i in range(options.bags):
+        bag = Bag('bag%s' % i)
+        bag.desc = 'bag number %s' % i
+        store.put(bag)
+        for j in range(options.tiddlers):
+            tiddler = Tiddler('tiddler %s' % j, bag.name)
+            tiddler.tags = ['tag%s' % (j % 10), WORDS[j % len(WORDS)]]
+            tiddler.text = '%s %s\n' % (WORDS[j % len(WORDS)], j) * 20
+            store.put(tiddler)
+            if j % REVISED_EVERY == 0:
+                for revision in range(options.revisions - 1):
+                    tiddler.text += 'edit %s\n' % revision
+                    store.put(tiddler)
+            if j % BINARY_EVERY == BINARY_EVERY // 2:
+                binary = Tiddler('image %s' % j, bag.name)
+                binary.type = 'image/png'
+                binary.text = BINARY_TEXT
+                store.put(binary)
+
+    recipe = Recipe('all')
+    recipe.set_recipe([('bag%s' % i, '') for i in range(options.bags)])
+    store.put(recipe)
+    for i in range(options.bags):
+        recipe = Recipe('recipe%s' % i)
+        recipe.set_recipe([('bag%s' % i, ''),
+            ('bag%s' % ((i + 1) % options.bags), 'select=tag:tag0')])
+        store.put(recipe)
+
+
+def prepare_store(options):
+    """
+    Use the store at options.store, making it if it is not there,
+    is not the shape asked for or rebuild is set.
+    """
+    shape = {'bags': options.bags, 'tiddlers': options.tiddlers,
+            'revisions': options.revisions, 'binary': BINARY_EVERY}
+    shape_file = os.path.join(options.store, 'crawl_shape.json')
+    config['server_store'] = ['text', {'store_root': options.store}]
+    try:
+        with open(shape_file) as made:
+            if json.load(made) == shape and not options.rebuild:
+                return
+    except (IOError, ValueError):
+        if os.path.isdir(options.store) and os.listdir(options.store):
+            sys.exit('%s is not a crawl store, not replacing it'
+                    % options.store)
+
+    shutil.rmtree(options.store, ignore_errors=True)
+    started = time.time()
+    make_store(options)
+    with open(shape_file, 'w') as made:
+        json.dump(shape, made)
+    print >> sys.stderr, 'made store in %.1fs' % (time.time() - started)
+
+
+def resource_type(path):
+    """
+    The type of the resource at path.
+    """
+    path = path.split('?', 1)[0]
+    for name, pattern in RESOURCE_TYPES:
+        if pattern.search(path):
+            return name
+    return 'other'
+
+
+def expand(href, rng, seen):
+    """
+    href with its template filled in, None if it cannot be.
+    """
+    if '{?q}' in href:
+        return href.replace('{?q}', '?q=%s' % rng.choice(WORDS))
+    if '{?uri*}' in href:
+        if not seen:
+            return None
+        uris = rng.sample(seen, min(3, len(seen)))
+        return href.replace('{?uri*}', '?' + '&'.join(
+            ['uri=%s' % quote(uri, safe='') for uri in uris]))
+    return None
+
+
+def candidate_links(document, base, rng, seen):
+    """
+    The (rel, path) pairs the crawler may follow from document:
+    its links and the self links of its embedded entities, on
+    this server, and the revisions of a tiddler.
+    """
+    candidates = []
+    href = document.get('_links', {}).get('self', {}).get('href', '')
+    if href.startswith(base) and resource_type(href[len(base):]) == 'tiddler':
+        candidates.append(('tiddlyweb:revisions',
+            href[len(base):].split('?', 1)[0] + '/revisions'))
+    for rel, links in document.get('_links', {}).items():
+        if rel in SKIPPED_RELS:
+            continue
+        if not isinstance(links, list):
+            links = [links]
+        for link in links:
+            href = link.get('href', '')
+            if link.get('templated'):
+                href = expand(href, rng, seen)
+            if href and href.startswith(base):
+                candidates.append((rel, href[len(base):]))
+
+    for rel, entities in document.get('_embedded', {}).items():
+        if not isinstance(entities, list):
+            entities = [entities]
+        for entity in entities:
+            href = entity.get('_links', {}).get('self', {}).get('href', '')
+            if href.startswith(base):
+                candidates.append((rel, href[len(base):]))
+                if rel == 'tiddlyweb:tiddler' and len(seen) < 1000:
+                    seen.append(href[len(base):])
+    return candidates
+
+
+def crawl(client, base, budget, rng, records):
+    """
+    Walk from the root until the budget is spent, adding a record
+    of (rel, type, seconds, status, bytes) for each request.
+    """
+    seen = []
+    rel, path = 'root', '/'
+    while budget.take():
+        started = time.time()
+        try:
+            status, headers, body = client.get(path)
+        except Exception, exc:
+            print >> sys.stderr, 'error getting %s: %s' % (path, exc)
+            status, headers, body = 599, {}, ''
+        elapsed = time.time() - started
+        records.append((rel, resource_type(path), elapsed, status,
+            len(body)))
+
+        candidates = []
+        if status == 200 and rng.random() > RESTART:
+            if headers.get('content-encoding') == 'gzip':
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            try:
+                candidates = candidate_links(json.loads(body), base, rng,
+                        seen)
+            except ValueError:
+                pass
+        if candidates:
+            rel, path = rng.choice(candidates)
+        else:
+            rel, path = 'root', '/'
+
+
+def percentile(ordered, percent):
+    """
+    The nearest rank percentile of the ordered values.
+    """
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[max(rank - 1, 0)]
+
+
+def summarize(records, elapsed):
+    """
+    Throughput and latency, in ms, of records.
+    """
+    latencies = sorted([record[2] * 1000 for record in records])
+    return {
+        'requests': len(records),
+        'errors': len([record for record in records if record[3] >= 400]),
+        'throughput': len(records) / elapsed,
+        'mean': sum(latencies) / len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'bytes': sum([record[4] for record in records]) / len(records),
+    }
+
+
+def grouped(records, index):
+    """
+    records grouped by the field at index.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(record[index], []).append(record)
+    return groups
+
+
+def report(records, elapsed):
+    """
+    The summary of all records, then by rel and by resource type.
+    """
+    return {
+        'elapsed': elapsed,
+        'total': summarize(records, elapsed),
+        'rels': dict([(rel, summarize(group, elapsed))
+            for rel, group in grouped(records, 0).items()]),
+        'types': dict([(name, summarize(group, elapsed))
+            for name, group in grouped(records, 1).items()]),
+    }
+
+
+def print_table(results):
+    """
+    Print results as tables.
+    """
+    row = '%-24s %8s %6s %9s %8s %8s %8s %8s %9s'
+    total = results['total']
+    print 'requests %s in %.2fs, %.1f req/s, %s errors' % (
+            total['requests'], results['elapsed'], total['throughput'],
+            total['errors'])
+    for heading in ['rels', 'types']:
+        print
+        print row % (heading[:-1], 'requests', 'errors', 'req/s',
+                'mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'bytes')
+        for name, summary in sorted(results[heading].items(),
+                key=lambda item: -item[1]['requests']):
+            print row % (name, summary['requests'], summary['errors'],
+                    '%.1f' % summary['throughput'],
+                    '%.2f' % summary['mean'], '%.2f' % summary['p50'],
+                    '%.2f' % summary['p95'], '%.2f' % summary['p99'],
+                    '%d' % summary['bytes'])
+
+
+def config_value(value):
+    """
+    A --set value as JSON, or as the string if it is not JSON.
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--workers', type='int', default=8,
+            help='concurrent crawlers')
+    parser.add_option('--requests', type='int', default=2000,
+            help='requests to make in all, 0 for no limit')
+    parser.add_option('--duration', type='float', default=0,
+            help='seconds to run for, 0 for no limit')
+    parser.add_option('--socket', action='store_true', default=False,
+            help='serve the app on a local socket instead of in process')
+    parser.add_option('--port', type='int', default=0,
+            help='port for --socket, default any free port')
+    parser.add_option('--store', default='crawl_store',
+            help='directory of the synthetic store')
+    parser.add_option('--rebuild', action='store_true', default=False,
+            help='make the store again even if it is there')
+    parser.add_option('--bags', type='int', default=10)
+    parser.add_option('--tiddlers', type='int', default=100,
+            help='tiddlers in each bag')
+    parser.add_option('--revisions', type='int', default=20,
+            help='revisions of every %sth tiddler' % REVISED_EVERY)
+    parser.add_option('--gzip', action='store_true', default=False,
+            help='accept gzip encoded responses')
+    parser.add_option('--set', action='append', default=[],
+            dest='settings', help='name=value to set in config')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--output', default=None,
+            help='file for the JSON results, default a table on stdout')
+    options, _ = parser.parse_args()
+    if not (options.requests or options.duration):
+        parser.error('one of --requests or --duration is needed')
+
+    config['log_level'] = 'WARNING'
+    for setting in options.settings:
+        name, _, value = setting.partition('=')
+        config[name] = config_value(value)
+    config.setdefault('hal.binary_links', True)
+    if 'tiddlywebplugins.hal' not in config['system_plugins']:
+        config['system_plugins'].append('tiddlywebplugins.hal')
+    prepare_store(options)
+
+    headers = {'Accept': ACCEPT}
+    if options.gzip:
+        headers['Accept-Encoding'] = 'gzip'
+
+    host = '127.0.0.1'
+    server = None
+    if options.socket:
+        server = make_server(host, options.port, None,
+                server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+        port = server.server_port
+    else:
+        port = 8080
+    config['server_host'] = {'scheme': 'http', 'host': host,
+            'port': str(port)}
+    app = load_app()
+    if server:
+        server.set_app(app)
+        threading.Thread(target=server.serve_forever).start()
+    base = 'http://%s:%s' % (host, port)
+
+    budget = Budget(options.requests or None, options.duration)
+    records = [[] for _ in range(options.workers)]
+    workers = []
+    for index in range(options.workers):
+        if options.socket:
+            client = SocketClient(host, port, headers)
+        else:
+            client = InProcessClient(app, host, port, headers)
+        rng = random.Random(options.seed + index)
+        workers.append(threading.Thread(target=crawl,
+            args=(client, base, budget, rng, records[index])))
+
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+    if server:
+        server.shutdown()
+
+    results = report(sum(records, []), elapsed)
+    unvisited = [name for name, _ in RESOURCE_TYPES
+            if name not in results['types']]
+    if unvisited:
+        print >> sys.stderr, 'warning: no requests for %s' % ', '.join(
+                unvisited)
+    results.update({
+        'unvisited': unvisited,
+        'python': platform.python_version(),
+        'workers': options.workers,
+        'socket': options.socket,
+        'gzip': options.gzip,
+        'settings': options.settings,
+        'store': {'bags': options.bags, 'tiddlers': options.tiddlers,
+            'revisions': options.revisions},
+    })
+    if options.output:
+        with open(options.output, 'w') as output:
+            output.write(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Test getting many resources in one request.
+"""
+
+import shutil
+import json
+
+from urllib import urlencode
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import StoreError
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal import batch
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('bag0'))
+    bag = Bag('private')
+    bag.policy.read = ['cdent']
+    module.store.put(bag)
+    recipe = Recipe('recipe0')
+    recipe.set_recipe([('bag0', '')])
+    module.store.put(recipe)
+    tiddler = Tiddler('tiddler one', 'bag0')
+    tiddler.text = 'one'
+    module.store.put(tiddler)
+    tiddler.text = 'one again'
+    module.store.put(tiddler)
+
+
+def _get(uri, headers=None):
+    request_headers = {'Accept': 'application/hal+json'}
+    request_headers.update(headers or {})
+    response, content = http.request(uri, headers=request_headers)
+    return response, content
+
+
+def _batch(uris):
+    response, content = _get('http://0.0.0.0:8080/batch?%s'
+            % urlencode([('uri', uri) for uri in uris]))
+    assert response['status'] == '200', content
+    return json.loads(content)['_embedded']
+
+
+def test_batch_matches_single():
+    uris = ['http://0.0.0.0:8080/bags/bag0',
+            '/recipes/recipe0',
+            'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler%20one',
+            '/recipes/recipe0/tiddlers/tiddler%20one',
+            '/bags/bag0/tiddlers/tiddler%20one/revisions/1']
+    embedded = _batch(uris)
+
+    for rel, uri, index in [('tiddlyweb:bag', uris[0], 0),
+            ('tiddlyweb:recipe', uris[1], 0),
+            ('tiddlyweb:tiddler', uris[2], 0),
+            ('tiddlyweb:tiddler', uris[3], 1),
+            ('tiddlyweb:revision', uris[4], 0)]:
+        if uri.startswith('/'):
+            uri = 'http://0.0.0.0:8080' + uri
+        response, content = _get(uri)
+        assert response['status'] == '200', content
+        assert embedded[rel][index] == json.loads(content)
+
+    assert embedded['tiddlyweb:revision'][0]['text'] == 'one'
+
+
+def test_batch_errors():
+    embedded = _batch(['/bags/missing', '/bags/private', '/search',
+        '/bags/bag0'])
+    errors = embedded['tiddlyweb:error']
+    assert [error['status'] for error in errors] == [404, 401, 404]
+    assert errors[0]['uri'] == '/bags/missing'
+    assert embedded['tiddlyweb:bag'][0]['name'] == 'bag0'
+
+
+def test_batch_item_query():
+    embedded = _batch(['/bags/bag0/tiddlers/tiddler%20one?fields=title',
+        'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler%20one'])
+    sparse, full = embedded['tiddlyweb:tiddler']
+    assert sorted(sparse.keys()) == ['_links', 'title']
+    assert full['text'] == 'one again'
+
+
+def test_batch_foreign_and_store_errors():
+    def broken(environ):
+        raise StoreError('broken store')
+
+    get_recipe = batch._get_recipe
+    batch._get_recipe = broken
+    try:
+        embedded = _batch(['http://example.com/bags/bag0', '/recipes/recipe0',
+            '/bags/bag0'])
+    finally:
+        batch._get_recipe = get_recipe
+    errors = embedded['tiddlyweb:error']
+    assert [error['status'] for error in errors] == [400, 500]
+    assert 'broken store' in errors[1]['message']
+    assert embedded['tiddlyweb:bag'][0]['name'] == 'bag0'
+
+
+def test_batch_limits():
+    response, content = _get('http://0.0.0.0:8080/batch')
+    assert response['status'] == '400'
+
+    config['hal.batch_limit'] = 2
+    try:
+        response, content = _get('http://0.0.0.0:8080/batch?%s'
+                % urlencode([('uri', '/bags/bag0')] * 3))
+    finally:
+        del config['hal.batch_limit']
+    assert response['status'] == '400'
+
+
+def test_root_links_batch():
+    response, content = _get('http://0.0.0.0:8080/')
+    info = json.loads(content)
+    assert (info['_links']['tiddlyweb:batch']['href']
+            == 'http://0.0.0.0:8080/batch{?uri*}')
+    assert info['_links']['tiddlyweb:batch']['templated']
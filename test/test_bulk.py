@@ -0,0 +1,144 @@
+"""
+Test writing tiddlers in bulk.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS, StoreError
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('bag0'))
+    bag = Bag('locked')
+    bag.policy.create = ['NONE']
+    module.store.put(bag)
+    tiddler = Tiddler('existing', 'locked')
+    tiddler.text = 'old'
+    module.store.put(tiddler)
+
+
+def _post(uri, document, content_type='application/hal+json'):
+    return http.request(uri, method='POST',
+            headers={'Content-Type': content_type,
+                'Accept': 'application/hal+json'},
+            body=json.dumps(document))
+
+
+def test_bulk_write():
+    tiddlers = [{'title': 'tiddler%s' % i, 'text': 'text %s' % i,
+        'tags': ['bulk']} for i in range(5)]
+    tiddlers.insert(2, {'text': 'no title'})
+    response, content = _post('http://0.0.0.0:8080/bags/bag0/tiddlers',
+            {'_embedded': {'tiddlyweb:tiddler': tiddlers}})
+    assert response['status'] == '200', content
+    assert 'application/hal+json' in response['content-type']
+
+    info = json.loads(content)
+    assert info['written'] == 5
+    assert info['failed'] == 1
+    assert (info['_links']['self']['href']
+            == 'http://0.0.0.0:8080/bags/bag0/tiddlers')
+    results = info['_embedded']['tiddlyweb:tiddler']
+    assert len(results) == 6
+    assert results[2]['status'] == 400
+    assert results[0]['title'] == 'tiddler0'
+    assert results[0]['status'] == 204
+    assert (results[0]['_links']['self']['href']
+            == 'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler0')
+    assert results[0]['etag']
+
+    tiddler = store.get(Tiddler('tiddler3', 'bag0'))
+    assert tiddler.text == 'text 3'
+    assert tiddler.tags == ['bulk']
+    assert tiddler.modifier == 'GUEST'
+
+
+def test_bulk_policy():
+    response, content = _post('http://0.0.0.0:8080/bags/locked/tiddlers',
+            {'_embedded': {'tiddlyweb:tiddler': [
+                {'title': 'existing', 'text': 'new'},
+                {'title': 'other', 'text': 'other'}]}})
+    assert response['status'] == '200', content
+    results = json.loads(content)['_embedded']['tiddlyweb:tiddler']
+    assert results[0]['status'] == 204
+    assert results[1]['status'] == 403
+    assert store.get(Tiddler('existing', 'locked')).text == 'new'
+
+
+def test_bulk_errors():
+    response, content = _post('http://0.0.0.0:8080/bags/bag0/tiddlers',
+            {'tiddlers': []})
+    assert response['status'] == '400'
+
+    response, content = _post('http://0.0.0.0:8080/bags/nobag/tiddlers',
+            {'_embedded': {'tiddlyweb:tiddler': []}})
+    assert response['status'] == '404'
+
+    response, content = _post('http://0.0.0.0:8080/bags/bag0/tiddlers',
+            {'_embedded': {'tiddlyweb:tiddler': []}}, 'text/plain')
+    assert response['status'] == '415'
+
+
+def test_bulk_bad_members():
+    response, content = _post('http://0.0.0.0:8080/bags/bag0/tiddlers',
+            {'_embedded': {'tiddlyweb:tiddler': [
+                {'title': 'badtags', 'tags': 'one two'},
+                {'title': 'badfields', 'fields': {'count': 1}},
+                {'title': 'badtext', 'text': ['one']},
+                {'title': 'good', 'text': 'good'}]}})
+    assert response['status'] == '200', content
+    info = json.loads(content)
+    results = info['_embedded']['tiddlyweb:tiddler']
+    assert [result['status'] for result in results] == [400, 400, 400, 204]
+    assert 'tags' in results[0]['message']
+    assert info['written'] == 1
+    assert store.get(Tiddler('good', 'bag0')).text == 'good'
+
+
+def test_bulk_store_error():
+    def failing_put(store, tiddler):
+        if tiddler.title == 'failing':
+            raise StoreError('store failed')
+    HOOKS['tiddler']['put'].append(failing_put)
+    try:
+        response, content = _post('http://0.0.0.0:8080/bags/bag0/tiddlers',
+                {'_embedded': {'tiddlyweb:tiddler': [
+                    {'title': 'failing', 'text': 'one'},
+                    {'title': 'after', 'text': 'two'}]}})
+    finally:
+        HOOKS['tiddler']['put'].remove(failing_put)
+    assert response['status'] == '200', content
+    results = json.loads(content)['_embedded']['tiddlyweb:tiddler']
+    assert results[0]['status'] == 500
+    assert 'store failed' in results[0]['message']
+    assert results[1]['status'] == 204
@@ -0,0 +1,161 @@
+"""
+Test the HAL collection response cache.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal.cache import (CACHE, HalCache, ResponseCache,
+        _invalidate)
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    config['hal.cache_size'] = 10
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('bag0'))
+    module.store.put(Bag('bag1'))
+    for i in range(3):
+        tiddler = Tiddler('tiddler%s' % i, 'bag0')
+        tiddler.text = 'text%s' % i
+        module.store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('hal.cache_size', None)
+    config['server_request_filters'].remove(HalCache)
+    for entity in ['bag', 'recipe', 'tiddler']:
+        for method in ['put', 'delete']:
+            HOOKS[entity][method].remove(_invalidate)
+    CACHE.clear()
+
+
+def _get(uri, headers=None):
+    request_headers = {'Accept': 'application/hal+json'}
+    request_headers.update(headers or {})
+    return http.request(uri, headers=request_headers)
+
+
+def test_hit_and_invalidate():
+    CACHE.clear()
+    hits = CACHE.stats['hits']
+
+    response, first = _get('http://0.0.0.0:8080/bags/bag0/tiddlers')
+    assert response['status'] == '200', first
+    response, second = _get('http://0.0.0.0:8080/bags/bag0/tiddlers')
+    assert response['status'] == '200', second
+    assert 'application/hal+json' in response['content-type']
+    assert second == first
+    assert CACHE.stats['hits'] == hits + 1
+
+    etag = response['etag']
+    cache_control = response['cache-control']
+    response, _ = _get('http://0.0.0.0:8080/bags/bag0/tiddlers',
+            {'If-None-Match': etag})
+    assert response['status'] == '304'
+    assert response['etag'] == etag
+    assert response['cache-control'] == cache_control
+
+    for header in ['"other", %s' % etag, 'W/%s' % etag, '*']:
+        response, _ = _get('http://0.0.0.0:8080/bags/bag0/tiddlers',
+                {'If-None-Match': header})
+        assert response['status'] == '304', header
+
+    response, _ = _get('http://0.0.0.0:8080/bags/bag0/tiddlers',
+            {'If-None-Match': '"other", W/"another"'})
+    assert response['status'] == '200'
+
+    tiddler = Tiddler('tiddler3', 'bag0')
+    store.put(tiddler)
+
+    response, third = _get('http://0.0.0.0:8080/bags/bag0/tiddlers')
+    info = json.loads(third)
+    assert len(info['_embedded']['tiddlyweb:tiddler']) == 4
+
+
+def test_other_bag_untouched():
+    CACHE.clear()
+    _get('http://0.0.0.0:8080/bags/bag0/tiddlers')
+    _get('http://0.0.0.0:8080/bags')
+    invalidations = CACHE.stats['invalidations']
+
+    store.put(Tiddler('other', 'bag1'))
+    assert CACHE.stats['invalidations'] == invalidations
+
+    store.put(Bag('bag2'))
+    assert CACHE.stats['invalidations'] == invalidations + 1
+    response, content = _get('http://0.0.0.0:8080/bags')
+    info = json.loads(content)
+    assert len(info['_embedded']['tiddlyweb:bag']) == 3
+
+
+def test_type_in_key():
+    CACHE.clear()
+    response, content = _get('http://0.0.0.0:8080/bags')
+    assert 'application/hal+json' in response['content-type']
+    hits, misses = CACHE.stats['hits'], CACHE.stats['misses']
+    response, content = http.request('http://0.0.0.0:8080/bags',
+            headers={'Accept': 'application/json'})
+    assert 'application/json' in response['content-type']
+    assert CACHE.stats['hits'] == hits
+    assert CACHE.stats['misses'] == misses
+
+
+def test_encoded_bag_name():
+    store.put(Bag(u'b\u00e4g'))
+    store.put(Tiddler(u't\u00efddler', u'b\u00e4g'))
+    for _ in range(2):
+        response, content = _get(
+                'http://0.0.0.0:8080/bags/b%C3%A4g/tiddlers')
+        assert response['status'] == '200', content
+        info = json.loads(content)
+        assert (info['_embedded']['tiddlyweb:tiddler'][0]['title']
+                == u't\u00efddler')
+
+    store.put(Tiddler('another', u'b\u00e4g'))
+    response, content = _get('http://0.0.0.0:8080/bags/b%C3%A4g/tiddlers')
+    info = json.loads(content)
+    assert len(info['_embedded']['tiddlyweb:tiddler']) == 2
+
+
+def test_eviction():
+    cache = ResponseCache(2)
+    for key in ['one', 'two', 'three']:
+        cache.put(key, ['bags'], ('200 OK', [], key), cache.generation)
+    assert cache.get('one') is None
+    assert cache.get('three')[2] == 'three'
+    assert cache.stats['evictions'] == 1
+
+    generation = cache.generation
+    cache.invalidate(['bags'])
+    cache.put('four', ['bags'], ('200 OK', [], 'four'), generation)
+    assert cache.get('four') is None
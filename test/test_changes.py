@@ -0,0 +1,175 @@
+"""
+Test the since change feed on tiddler collections.
+"""
+
+import shutil
+import json
+
+import py.test
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal.changes import (INDEX, changed, init_index,
+        parse_since, since_token)
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    for name in ['bag0', 'bag1']:
+        module.store.put(Bag(name))
+        for year in ['2020', '2021', '2022']:
+            _put(name, 'tiddler%s' % year, '%s0101000000' % year)
+
+
+def teardown_module(module):
+    config.pop('hal.since_index', None)
+    HOOKS['tiddler']['put'].remove(INDEX.put)
+    HOOKS['tiddler']['delete'].remove(INDEX.delete)
+    HOOKS['bag']['delete'].remove(INDEX.delete)
+    INDEX.clear()
+
+
+def _put(bag, title, modified):
+    tiddler = Tiddler(title, bag)
+    tiddler.text = title
+    tiddler.modified = modified
+    store.put(tiddler)
+
+
+def _changes(uri):
+    response, content = http.request(uri,
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    info = json.loads(content)
+    titles = sorted(tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler'])
+    return titles, info['_links']['next-sync']['href']
+
+
+def _sync(bag):
+    titles, next_sync = _changes(
+            'http://0.0.0.0:8080/bags/%s/tiddlers?since=2021' % bag)
+    assert titles == ['tiddler2021', 'tiddler2022']
+    assert next_sync.startswith(
+            'http://0.0.0.0:8080/bags/%s/tiddlers?since=' % bag)
+
+    titles, next_sync = _changes(next_sync)
+    assert titles == []
+
+    _put(bag, 'tiddler2022b', '20220101000000')
+    _put(bag, 'tiddler2023', '20230101000000')
+    titles, next_sync = _changes(next_sync)
+    assert titles == ['tiddler2022b', 'tiddler2023']
+
+    titles, next_sync = _changes(next_sync)
+    assert titles == []
+
+
+def test_since_scan():
+    _sync('bag0')
+
+
+def test_since_index():
+    config['hal.since_index'] = True
+    init_index(config)
+    _sync('bag1')
+
+    store.delete(Tiddler('tiddler2023', 'bag1'))
+    assert INDEX.modified(store, Tiddler('tiddler2023', 'bag1')) is None
+
+
+def test_no_since():
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag0/tiddlers',
+            headers={'Accept': 'application/hal+json'})
+    info = json.loads(content)
+    assert 'next-sync' not in info['_links']
+    assert len(info['_embedded']['tiddlyweb:tiddler']) == 5
+
+
+def test_since_paged():
+    uri = 'http://0.0.0.0:8080/bags/bag0/tiddlers?since=2021&page_size=2'
+    titles = []
+    while True:
+        response, content = http.request(uri,
+                headers={'Accept': 'application/hal+json'})
+        info = json.loads(content)
+        titles.extend(tiddler['title']
+                for tiddler in info['_embedded']['tiddlyweb:tiddler'])
+        if 'next' not in info['_links']:
+            break
+        assert 'next-sync' not in info['_links']
+        uri = info['_links']['next']['href']
+    assert sorted(titles) == ['tiddler2021', 'tiddler2022', 'tiddler2022b',
+            'tiddler2023']
+
+    titles, next_sync = _changes(info['_links']['next-sync']['href'])
+    assert titles == []
+
+
+def test_bad_since():
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag0/tiddlers?since=yesterday',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '400'
+
+
+def test_parse_since():
+    assert parse_since('2021') == ('20210000000000', frozenset())
+    token = since_token('20210101000000', [('bag0', 'tiddler2021')])
+    assert parse_since(token) == ('20210101000000',
+            frozenset([('bag0', 'tiddler2021')]))
+    py.test.raises(ValueError, 'parse_since("not a token")')
+
+
+def test_many_sent_digested():
+    members = [Tiddler('bulk%s' % i, 'bulk') for i in range(200)]
+    modified = dict([(member.title, '20240101000000') for member in members])
+
+    def member_modified(member):
+        return modified[member.title]
+
+    selected, token = changed(members, parse_since('2024'), member_modified)
+    assert len(selected) == 200
+    assert len(token) < 100
+    timestamp, sent = parse_since(token)
+    assert sent == (200, sent[1])
+
+    selected, token = changed(members, (timestamp, sent), member_modified)
+    assert selected == []
+
+    members.append(Tiddler('late', 'bulk'))
+    modified['late'] = '20240101000000'
+    selected, token = changed(members, (timestamp, sent), member_modified)
+    assert len(selected) == 201
+
+    selected, _ = changed(members, parse_since(token), member_modified)
+    assert selected == []
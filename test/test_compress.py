@@ -0,0 +1,191 @@
+"""
+Test compressed HAL responses and the compressed bodies kept for
+the root and cached collections.
+"""
+
+import shutil
+import json
+import zlib
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal import compress
+from tiddlywebplugins.hal.cache import CACHE, HalCache, _invalidate
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    config['hal.compress'] = True
+    config['hal.cache_size'] = 10
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('squeeze'))
+    for i in range(50):
+        tiddler = Tiddler('tiddler%s' % i, 'squeeze')
+        tiddler.text = 'text %s' % i
+        module.store.put(tiddler)
+
+
+def teardown_module(module):
+    del config['hal.compress']
+    del config['hal.cache_size']
+    config.pop('hal.stream', None)
+    config['server_request_filters'].remove(compress.HalCompress)
+    config['server_request_filters'].remove(HalCache)
+    for entity in ['bag', 'recipe', 'tiddler']:
+        for method in ['put', 'delete']:
+            HOOKS[entity][method].remove(_invalidate)
+    CACHE.clear()
+
+
+def _get(uri, encoding, headers=None):
+    request_headers = {'Accept': 'application/hal+json',
+            'Accept-Encoding': encoding}
+    request_headers.update(headers or {})
+    return http.request(uri, headers=request_headers)
+
+
+def test_root_compressed():
+    response, plain = _get('http://0.0.0.0:8080/', 'identity')
+    assert response['status'] == '200', plain
+    assert '-content-encoding' not in response
+    plain_etag = response['etag']
+
+    response, content = _get('http://0.0.0.0:8080/', 'gzip')
+    assert response['status'] == '200', content
+    assert response['-content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response['vary']
+    assert response['etag'] == plain_etag[:-1] + '-gzip"'
+    assert json.loads(content) == json.loads(plain)
+
+    response, content = _get('http://0.0.0.0:8080/', 'gzip',
+            {'If-None-Match': response['etag']})
+    assert response['status'] == '304'
+    assert response['etag'].endswith('-gzip"')
+
+    response, content = _get('http://0.0.0.0:8080/', 'identity',
+            {'If-None-Match': plain_etag})
+    assert response['status'] == '304'
+
+
+def test_cached_collection_compressed():
+    CACHE.clear()
+    uri = 'http://0.0.0.0:8080/bags/squeeze/tiddlers'
+    response, plain = _get(uri, 'identity')
+    assert response['status'] == '200', plain
+
+    hits = CACHE.stats['hits']
+    response, content = _get(uri, 'gzip')
+    assert response['status'] == '200', content
+    assert response['-content-encoding'] == 'gzip'
+    assert CACHE.stats['hits'] == hits + 1
+    assert json.loads(content) == json.loads(plain)
+
+    encoded = [entry[1][3] for entry in CACHE._entries.values()]
+    assert 'gzip' in encoded[0]
+
+    response, content = _get(uri, 'gzip')
+    assert json.loads(content) == json.loads(plain)
+
+
+def test_streamed_compressed():
+    config['hal.stream'] = True
+    try:
+        uri = 'http://0.0.0.0:8080/bags/squeeze/tiddlers?fat=1'
+        response, plain = _get(uri, 'identity')
+        response, content = _get(uri, 'gzip;q=0.5, identity;q=0.1')
+    finally:
+        config.pop('hal.stream', None)
+    assert response['status'] == '200', content
+    assert response['-content-encoding'] == 'gzip'
+    info = json.loads(content)
+    assert info == json.loads(plain)
+    assert len(info['_embedded']['tiddlyweb:tiddler']) == 50
+
+
+def test_streamed_first_chunk_flushed():
+    made = []
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/hal+json')])
+
+        def chunks():
+            for index in range(3):
+                made.append(index)
+                yield '{"chunk": %s}' % index
+        return chunks()
+
+    environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip',
+            'tiddlyweb.config': {'hal.compress': True}}
+    output = iter(compress.HalCompress(app)(environ, lambda *args: None))
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(next(output)) == '{"chunk": 0}'
+    assert made == [0]
+
+    body = ''.join(output)
+    assert made == [0, 1, 2]
+    assert decompressor.decompress(body) == '{"chunk": 1}{"chunk": 2}'
+
+
+def test_strip_if_none_match():
+    environ = {'HTTP_IF_NONE_MATCH': '"abc-gzip", W/"def-gzip", "ghi"'}
+    assert compress._strip_if_none_match(environ, 'gzip')
+    assert environ['HTTP_IF_NONE_MATCH'] == '"abc", W/"def", "ghi"'
+    assert not compress._strip_if_none_match(environ, 'br')
+
+
+def test_not_hal_not_compressed():
+    response, content = http.request('http://0.0.0.0:8080/bags/squeeze',
+            headers={'Accept': 'application/json',
+                'Accept-Encoding': 'gzip'})
+    assert response['status'] == '200', content
+    assert '-content-encoding' not in response
+
+
+def test_negotiate():
+    environ = {'tiddlyweb.config': {'hal.compress': True}}
+    for accept_encoding, expected in [
+            ('', None),
+            ('gzip', 'gzip'),
+            ('gzip;q=0', None),
+            ('deflate, identity', None),
+            ('*;q=0.2, gzip;q=0',
+                'br' if compress.available('br') else None),
+            ('br;q=1.0, gzip;q=0.8',
+                'br' if compress.available('br') else 'gzip')]:
+        environ['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        assert compress.negotiate(environ) == expected, accept_encoding
+
+    environ['tiddlyweb.config'] = {}
+    environ['HTTP_ACCEPT_ENCODING'] = 'gzip'
+    assert compress.negotiate(environ) is None
+
+
+def test_encoded_etag():
+    assert compress.encoded_etag('"abc:def"', 'br') == '"abc:def-br"'
@@ -0,0 +1,125 @@
+"""
+Test the delta profile for revision collections.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal.serialization import DELTA_PROFILE, _text_delta
+
+
+REVISIONS_URI = 'http://0.0.0.0:8080/bags/deltabag/tiddlers/history/revisions'
+
+TEXTS = [
+        'one\ntwo\nthree\nfour\n',
+        'one\ntwo\nthree and a bit\nfour\n',
+        'zero\none\ntwo\nthree and a bit\nfour\nfive',
+        'zero\none\ntwo\nthree and a bit\nfour\nfive',
+]
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('deltabag'))
+    for index, text in enumerate(TEXTS):
+        tiddler = Tiddler('history', 'deltabag')
+        tiddler.text = text
+        tiddler.tags = ['last'] if index == len(TEXTS) - 1 else []
+        module.store.put(tiddler)
+
+
+def _get(uri, accept='application/hal+json'):
+    response, content = http.request(uri, headers={'Accept': accept})
+    assert response['status'] == '200', content
+    return json.loads(content)
+
+
+def _apply(text, text_delta):
+    lines = text.splitlines(True)
+    for start, end, replacement in reversed(text_delta):
+        lines[start:end] = [replacement]
+    return ''.join(lines)
+
+
+def test_text_delta():
+    for old in TEXTS + ['']:
+        for new in TEXTS + ['']:
+            assert _apply(old, _text_delta(old, new)) == new
+    assert _text_delta(TEXTS[0], TEXTS[1]) == [[2, 3, 'three and a bit\n']]
+
+
+def test_delta_revisions():
+    info = _get(REVISIONS_URI + '?delta=1')
+    assert info['_links']['profile']['href'] == DELTA_PROFILE
+    revisions = info['_embedded']['tiddlyweb:revision']
+    assert len(revisions) == 4
+
+    full = _get(REVISIONS_URI + '?fat=1')['_embedded']['tiddlyweb:revision']
+    assert revisions[0] == full[0]
+    assert revisions[0]['text'] == TEXTS[-1]
+
+    text = revisions[0]['text']
+    tags = revisions[0]['tags']
+    for delta, whole in zip(revisions[1:], full[1:]):
+        assert delta['_links']['self'] == whole['_links']['self']
+        assert delta['revision'] == whole['revision']
+        assert 'text' not in delta
+        assert 'bag' not in delta
+        text = _apply(text, delta.get('text_delta', []))
+        tags = delta.get('tags', tags)
+        assert text == whole['text']
+        assert tags == whole['tags']
+
+    # The two newest revisions have the same text.
+    assert 'text_delta' not in revisions[1]
+    assert revisions[1]['tags'] == []
+
+
+def test_delta_profile_accept():
+    info = _get(REVISIONS_URI, 'application/hal+json; '
+            'profile="http://tiddlyweb.com/profiles/delta"')
+    revisions = info['_embedded']['tiddlyweb:revision']
+    assert 'text' in revisions[0]
+    assert 'text_delta' in revisions[2]
+
+
+def test_delta_compact():
+    info = _get(REVISIONS_URI + '?delta=1&compact=1')
+    profiles = [profile['href'] for profile in info['_links']['profile']]
+    assert DELTA_PROFILE in profiles
+    assert '_links' not in info['_embedded']['tiddlyweb:revision'][1]
+
+
+def test_delta_only_revisions():
+    info = _get('http://0.0.0.0:8080/bags/deltabag/tiddlers?delta=1')
+    assert 'profile' not in info['_links']
+    assert 'text' not in info['_embedded']['tiddlyweb:tiddler'][0]
@@ -0,0 +1,148 @@
+"""
+Test the cached content negotiation and the HAL root sent ahead
+of the selector.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store, replace_handler
+
+from tiddlywebplugins.hal.dispatch import (NEGOTIATIONS, init_dispatch,
+        negotiate)
+
+
+def custom_root(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/html')])
+    return ['custom root']
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server, with
+    another handler for / as a plugin loaded later would add.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        app = load_app()
+        replace_handler(config['selector'], '/', dict(GET=custom_root))
+        return app
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('routes'))
+    tiddler = Tiddler('one', 'routes')
+    tiddler.text = 'one'
+    module.store.put(tiddler)
+
+
+def test_root_hal_and_replaced():
+    response, content = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    assert 'application/hal+json' in response['content-type']
+    assert 'tiddlyweb:bags' in json.loads(content)['_links']
+
+    response, content = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'text/html'})
+    assert response['status'] == '200', content
+    assert content == 'custom root'
+
+
+def test_negotiation_cached():
+    uri = 'http://0.0.0.0:8080/bags/routes/tiddlers/one'
+    headers = {'Accept': 'application/hal+json; q=0.9, text/plain; q=0.1'}
+    response, first = http.request(uri, headers=headers)
+    assert response['status'] == '200', first
+
+    hits = NEGOTIATIONS.stats['hits']
+    response, content = http.request(uri, headers=headers)
+    assert response['status'] == '200', content
+    assert NEGOTIATIONS.stats['hits'] == hits + 1
+    assert json.loads(content) == json.loads(first)
+
+
+def test_extension_cached():
+    for _ in range(2):
+        response, content = http.request(
+                'http://0.0.0.0:8080/bags/routes/tiddlers/one.hal')
+        assert response['status'] == '200', content
+        assert 'application/hal+json' in response['content-type']
+        assert json.loads(content)['title'] == 'one'
+
+
+def test_negotiate_same_as_figure_type():
+    environ = {'tiddlyweb.config': config, 'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/bags/routes/tiddlers/one.json',
+            'HTTP_ACCEPT': 'text/html'}
+    negotiate(environ)
+    first = dict(environ)
+    environ = dict(environ)
+    del environ['tiddlyweb.type']
+    del environ['tiddlyweb.extension']
+    negotiate(environ)
+    assert environ['tiddlyweb.type'] == first['tiddlyweb.type']
+    assert environ['tiddlyweb.extension'] == 'json'
+
+
+def test_unknown_extension_not_keyed():
+    environ = {'tiddlyweb.config': config, 'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/bags/routes/tiddlers/version.one',
+            'HTTP_ACCEPT': 'text/x-unknown-extension'}
+    negotiate(environ)
+    hits = NEGOTIATIONS.stats['hits']
+    other = dict(environ, PATH_INFO='/bags/routes/tiddlers/version.two')
+    negotiate(other)
+    assert NEGOTIATIONS.stats['hits'] == hits + 1
+    assert other['tiddlyweb.extension'] == 'two'
+    assert other['tiddlyweb.type'] == environ['tiddlyweb.type']
+
+
+def test_init_keeps_decisions():
+    environ = {'tiddlyweb.config': config, 'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/bags', 'HTTP_ACCEPT': 'text/plain'}
+    negotiate(environ)
+    init_dispatch(config)
+    hits = NEGOTIATIONS.stats['hits']
+    negotiate(dict(environ))
+    assert NEGOTIATIONS.stats['hits'] == hits + 1
+
+    config['serializers']['text/x-dispatch'] = ['text', 'text/plain']
+    try:
+        init_dispatch(config)
+        negotiate(dict(environ))
+        assert NEGOTIATIONS.stats['hits'] == hits + 1
+    finally:
+        del config['serializers']['text/x-dispatch']
+        init_dispatch(config)
+
+    negotiate(dict(environ))
+    hits = NEGOTIATIONS.stats['hits']
+    default_serializer = config['default_serializer']
+    config['default_serializer'] = 'application/json'
+    try:
+        init_dispatch(config)
+        negotiate(dict(environ))
+        assert NEGOTIATIONS.stats['hits'] == hits
+    finally:
+        config['default_serializer'] = default_serializer
+        init_dispatch(config)
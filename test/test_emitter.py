@@ -0,0 +1,164 @@
+"""
+Test that the direct emitter, and simplehal, the reference
+implementation, make the expected documents.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal.emitter import (document, reference_document,
+        link, CURIE)
+
+
+# The links of some documents, without the curie, and the self links
+# of the documents they embed, as simplehal made them before the
+# direct emitter, with the links added since.
+EXPECTED_LINKS = {
+    '/bags': ({
+        'self': '/bags',
+        'tiddlyweb:bag': '/bags/{bag}',
+    }, ['/bags/bag0', '/bags/bag1', '/bags/bag2']),
+    '/recipes/recipe0': ({
+        'self': '/recipes/recipe0',
+        'tiddlyweb:recipes': '/recipes',
+        'tiddlyweb:tiddlers': '/recipes/recipe0/tiddlers',
+    }, []),
+    '/bags/bag0/tiddlers': ({
+        'self': '/bags/bag0/tiddlers',
+        'tiddlyweb:bag': '/bags/bag0',
+        'tiddlyweb:tiddler': '/bags/bag0/tiddlers/{tiddler}',
+    }, ['/bags/bag0/tiddlers/tiddler0', '/bags/bag0/tiddlers/tiddler2',
+        '/bags/bag0/tiddlers/tiddler4']),
+    '/recipes/recipe0/tiddlers': ({
+        'self': '/recipes/recipe0/tiddlers',
+        'tiddlyweb:recipe': '/recipes/recipe0',
+        'tiddlyweb:tiddler': '/recipes/recipe0/tiddlers/{tiddler}',
+    }, ['/bags/bag0/tiddlers/tiddler0', '/bags/bag0/tiddlers/tiddler2',
+        '/bags/bag0/tiddlers/tiddler4', '/bags/bag1/tiddlers/tiddler1',
+        '/bags/bag1/tiddlers/tiddler3']),
+    '/bags/bag0/tiddlers/tiddler0': ({
+        'self': '/bags/bag0/tiddlers/tiddler0',
+        'collection': '/bags/bag0/tiddlers',
+        'tiddlyweb:bag': '/bags/bag0',
+        'tiddlyweb:tiddlers': '/bags/bag0/tiddlers',
+    }, []),
+    '/recipes/recipe0/tiddlers/tiddler1': ({
+        'self': '/bags/bag1/tiddlers/tiddler1',
+        'collection': '/recipes/recipe0/tiddlers',
+        'tiddlyweb:bag': '/bags/bag1',
+        'tiddlyweb:recipe': '/recipes/recipe0',
+        'tiddlyweb:tiddlers': '/recipes/recipe0/tiddlers',
+    }, []),
+    '/bags/bag0/tiddlers/tiddler0/revisions': ({
+        'self': '/bags/bag0/tiddlers/tiddler0/revisions',
+        'tiddlyweb:tiddler': '/bags/bag0/tiddlers/tiddler0',
+    }, ['/bags/bag0/tiddlers/tiddler0/revisions/1',
+        '/bags/bag0/tiddlers/tiddler0/revisions/2']),
+    '/bags/bag0/tiddlers/tiddler0/revisions/1': ({
+        'collection': '/bags/bag0/tiddlers/tiddler0/revisions',
+        'latest-version': '/bags/bag0/tiddlers/tiddler0',
+        'prev': '/bags/bag0/tiddlers/tiddler0/revisions/2',
+        'successor-version': '/bags/bag0/tiddlers/tiddler0/revisions/2',
+        'tiddlyweb:revisions': '/bags/bag0/tiddlers/tiddler0/revisions',
+        'tiddlyweb:tiddler': '/bags/bag0/tiddlers/tiddler0',
+    }, []),
+    '/search?q=text': ({}, ['/bags/bag0/tiddlers/tiddler2',
+        '/bags/bag0/tiddlers/tiddler4', '/bags/bag1/tiddlers/tiddler1',
+        '/bags/bag1/tiddlers/tiddler3']),
+}
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    for i in range(3):
+        module.store.put(Bag('bag%s' % i))
+    recipe = Recipe('recipe0')
+    recipe.set_recipe([('bag0', ''), ('bag1', '')])
+    module.store.put(recipe)
+    for i in range(5):
+        tiddler = Tiddler('tiddler%s' % i, 'bag%s' % (i % 2))
+        tiddler.text = 'text%s' % i
+        tiddler.tags = ['tag%s' % i]
+        tiddler.fields['field'] = 'value%s' % i
+        module.store.put(tiddler)
+    module.store.put(Tiddler('tiddler0', 'bag0'))
+
+
+def teardown_module(module):
+    config.pop('hal.emitter', None)
+
+
+def test_document_structure():
+    links = {'self': link('http://0.0.0.0:8080/bags'),
+            'tiddlyweb:bag': link('http://0.0.0.0:8080/bags/{bag}',
+                templated=True),
+            'curie': CURIE}
+    embed = {'tiddlyweb:bag': [document({'self': link('/bags/bag0')},
+        {'name': 'bag0'})]}
+
+    assert (document(dict(links), None, embed)
+            == reference_document(dict(links), None, embed))
+    assert (document(dict(links), {'name': 'bag0'})
+            == reference_document(dict(links), {'name': 'bag0'}))
+
+
+def test_expected_links():
+    for emitter in [None, 'simplehal']:
+        config['hal.emitter'] = emitter
+        for uri in sorted(EXPECTED_LINKS):
+            links, embedded = _links(uri)
+            assert links == EXPECTED_LINKS[uri][0], (emitter, uri)
+            assert embedded == EXPECTED_LINKS[uri][1], (emitter, uri)
+
+
+def _links(uri):
+    """
+    The links of the document at uri, without the server, and the
+    self links of its embedded documents, sorted.
+    """
+    response, content = http.request('http://0.0.0.0:8080' + uri,
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    assert info['_links'].pop('curie') == CURIE
+    links = {}
+    for rel, rel_link in info['_links'].items():
+        href = rel_link['href'].replace('http://0.0.0.0:8080', '')
+        assert rel_link.get('templated', False) == ('{' in href), uri
+        links[rel] = href
+    embedded = sorted([document['_links']['self']['href'].replace(
+        'http://0.0.0.0:8080', '')
+        for documents in info.get('_embedded', {}).values()
+        for document in documents])
+    return links, embedded
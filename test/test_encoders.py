@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Test that each available JSON encoder backend makes the same
+documents as the others.
+"""
+
+import shutil
+import json
+
+from base64 import b64encode
+
+import py.test
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal import emitter
+
+
+STRUCTURE = {
+        'title': u'tiddler é ☃  ',
+        'text': b64encode('\x89PNG\r\n\x1a\n\x00\x00'),
+        'fields': {u'clé': u'välue', 'nested': {'list': [1, 2.5, None,
+            True, {'deeper': [u'ü', '/slash/']}]}},
+        '_links': {'self': emitter.link('http://0.0.0.0:8080/bags/b%C3%A9')},
+}
+
+URIS = ['http://0.0.0.0:8080/bags/b%C3%A9g/tiddlers',
+        'http://0.0.0.0:8080/bags/b%C3%A9g/tiddlers/tiddler%20%C3%A9',
+        'http://0.0.0.0:8080/bags/b%C3%A9g/tiddlers/binary',
+        'http://0.0.0.0:8080/bags/b%C3%A9g/tiddlers/tiddler%20%C3%A9/'
+        'revisions',
+        'http://0.0.0.0:8080/bags']
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag(u'bég'))
+    tiddler = Tiddler(u'tiddler é', u'bég')
+    tiddler.text = u'☃ snow'
+    tiddler.tags = [u'tág', 'two words']
+    tiddler.fields[u'fïeld'] = u'välue'
+    module.store.put(tiddler)
+    tiddler = Tiddler('binary', u'bég')
+    tiddler.type = 'image/png'
+    tiddler.text = '\x89PNG\r\n\x1a\n\x00\x00\xff'
+    module.store.put(tiddler)
+
+
+def teardown_module(module):
+    emitter.set_encoder('json')
+
+
+def _available():
+    names = []
+    for name in sorted(emitter.ENCODERS):
+        try:
+            emitter.ENCODERS[name]()
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+
+def test_fallback():
+    assert emitter.set_encoder('nosuchencoder') == 'json'
+    assert emitter.set_encoder('auto') in _available()
+    emitter.set_encoder('json')
+
+
+def test_structure():
+    expected = json.loads(json.dumps(STRUCTURE))
+    for name in _available():
+        assert emitter.set_encoder(name) == name
+        output = emitter.to_json(STRUCTURE)
+        assert isinstance(output, str), name
+        assert json.loads(output) == expected, name
+    emitter.set_encoder('json')
+
+
+def test_documents():
+    if len(_available()) < 2:
+        py.test.skip('only one JSON encoder available')
+
+    documents = {}
+    for name in _available():
+        emitter.set_encoder(name)
+        for uri in URIS:
+            response, content = http.request(uri,
+                    headers={'Accept': 'application/hal+json'})
+            assert response['status'] == '200', content
+            documents.setdefault(uri, []).append((name, json.loads(content)))
+    emitter.set_encoder('json')
+
+    for uri in documents:
+        reference_name, reference = documents[uri][0]
+        for name, document in documents[uri][1:]:
+            assert document == reference, (uri, reference_name, name)
+
+    binary = documents[URIS[2]][0][1]
+    assert binary['text'] == b64encode('\x89PNG\r\n\x1a\n\x00\x00\xff')
@@ -0,0 +1,88 @@
+"""
+Test that HAL resources carry ETags and answer If-None-Match
+with a 304.
+"""
+
+import shutil
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+URIS = ['http://0.0.0.0:8080/bags',
+        'http://0.0.0.0:8080/recipes',
+        'http://0.0.0.0:8080/bags/bag0',
+        'http://0.0.0.0:8080/recipes/recipe0',
+        'http://0.0.0.0:8080/bags/bag0/tiddlers',
+        'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler0',
+        'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler0/revisions']
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('bag0'))
+    recipe = Recipe('recipe0')
+    recipe.set_recipe([('bag0', '')])
+    module.store.put(recipe)
+    tiddler = Tiddler('tiddler0', 'bag0')
+    tiddler.text = 'text0'
+    module.store.put(tiddler)
+
+
+def _get(uri, etag=None):
+    headers = {'Accept': 'application/hal+json'}
+    if etag:
+        headers['If-None-Match'] = etag
+    return http.request(uri, headers=headers)
+
+
+def test_not_modified():
+    for uri in URIS:
+        response, content = _get(uri)
+        assert response['status'] == '200', content
+        assert 'etag' in response, uri
+
+        response, content = _get(uri, response['etag'])
+        assert response['status'] == '304', uri
+
+
+def test_modified():
+    etags = dict([(uri, _get(uri)[0]['etag']) for uri in URIS])
+
+    tiddler = Tiddler('tiddler0', 'bag0')
+    tiddler.text = 'changed'
+    store.put(tiddler)
+
+    for uri in ['http://0.0.0.0:8080/bags/bag0/tiddlers',
+            'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler0',
+            'http://0.0.0.0:8080/bags/bag0/tiddlers/tiddler0/revisions']:
+        response, content = _get(uri, etags[uri])
+        assert response['status'] == '200', uri
+        assert response['etag'] != etags[uri]
@@ -0,0 +1,96 @@
+"""
+Test that embedded entities are encoded as they are made, rather
+than all kept as structures until the end.
+"""
+
+import gc
+import json
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Container, Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+
+from tiddlywebplugins.hal.serialization import Serialization
+
+# The most live objects gained, beyond the JSON, for each embedded
+# tiddler. Keeping each tiddler's structure would gain several.
+OBJECTS_PER_TIDDLER = 0.1
+
+
+def _environ(route):
+    return {
+        'tiddlyweb.config': config,
+        'tiddlyweb.query': {},
+        'wsgiorg.routing_args': ((), route),
+    }
+
+
+def _tiddlers(count):
+    tiddlers = Tiddlers(bag='bag0')
+    for i in range(count):
+        tiddler = Tiddler('tiddler%s' % i, 'bag0')
+        tiddler.text = 'text %s' % i
+        tiddler.tags = ['one', 'two']
+        tiddler.fields = {'field': 'value %s' % i}
+        tiddlers.add(tiddler)
+    return tiddlers
+
+
+def _recorder(calls, name, func):
+    def recorded(*args, **kwargs):
+        calls.append(name)
+        return func(*args, **kwargs)
+    return recorded
+
+
+def _record_calls(serialization, names):
+    calls = []
+    for name in names:
+        setattr(serialization, name,
+                _recorder(calls, name, getattr(serialization, name)))
+    return calls
+
+
+def test_tiddlers_encoded_as_made():
+    serialization = Serialization(_environ({'bag_name': 'bag0'}))
+    calls = _record_calls(serialization, ['_embedded_tiddler', '_to_json'])
+    output = serialization.list_tiddlers(_tiddlers(5))
+
+    assert len(json.loads(output)['_embedded']['tiddlyweb:tiddler']) == 5
+    # The skeleton, then each tiddler encoded before the next is made.
+    assert calls == ['_to_json'] + ['_embedded_tiddler', '_to_json'] * 5
+
+
+def test_entities_encoded_as_made():
+    bags = Container()
+    for i in range(3):
+        bags.add(Bag('bag%s' % i))
+    serialization = Serialization(_environ({}))
+    calls = _record_calls(serialization, ['_document', '_to_json'])
+    output = serialization.list_bags(bags)
+
+    assert len(json.loads(output)['_embedded']['tiddlyweb:bag']) == 3
+    assert calls == ['_document', '_to_json'] + ['_document',
+            '_to_json'] * 3
+
+
+def test_objects_per_tiddler():
+    count = 2000
+    tiddlers = _tiddlers(count)
+    serialization = Serialization(_environ({'bag_name': 'bag0'}))
+    embedded_tiddler = serialization._embedded_tiddler
+    live = []
+
+    def counted(*args, **kwargs):
+        if len(live) in [0, count - 1]:
+            gc.collect()
+            live.append(len(gc.get_objects()))
+        else:
+            live.append(None)
+        return embedded_tiddler(*args, **kwargs)
+    serialization._embedded_tiddler = counted
+    serialization.list_tiddlers(tiddlers)
+
+    assert len(live) == count
+    assert (live[-1] - live[0]) / float(count) < OBJECTS_PER_TIDDLER
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Test the newline delimited JSON form of HAL collections.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('ndbag'))
+    module.store.put(Bag('emptybag'))
+    for i in range(5):
+        tiddler = Tiddler(u'tiddler é %s' % i, 'ndbag')
+        tiddler.text = 'line one\nline two %s' % i
+        module.store.put(tiddler)
+
+
+def _records(uri, accept='application/hal+x-ndjson'):
+    response, content = http.request(uri, headers={'Accept': accept})
+    assert response['status'] == '200', content
+    assert 'application/hal+x-ndjson' in response['content-type']
+    assert content.endswith('\n')
+    return [json.loads(line) for line in content.splitlines()]
+
+
+def test_tiddlers_records():
+    records = _records('http://0.0.0.0:8080/bags/ndbag/tiddlers')
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/ndbag/tiddlers',
+            headers={'Accept': 'application/hal+json'})
+    document = json.loads(content)
+
+    header = records[0]
+    assert '_embedded' not in header
+    assert header['_links'] == document['_links']
+    assert records[1:] == document['_embedded']['tiddlyweb:tiddler']
+
+
+def test_extension():
+    records = _records('http://0.0.0.0:8080/bags/ndbag/tiddlers.haln',
+            'text/html')
+    assert len(records) == 6
+
+
+def test_empty_and_paged():
+    records = _records('http://0.0.0.0:8080/bags/emptybag/tiddlers')
+    assert len(records) == 1
+
+    records = _records(
+            'http://0.0.0.0:8080/bags/ndbag/tiddlers?page_size=2')
+    assert len(records) == 3
+    assert 'next' in records[0]['_links']
+
+
+def test_bags_records():
+    records = _records('http://0.0.0.0:8080/bags')
+    assert (records[0]['_links']['self']['href']
+            == 'http://0.0.0.0:8080/bags')
+    assert sorted(record['name'] for record in records[1:]) == [
+            'emptybag', 'ndbag']
+
+
+def test_single_tiddler():
+    records = _records(
+            'http://0.0.0.0:8080/bags/ndbag/tiddlers/tiddler%20%C3%A9%200')
+    assert len(records) == 1
+    assert records[0]['text'] == 'line one\nline two 0'
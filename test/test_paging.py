@@ -0,0 +1,167 @@
+"""
+Test paging through collections with page_size and cursor.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    for i in range(7):
+        module.store.put(Bag('bag%s' % i))
+    for i in range(12):
+        tiddler = Tiddler('tiddler%02d' % i, 'bag0')
+        tiddler.text = 'text%s' % i
+        module.store.put(tiddler)
+
+
+def _get(uri):
+    response, content = http.request(uri,
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    return json.loads(content)
+
+
+def test_unpaged():
+    info = _get('http://0.0.0.0:8080/bags/bag0/tiddlers')
+    assert len(info['_embedded']['tiddlyweb:tiddler']) == 12
+    assert 'next' not in info['_links']
+    assert 'first' not in info['_links']
+
+
+def test_page_through_tiddlers():
+    info = _get('http://0.0.0.0:8080/bags/bag0/tiddlers?page_size=5')
+    links = info['_links']
+
+    titles = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert titles == ['tiddler%02d' % i for i in range(5)]
+    assert (links['first']['href']
+            == 'http://0.0.0.0:8080/bags/bag0/tiddlers?page_size=5')
+    assert 'prev' not in links
+    assert 'tiddlyweb:bag' in links
+
+    info = _get(links['next']['href'])
+    links = info['_links']
+    titles = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert titles == ['tiddler%02d' % i for i in range(5, 10)]
+    assert (links['prev']['href']
+            == 'http://0.0.0.0:8080/bags/bag0/tiddlers?page_size=5')
+
+    info = _get(links['next']['href'])
+    links = info['_links']
+    titles = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert titles == ['tiddler10', 'tiddler11']
+    assert 'next' not in links
+
+    info = _get(links['prev']['href'])
+    titles = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert titles == ['tiddler%02d' % i for i in range(5, 10)]
+
+
+def test_cursor_stable_across_changes():
+    info = _get('http://0.0.0.0:8080/bags/bag0/tiddlers?page_size=5')
+    next_link = info['_links']['next']['href']
+
+    tiddler = Tiddler('tiddler00a', 'bag0')
+    store.put(tiddler)
+
+    info = _get(next_link)
+    titles = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert titles[0] == 'tiddler05'
+
+
+def test_page_sorted_tiddlers():
+    info = _get('http://0.0.0.0:8080/bags/bag0/tiddlers?sort=-title')
+    expected = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert expected[0] == 'tiddler11'
+
+    titles = []
+    info = _get('http://0.0.0.0:8080/bags/bag0/tiddlers'
+            '?sort=-title&page_size=5')
+    while True:
+        page = [tiddler['title']
+                for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+        assert len(page) <= 5
+        titles.extend(page)
+        if 'next' not in info['_links']:
+            break
+        assert 'sort=-title' in info['_links']['next']['href']
+        info = _get(info['_links']['next']['href'])
+    assert titles == expected
+
+    info = _get(info['_links']['prev']['href'])
+    titles = [tiddler['title']
+            for tiddler in info['_embedded']['tiddlyweb:tiddler']]
+    assert titles == expected[5:10]
+
+
+def test_page_bags():
+    info = _get('http://0.0.0.0:8080/bags?page_size=3')
+    names = [bag['name'] for bag in info['_embedded']['tiddlyweb:bag']]
+    assert names == ['bag0', 'bag1', 'bag2']
+
+    info = _get(info['_links']['next']['href'])
+    names = [bag['name'] for bag in info['_embedded']['tiddlyweb:bag']]
+    assert names == ['bag3', 'bag4', 'bag5']
+
+    info = _get(info['_links']['next']['href'])
+    names = [bag['name'] for bag in info['_embedded']['tiddlyweb:bag']]
+    assert names == ['bag6']
+    assert 'next' not in info['_links']
+    assert 'prev' in info['_links']
+
+
+def test_bad_cursor():
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags?page_size=3&cursor=notacursor',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '400'
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags?page_size=0',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '400'
+
+    info = _get('http://0.0.0.0:8080/bags/bag0/tiddlers?page_size=5')
+    cursor = info['_links']['next']['href'].split('cursor=')[1]
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag0/tiddlers'
+            '?sort=title&page_size=5&cursor=%s' % cursor,
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '400'
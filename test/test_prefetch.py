@@ -0,0 +1,103 @@
+"""
+Test fat HAL listings and loading their tiddlers in batches.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal.prefetch import (POOL, close_pool, get_pool,
+        loaded)
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('fatbag'))
+    for i in range(20):
+        tiddler = Tiddler('tiddler%02d' % i, 'fatbag')
+        tiddler.text = 'text of %s' % i
+        module.store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('hal.prefetch_threads', None)
+    config.pop('hal.prefetch_batch', None)
+    close_pool()
+
+
+def _get(uri):
+    response, content = http.request(uri,
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    return content
+
+
+def test_fat_listing():
+    info = json.loads(_get('http://0.0.0.0:8080/bags/fatbag/tiddlers'))
+    assert 'text' not in info['_embedded']['tiddlyweb:tiddler'][0]
+
+    info = json.loads(_get(
+        'http://0.0.0.0:8080/bags/fatbag/tiddlers?fat=1'))
+    tiddlers = info['_embedded']['tiddlyweb:tiddler']
+    assert len(tiddlers) == 20
+    assert tiddlers[0]['text'].startswith('text of ')
+
+
+def test_prefetch_same_output():
+    config.pop('hal.prefetch_threads', None)
+    plain = _get('http://0.0.0.0:8080/bags/fatbag/tiddlers?fat=1')
+
+    config['hal.prefetch_threads'] = 4
+    config['hal.prefetch_batch'] = 3
+    prefetched = _get('http://0.0.0.0:8080/bags/fatbag/tiddlers?fat=1')
+    assert prefetched == plain
+
+
+def test_loaded_in_order():
+    references = [Tiddler('tiddler%02d' % i, 'fatbag') for i in range(10)]
+    references.insert(4, Tiddler('missing', 'fatbag'))
+    tiddlers = list(loaded(store, references, 3, 4))
+    assert [tiddler.title for tiddler in tiddlers] == [
+            'tiddler%02d' % i for i in range(10)]
+    assert tiddlers[7].text == 'text of 7'
+    assert references[0].store is None
+
+
+def test_one_pool():
+    pool = get_pool(3)
+    assert get_pool(5) is pool
+    assert len(POOL) == 1
+
+    close_pool()
+    assert POOL == []
+    assert get_pool(2) is not pool
+    assert [tiddler.title for tiddler in loaded(store,
+        [Tiddler('tiddler00', 'fatbag')], 2)] == ['tiddler00']
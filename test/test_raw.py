@@ -0,0 +1,160 @@
+"""
+Test enclosure links for binary tiddlers and their raw content.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+CONTENT = ''.join(chr(i) for i in range(256))
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('binbag'))
+    tiddler = Tiddler('blob', 'binbag')
+    tiddler.type = 'application/octet-stream'
+    tiddler.text = CONTENT
+    module.store.put(tiddler)
+    tiddler = Tiddler('note', 'binbag')
+    tiddler.text = 'some text'
+    module.store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('hal.binary_links', None)
+
+
+def _get(uri, headers=None):
+    request_headers = {'Accept': 'application/hal+json'}
+    request_headers.update(headers or {})
+    return http.request(uri, headers=request_headers)
+
+
+def test_inline_by_default():
+    config.pop('hal.binary_links', None)
+    response, content = _get('http://0.0.0.0:8080/bags/binbag/tiddlers/blob')
+    info = json.loads(content)
+    assert 'text' in info
+    assert 'enclosure' not in info['_links']
+
+
+def test_enclosure_link():
+    config['hal.binary_links'] = True
+    response, content = _get('http://0.0.0.0:8080/bags/binbag/tiddlers/blob')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+    assert 'text' not in info
+    enclosure = info['_links']['enclosure']
+    assert (enclosure['href']
+            == 'http://0.0.0.0:8080/bags/binbag/tiddlers/blob/raw')
+    assert enclosure['type'] == 'application/octet-stream'
+    assert enclosure['length'] == 256
+
+    response, content = _get('http://0.0.0.0:8080/bags/binbag/tiddlers/note')
+    info = json.loads(content)
+    assert info['text'] == 'some text'
+    assert 'enclosure' not in info['_links']
+
+    response, content = _get(
+            'http://0.0.0.0:8080/bags/binbag/tiddlers/blob/revisions/1')
+    info = json.loads(content)
+    assert info['_links']['enclosure']['href'].endswith(
+            '/bags/binbag/tiddlers/blob/revisions/1/raw')
+
+
+def test_enclosure_with_fields():
+    config['hal.binary_links'] = True
+    response, content = _get(
+            'http://0.0.0.0:8080/bags/binbag/tiddlers/blob?fields=title,text')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+    assert sorted(info.keys()) == ['_links', 'title']
+    assert 'enclosure' in info['_links']
+
+    response, content = _get(
+            'http://0.0.0.0:8080/bags/binbag/tiddlers?fields=title,text')
+    info = json.loads(content)
+    for tiddler in info['_embedded']['tiddlyweb:tiddler']:
+        if tiddler['title'] == 'blob':
+            assert 'text' not in tiddler
+            assert 'enclosure' in tiddler['_links']
+        else:
+            assert tiddler['text'] == 'some text'
+
+
+def test_raw():
+    response, content = _get(
+            'http://0.0.0.0:8080/bags/binbag/tiddlers/blob/raw')
+    assert response['status'] == '200'
+    assert response['content-type'] == 'application/octet-stream'
+    assert response['accept-ranges'] == 'bytes'
+    assert content == CONTENT
+
+    response, content = _get(
+            'http://0.0.0.0:8080/bags/binbag/tiddlers/blob/revisions/1/raw')
+    assert content == CONTENT
+
+    response, content = _get(
+            'http://0.0.0.0:8080/bags/binbag/tiddlers/missing/raw')
+    assert response['status'] == '404'
+
+
+def test_ranges():
+    uri = 'http://0.0.0.0:8080/bags/binbag/tiddlers/blob/raw'
+    response, content = _get(uri, {'Range': 'bytes=10-19'})
+    assert response['status'] == '206'
+    assert response['content-range'] == 'bytes 10-19/256'
+    assert content == CONTENT[10:20]
+
+    response, content = _get(uri, {'Range': 'bytes=250-'})
+    assert response['status'] == '206'
+    assert content == CONTENT[250:]
+
+    response, content = _get(uri, {'Range': 'bytes=-6'})
+    assert response['status'] == '206'
+    assert content == CONTENT[-6:]
+
+    response, content = _get(uri, {'Range': 'bytes=300-'})
+    assert response['status'] == '416'
+    assert response['content-range'] == 'bytes */256'
+
+    response, content = _get(uri, {'Range': 'bytes=0-1,5-6'})
+    assert response['status'] == '200'
+    assert content == CONTENT
+
+    etag = response['etag']
+    response, content = _get(uri, {'Range': 'bytes=0-1', 'If-Range': etag})
+    assert response['status'] == '206'
+    response, content = _get(uri, {'Range': 'bytes=0-1',
+        'If-Range': '"stale"'})
+    assert response['status'] == '200'
@@ -0,0 +1,130 @@
+"""
+Test listing ranges of revisions and the links between revisions.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+TIDDLER_URI = 'http://0.0.0.0:8080/bags/long/tiddlers/history'
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('long'))
+    bag = Bag('private')
+    bag.policy.read = ['cdent']
+    module.store.put(bag)
+    recipe = Recipe('longrecipe')
+    recipe.set_recipe([('long', '')])
+    module.store.put(recipe)
+    for i in range(30):
+        tiddler = Tiddler('history', 'long')
+        tiddler.text = 'edit %s' % i
+        module.store.put(tiddler)
+        tiddler.bag = 'private'
+        module.store.put(tiddler)
+
+
+def _get(uri, status='200'):
+    response, content = http.request(uri,
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == status, content
+    return response, content
+
+
+def _revisions(uri):
+    response, content = _get(uri)
+    info = json.loads(content)
+    return info, [revision['revision'] for revision
+            in info['_embedded']['tiddlyweb:revision']]
+
+
+def test_all_revisions():
+    info, revisions = _revisions(TIDDLER_URI + '/revisions')
+    assert revisions == range(30, 0, -1)
+    assert 'next' not in info['_links']
+
+
+def test_count():
+    info, revisions = _revisions(TIDDLER_URI + '/revisions?count=5')
+    assert revisions == [30, 29, 28, 27, 26]
+    assert 'prev' not in info['_links']
+
+    info, revisions = _revisions(info['_links']['next']['href'])
+    assert revisions == [25, 24, 23, 22, 21]
+    assert 'prev' in info['_links']
+
+
+def test_range():
+    info, revisions = _revisions(
+            TIDDLER_URI + '/revisions?newest=10&oldest=6')
+    assert revisions == [10, 9, 8, 7, 6]
+
+    info, revisions = _revisions(
+            TIDDLER_URI + '/revisions?newest=10&count=3')
+    assert revisions == [10, 9, 8]
+    info, revisions = _revisions(info['_links']['next']['href'])
+    assert revisions == [7, 6, 5]
+
+    info, revisions = _revisions('http://0.0.0.0:8080/recipes/longrecipe'
+            '/tiddlers/history/revisions?oldest=29')
+    assert revisions == [30, 29]
+
+    _get(TIDDLER_URI + '/revisions?newest=latest', '400')
+
+
+def test_revisions_not_found():
+    _get('http://0.0.0.0:8080/bags/long/tiddlers/missing/revisions', '404')
+    _get('http://0.0.0.0:8080/bags/private/tiddlers/history/revisions',
+            '401')
+
+
+def test_revision_neighbours():
+    response, content = _get(TIDDLER_URI + '/revisions/10')
+    links = json.loads(content)['_links']
+    assert (links['predecessor-version']['href']
+            == TIDDLER_URI + '/revisions/9')
+    assert links['next']['href'] == TIDDLER_URI + '/revisions/9'
+    assert (links['successor-version']['href']
+            == TIDDLER_URI + '/revisions/11')
+    assert links['prev']['href'] == TIDDLER_URI + '/revisions/11'
+
+    response, content = _get(TIDDLER_URI + '/revisions/30')
+    links = json.loads(content)['_links']
+    assert 'successor-version' not in links
+    assert links['latest-version']['href'] == TIDDLER_URI
+
+    response, content = _get(TIDDLER_URI + '/revisions/1')
+    links = json.loads(content)['_links']
+    assert 'predecessor-version' not in links
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Test that a streamed tiddlers collection is the same document
+as an unstreamed one.
+"""
+
+import shutil
+import json
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('streambag'))
+    module.store.put(Bag('emptybag'))
+    for i in range(10):
+        tiddler = Tiddler(u'tiddler é %s' % i, 'streambag')
+        tiddler.text = 'text%s' % i
+        tiddler.tags = ['tag%s' % i]
+        module.store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('hal.stream', None)
+
+
+def _get_both(uri):
+    config['hal.stream'] = False
+    response, whole = http.request(uri)
+    assert response['status'] == '200', whole
+
+    config['hal.stream'] = True
+    response, streamed = http.request(uri)
+    assert response['status'] == '200', streamed
+    config['hal.stream'] = False
+
+    return whole, streamed
+
+
+def test_stream_tiddlers():
+    whole, streamed = _get_both(
+            'http://0.0.0.0:8080/bags/streambag/tiddlers.hal')
+    assert streamed == whole
+
+    info = json.loads(streamed)
+    assert len(info['_embedded']['tiddlyweb:tiddler']) == 10
+    assert (info['_links']['tiddlyweb:bag']['href']
+            == 'http://0.0.0.0:8080/bags/streambag')
+
+
+def test_stream_empty_tiddlers():
+    whole, streamed = _get_both(
+            'http://0.0.0.0:8080/bags/emptybag/tiddlers.hal')
+    assert streamed == whole
+
+    info = json.loads(streamed)
+    assert info['_embedded']['tiddlyweb:tiddler'] == []
+
+
+def test_stream_revisions():
+    tiddler = Tiddler(u'tiddler é 1', 'streambag')
+    tiddler.text = 'newer text'
+    store.put(tiddler)
+
+    whole, streamed = _get_both('http://0.0.0.0:8080/bags/streambag/'
+            'tiddlers/tiddler%20%C3%A9%201/revisions.hal')
+    assert streamed == whole
+
+    info = json.loads(streamed)
+    assert len(info['_embedded']['tiddlyweb:revision']) == 2
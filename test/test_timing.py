@@ -0,0 +1,101 @@
+"""
+Test the Server-Timing header and stats hook.
+"""
+
+import shutil
+
+from wsgi_intercept import httplib2_intercept
+import wsgi_intercept
+import httplib2
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.web.serve import load_app
+
+from tiddlywebplugins.utils import get_store
+
+from tiddlywebplugins.hal.timing import HalTiming, Timing
+
+
+STATS = []
+
+
+def stats_hook(environ, stats):
+    STATS.append((environ['PATH_INFO'], stats))
+
+
+def setup_module(module):
+    """
+    Set up a fresh new store and turn on the mock server.
+    """
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+
+    module.store = get_store(config)
+
+    config['hal.timing'] = True
+    config['hal.stats_hook'] = stats_hook
+    from tiddlywebplugins.hal import init
+    init(config)
+
+    def app_fn():
+        return load_app()
+    httplib2_intercept.install()
+    wsgi_intercept.add_wsgi_intercept('0.0.0.0', 8080, app_fn)
+    module.http = httplib2.Http()
+
+    module.store.put(Bag('bag0'))
+    for i in range(3):
+        tiddler = Tiddler('tiddler%s' % i, 'bag0')
+        tiddler.text = 'text%s' % i
+        module.store.put(tiddler)
+
+
+def teardown_module(module):
+    config.pop('hal.timing', None)
+    config.pop('hal.stats_hook', None)
+    config['server_request_filters'].remove(HalTiming)
+
+
+def test_timing_header():
+    del STATS[:]
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag0/tiddlers',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+
+    timing = response['server-timing']
+    for phase in ['store', 'links', 'dict', 'encode']:
+        assert 'hal-%s;dur=' % phase in timing
+    assert 'hal-items;desc="3"' in timing
+    assert 'hal-bytes;desc="%s"' % len(content) in timing
+
+    assert len(STATS) == 1
+    path, stats = STATS[0]
+    assert path == '/bags/bag0/tiddlers'
+    assert stats['items'] == 3
+    assert stats['bytes'] == len(content)
+
+
+def test_no_timing_without_hal():
+    del STATS[:]
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag0/tiddlers',
+            headers={'Accept': 'application/json'})
+    assert response['status'] == '200', content
+    assert 'server-timing' not in response
+    assert STATS == []
+
+
+def test_nested_phases():
+    timing = Timing()
+    timing.enter('dict')
+    timing.enter('links')
+    timing.leave()
+    timing.leave()
+    assert timing.times['dict'] >= 0
+    assert timing.times['links'] >= 0
+    assert timing.times['store'] == 0
@@ -237,3 +237,181 @@ def test_search():
 
     links = info['_links']
     assert 'curie' in links
+
+
+def test_root_etag():
+    response, content = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    etag = response['etag']
+
+    response, again = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'application/hal+json'})
+    assert response['etag'] == etag
+    assert again == content
+
+    response, _ = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'application/hal+json',
+                'If-None-Match': etag})
+    assert response['status'] == '304'
+
+
+def test_root_links_change():
+    from tiddlywebplugins.hal.fixups import remove_root_link, set_root_link
+    response, content = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'application/hal+json'})
+    etag = response['etag']
+
+    set_root_link('tiddlyweb:users', '/users')
+    try:
+        response, content = http.request('http://0.0.0.0:8080/',
+                headers={'Accept': 'application/hal+json'})
+    finally:
+        remove_root_link('tiddlyweb:users')
+
+    assert response['etag'] != etag
+    info = json.loads(content)
+    assert (info['_links']['tiddlyweb:users']['href']
+            == 'http://0.0.0.0:8080/users')
+
+    response, content = http.request('http://0.0.0.0:8080/',
+            headers={'Accept': 'application/hal+json'})
+    assert response['etag'] == etag
+    assert 'tiddlyweb:users' not in json.loads(content)['_links']
+
+
+def test_sparse_fields():
+    store.put(Bag('sparsebag'))
+    tiddler = Tiddler('sparse', 'sparsebag')
+    tiddler.text = 'sparse text'
+    tiddler.tags = ['sparse']
+    store.put(tiddler)
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag6/tiddlers.hal?fields=title,modified')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    tiddlers = info['_embedded']['tiddlyweb:tiddler']
+    for tiddler in tiddlers:
+        assert sorted(tiddler.keys()) == ['_links', 'modified', 'title']
+        assert 'self' in tiddler['_links']
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/sparsebag/tiddlers/sparse.hal'
+            '?fields=tags&fields=text')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    assert sorted(info.keys()) == ['_links', 'tags', 'text']
+    assert info['tags'] == ['sparse']
+    assert info['text'] == 'sparse text'
+
+
+def test_render():
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/sparsebag/tiddlers/sparse.hal?render=1')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+    assert 'sparse text' in info['render']
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/sparsebag/tiddlers.hal?render=1')
+    info = json.loads(content)
+    assert 'sparse text' in info['_embedded']['tiddlyweb:tiddler'][0]['render']
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/sparsebag/tiddlers/sparse.hal'
+            '?render=1&fields=title')
+    info = json.loads(content)
+    assert 'render' not in info
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/sparsebag/tiddlers/sparse.hal')
+    info = json.loads(content)
+    assert 'render' not in info
+
+
+def test_compact_tiddlers():
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag6/tiddlers?compact=1',
+            headers={'Accept': 'application/hal+json'})
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    links = info['_links']
+    assert links['profile']['href'] == 'http://tiddlyweb.com/profiles/compact'
+    assert links['tiddlyweb:tiddler']['templated']
+    assert (links['tiddlyweb:tiddler']['href']
+            == 'http://0.0.0.0:8080/bags/bag6/tiddlers/{tiddler}')
+
+    tiddlers = info['_embedded']['tiddlyweb:tiddler']
+    assert len(tiddlers) == 5
+    for tiddler in tiddlers:
+        assert '_links' not in tiddler
+        assert 'uri' not in tiddler
+        assert tiddler['bag'] == 'bag6'
+
+
+def test_compact_profile():
+    response, content = http.request('http://0.0.0.0:8080/bags',
+            headers={'Accept': 'application/hal+json; '
+                'profile="http://tiddlyweb.com/profiles/compact"'})
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    assert 'profile' in info['_links']
+    for bag in info['_embedded']['tiddlyweb:bag']:
+        assert bag.keys() == ['name']
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag6/tiddlers/tiddler4/revisions',
+            headers={'Accept': 'application/hal+json; '
+                'profile="http://tiddlyweb.com/profiles/compact"'})
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    assert (info['_links']['tiddlyweb:revision']['href']
+            == 'http://0.0.0.0:8080/bags/bag6/tiddlers/tiddler4/'
+            'revisions/{revision}')
+    for revision in info['_embedded']['tiddlyweb:revision']:
+        assert '_links' not in revision
+
+
+def test_search_not_compact():
+    response, content = http.request(
+            'http://0.0.0.0:8080/search.hal?q=text&compact=1')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    for tiddler in info['_embedded']['tiddlyweb:tiddler']:
+        assert 'self' in tiddler['_links']
+
+
+def test_embed_bag_recipe():
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag6/tiddlers/tiddler4.hal')
+    assert '_embedded' not in json.loads(content)
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/bags/bag6/tiddlers/tiddler4.hal?embed=bag')
+    assert response['status'] == '200', content
+    info = json.loads(content)
+
+    bag = info['_embedded']['tiddlyweb:bag']
+    assert bag['name'] == 'bag6'
+    assert bag['policy']['write'] == ['foobar']
+    assert (bag['_links']['self']['href']
+            == 'http://0.0.0.0:8080/bags/bag6')
+
+    recipe = Recipe('recipe7')
+    recipe.set_recipe([('bag6', '')])
+    store.put(recipe)
+
+    response, content = http.request(
+            'http://0.0.0.0:8080/recipes/recipe7/tiddlers/tiddler4.hal'
+            '?embed=bag,recipe')
+    assert response['status'] == '200', content
+    embedded = json.loads(content)['_embedded']
+    assert embedded['tiddlyweb:bag']['name'] == 'bag6'
+    assert embedded['tiddlyweb:recipe']['recipe'] == [['bag6', '']]
@@ -1,27 +1,120 @@
 """
-Description of My Plugin.
+A HAL serialization for TiddlyWeb.
+
+HAL is served as application/hal+json (extension .hal) and collections
+also as newline delimited application/hal+x-ndjson (extension .haln).
+
+Optional settings in config, see the README for more:
+
+hal.stream -- send tiddler collections in chunks as they are made
+hal.page_size -- page collections by this many entities
+hal.emitter -- 'simplehal' to build documents with simplehal
+hal.json_encoder -- the JSON library to encode with, or 'auto'
+hal.timing -- send a Server-Timing header of rendering phases
+hal.stats_hook -- a callable given the timings of each request
+hal.cache_size -- keep this many rendered collections
+hal.since_index -- index modified times for change feeds
+hal.binary_links -- link to the raw content of binary tiddlers
+hal.prefetch_threads -- load fat listings with this many threads
+hal.prefetch_batch -- how many tiddlers each prefetch loads
+hal.batch_limit -- the most URIs one /batch request may ask for
+hal.compress -- gzip or brotli HAL responses
+hal.negotiate_cache_size -- how many negotiated types to remember
 """
 
-from tiddlywebplugins.utils import replace_handler
+from tiddlyweb.web.negotiate import Negotiate
 
-from .fixups import replacement_root_handler
+from . import changes, emitter
+from .batch import get_batch
+from .bulk import post_tiddlers
+from .cache import HalCache, init_cache
+from .compress import HalCompress
+from .dispatch import HalDispatch, HalNegotiate, init_dispatch
+from .raw import RAW_ROUTES, get_raw
+from .revisions import REVISIONS_PATHS, get_revisions
+from .timing import HalTiming
 
 
 EXTENSION_TYPES = {
-        'hal': 'application/hal+json'
+        'hal': 'application/hal+json',
+        'haln': 'application/hal+x-ndjson',
 }
 SERIALIZERS = {
         'application/hal+json': ['tiddlywebplugins.hal.serialization',
-            'application/hal+json; charset=UTF-8']
+            'application/hal+json; charset=UTF-8'],
+        'application/hal+x-ndjson': ['tiddlywebplugins.hal.ndjson',
+            'application/hal+x-ndjson; charset=UTF-8'],
 }
 
+# The plugin's request filters, outermost first. Compression is
+# outside the cache, so the cache keeps uncompressed bodies, and
+# the root is sent last, so it passes through all of them.
+FILTERS = [HalTiming, HalCompress, HalCache, HalDispatch]
+
 
 def init(config):
     """
-    Initialize the plugin by establishing the serialization.
+    Initialize the plugin by establishing the serialization,
+    choosing the JSON encoder and, if hal.timing is set, adding
+    the filter which reports rendering times. If hal.compress is
+    set, add the filter which compresses HAL responses, and if
+    hal.cache_size is set, the one which caches collections. If
+    hal.since_index is set, keep the index of modified times
+    used for change feeds.
+
+    Negotiate is replaced by HalNegotiate, which remembers the
+    types negotiated, and HalDispatch sends the HAL root document.
+
+    POST to a bag's tiddlers writes tiddlers in bulk, the raw
+    content of tiddlers is at RAW_ROUTES and many resources can be
+    got at once from /batch. Revisions are listed lazily, in the
+    range asked for.
     """
+    emitter.set_encoder(config.get('hal.json_encoder', 'json'))
+    wanted = [HalDispatch]
+    if config.get('hal.timing', False):
+        wanted.append(HalTiming)
+    if config.get('hal.compress', False):
+        wanted.append(HalCompress)
+    if config.get('hal.cache_size'):
+        init_cache(config)
+        wanted.append(HalCache)
+    if config.get('hal.since_index'):
+        changes.init_index(config)
+    filters = config['server_request_filters']
+    if Negotiate in filters:
+        filters[filters.index(Negotiate)] = HalNegotiate
+    _add_filters(filters, wanted)
     config['extension_types'].update(EXTENSION_TYPES)
     config['serializers'].update(SERIALIZERS)
+    init_dispatch(config)
     if 'selector' in config:
-        replace_handler(config['selector'], '/', dict(
-            GET=replacement_root_handler))
+        _add_method(config['selector'], '/bags/_/tiddlers', 'POST',
+                post_tiddlers)
+        for path in REVISIONS_PATHS:
+            _add_method(config['selector'], path, 'GET', get_revisions)
+        for route in RAW_ROUTES:
+            config['selector'].add(route, GET=get_raw)
+        config['selector'].add('/batch', GET=get_batch)
+
+
+def _add_filters(filters, wanted):
+    """
+    Add the filters in wanted to filters, keeping all of the
+    plugin's filters at the end, in the order of FILTERS.
+    """
+    present = [hal_filter for hal_filter in FILTERS
+            if hal_filter in filters or hal_filter in wanted]
+    filters[:] = [request_filter for request_filter in filters
+            if request_filter not in FILTERS] + present
+
+
+def _add_method(selector, path, method, handler):
+    """
+    Add handler for method to the selector mapping which
+    matches path, keeping its other methods.
+    """
+    for regex, methods in selector.mappings:
+        if regex.match(path) is not None:
+            methods[method] = handler
+            return
@@ -0,0 +1,207 @@
+"""
+Get many bags, recipes and tiddlers in one request.
+
+GET /batch with a uri parameter for each bag, recipe, tiddler or
+revision wanted, as a full URI or a path, sends one HAL document
+embedding each under its rel (tiddlyweb:bag, tiddlyweb:recipe,
+tiddlyweb:tiddler or tiddlyweb:revision), as the document at that
+URI would be, with the query of that URI, not of the batch. The
+documents under each rel are in the order asked.
+
+A URI which cannot be resolved, because it is on another server, is
+not one of those, is not there, may not be read by the current user
+or the store fails to get it, is embedded under tiddlyweb:error with
+its status and a message. At most hal.batch_limit (default
+BATCH_LIMIT) URIs may be asked for at once.
+"""
+
+import re
+
+from urlparse import urlparse
+
+from httpexceptor import HTTP400
+
+from tiddlyweb.control import determine_bag_from_recipe
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import ForbiddenError, UserRequiredError
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import (NoBagError, NoRecipeError, NoTiddlerError,
+        StoreError)
+from tiddlyweb.web.query import Query
+from tiddlyweb.web.util import get_route_value, server_base_url
+
+from . import emitter
+from .serialization import Serialization
+
+
+BATCH_LIMIT = 100
+
+_TIDDLER = (r'^/(?:bags/(?P<bag_name>[^/]+)|recipes/(?P<recipe_name>[^/]+))'
+        r'/tiddlers/(?P<tiddler_name>[^/]+)')
+
+BATCH_ROUTES = [
+        ('tiddlyweb:bag', re.compile(r'^/bags/(?P<bag_name>[^/]+)$')),
+        ('tiddlyweb:recipe',
+            re.compile(r'^/recipes/(?P<recipe_name>[^/]+)$')),
+        ('tiddlyweb:tiddler', re.compile(_TIDDLER + '$')),
+        ('tiddlyweb:revision',
+            re.compile(_TIDDLER + r'/revisions/(?P<revision>[^/]+)$')),
+]
+
+
+def get_batch(environ, start_response):
+    """
+    Send the HAL document embedding the resources at the uris
+    in the query.
+    """
+    uris = environ['tiddlyweb.query'].get('uri', [])
+    limit = environ['tiddlyweb.config'].get('hal.batch_limit', BATCH_LIMIT)
+    if not uris:
+        raise HTTP400('one or more uri required')
+    if len(uris) > limit:
+        raise HTTP400('no more than %s uri allowed' % limit)
+
+    # Share bags and recipes loaded for ?embed= between documents.
+    environ.setdefault('tiddlyweb.hal.entities', {})
+    embed = {}
+    for uri in uris:
+        rel, document = _resolve(environ, uri)
+        embed.setdefault(rel, []).append(document)
+
+    server_base = server_base_url(environ)
+    query_string = environ.get('QUERY_STRING', '')
+    links = {
+        'self': emitter.link('%s/batch%s' % (server_base,
+            query_string and '?' + query_string)),
+        'curie': emitter.CURIE,
+    }
+    start_response('200 OK', [
+        ('Content-Type', 'application/hal+json; charset=UTF-8'),
+        ('Cache-Control', 'no-cache'),
+        ('Vary', 'Accept')])
+    return [emitter.to_json(emitter.document(links, embed=embed))]
+
+
+def _resolve(environ, uri):
+    """
+    The rel and document of the resource at uri, or of the error
+    in getting it.
+    """
+    if _foreign(environ, uri):
+        return 'tiddlyweb:error', _error(uri, 400, 'not on this server')
+    route = _route(environ, uri)
+    if route is None:
+        return 'tiddlyweb:error', _error(uri, 404, 'unknown resource')
+    rel, routing_args, query_string = route
+
+    item_environ = dict(environ)
+    item_environ['wsgiorg.routing_args'] = ((), routing_args)
+    # The uri has been decoded, but QUERY_STRING is bytes.
+    item_environ['QUERY_STRING'] = query_string.encode('utf-8')
+    try:
+        Query(None).extract_query(item_environ)
+    except HTTP400, exc:
+        return 'tiddlyweb:error', _error(uri, 400, 'bad query: %s' % exc)
+    serialization = Serialization(item_environ)
+    try:
+        if rel == 'tiddlyweb:bag':
+            return rel, serialization._bag_document(
+                    _get_bag(item_environ, 'read'))
+        if rel == 'tiddlyweb:recipe':
+            return rel, serialization._recipe_document(
+                    _get_recipe(item_environ))
+        return rel, serialization._tiddler_document(
+                _get_tiddler(item_environ))
+    except (NoBagError, NoRecipeError, NoTiddlerError), exc:
+        return 'tiddlyweb:error', _error(uri, 404, 'not found: %s' % exc)
+    except UserRequiredError, exc:
+        return 'tiddlyweb:error', _error(uri, 401, 'user required: %s' % exc)
+    except ForbiddenError, exc:
+        return 'tiddlyweb:error', _error(uri, 403, 'forbidden: %s' % exc)
+    except ValueError, exc:
+        return 'tiddlyweb:error', _error(uri, 404, 'bad revision: %s' % exc)
+    except StoreError, exc:
+        return 'tiddlyweb:error', _error(uri, 500, 'store error: %s' % exc)
+
+
+def _error(uri, status, message):
+    """
+    The embedded form of a uri which could not be resolved.
+    """
+    return {'uri': uri, 'status': status, 'message': message}
+
+
+def _get_bag(environ, constraint, bag_name=None):
+    """
+    The bag in the route, or bag_name, if the current user passes
+    constraint on it.
+    """
+    if bag_name is None:
+        bag_name = get_route_value(environ, 'bag_name')
+    bag = environ['tiddlyweb.store'].get(Bag(bag_name))
+    bag.policy.allows(environ['tiddlyweb.usersign'], constraint)
+    return bag
+
+
+def _get_recipe(environ):
+    """
+    The recipe in the route, if the current user may read it.
+    """
+    recipe = environ['tiddlyweb.store'].get(Recipe(get_route_value(
+        environ, 'recipe_name')))
+    recipe.policy.allows(environ['tiddlyweb.usersign'], 'read')
+    return recipe
+
+
+def _get_tiddler(environ):
+    """
+    The tiddler or revision in the route, found through its recipe
+    if there is one, if the current user may read it.
+    """
+    store = environ['tiddlyweb.store']
+    routing_args = environ['wsgiorg.routing_args'][1]
+    tiddler = Tiddler(get_route_value(environ, 'tiddler_name'))
+    if routing_args.get('revision'):
+        tiddler.revision = int(get_route_value(environ, 'revision'))
+    if routing_args.get('recipe_name'):
+        recipe = _get_recipe(environ)
+        tiddler.bag = determine_bag_from_recipe(recipe, tiddler,
+                environ).name
+        tiddler.recipe = recipe.name
+    else:
+        tiddler.bag = get_route_value(environ, 'bag_name')
+    _get_bag(environ, 'read', tiddler.bag)
+    return store.get(tiddler)
+
+
+def _foreign(environ, uri):
+    """
+    True if uri is a full URI on some other server.
+    """
+    return bool(urlparse(uri).netloc) and not uri.startswith(
+            server_base_url(environ))
+
+
+def _route(environ, uri):
+    """
+    The rel, routing args and query string of the resource at uri,
+    None if it is not one which can be batched.
+    """
+    server_base = server_base_url(environ)
+    if uri.startswith(server_base):
+        parsed = urlparse(uri[len(server_base):])
+        path = parsed.path
+    else:
+        parsed = urlparse(uri)
+        path = parsed.path
+        prefix = environ['tiddlyweb.config'].get('server_prefix', '')
+        if prefix and path.startswith(prefix):
+            path = path[len(prefix):]
+    for rel, pattern in BATCH_ROUTES:
+        match = pattern.match(path)
+        if match:
+            routing_args = dict([(name, value) for name, value
+                in match.groupdict().items() if value is not None])
+            return rel, routing_args, parsed.query
+    return None
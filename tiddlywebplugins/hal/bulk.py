@@ -0,0 +1,215 @@
+"""
+Write many tiddlers to a bag in one request.
+
+A POST to /bags/{bag_name}/tiddlers of a HAL document, with the
+tiddlers to write in the tiddlyweb:tiddler list in _embedded, puts
+each of them in the bag. Each embedded tiddler has a title and any
+of the keys accepted in a JSON PUT of a tiddler.
+
+The bag and its policy are read once for the whole batch, rather
+than once per tiddler as with a PUT of each. The core store has no
+call to put many tiddlers at once, so each is still its own put,
+and the store HOOKS run for each.
+
+The response is a HAL document embedding, in the order sent, the
+title and status of each tiddler, with its self link and ETag if
+it was written, or a message if it was not. A tiddler which cannot
+be written, because its keys have the wrong types, it is not
+allowed, or the store fails to put it, does not stop the others.
+"""
+
+import json
+
+from base64 import b64decode
+
+from httpexceptor import HTTP400, HTTP404, HTTP415
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import PermissionsError
+from tiddlyweb.model.tiddler import Tiddler, current_timestring
+from tiddlyweb.store import NoBagError, NoTiddlerError, StoreError
+from tiddlyweb.util import binary_tiddler
+from tiddlyweb.web.util import (bag_url, content_length_and_type,
+        get_route_value, read_request_body, tiddler_etag, tiddler_url)
+from tiddlyweb.web.validator import validate_tiddler, InvalidTiddlerError
+
+from . import emitter
+
+
+BULK_TYPES = ['application/hal+json', 'application/json',
+        'application/vnd.tiddlyweb+json']
+
+# The keys of an embedded tiddler which are written. modifier
+# and modified are set from the request, as with a PUT.
+ACCEPTED_KEYS = ['created', 'tags', 'fields', 'text', 'type']
+
+# The type each accepted key must have, and its name for messages.
+KEY_TYPES = {
+        'created': (basestring, 'string'),
+        'tags': (list, 'list'),
+        'fields': (dict, 'dict'),
+        'text': (basestring, 'string'),
+        'type': (basestring, 'string'),
+}
+
+
+def post_tiddlers(environ, start_response):
+    """
+    Write the tiddlers embedded in the HAL document in the request
+    body to the bag named in the route.
+    """
+    length, content_type = content_length_and_type(environ)
+    if content_type not in BULK_TYPES:
+        raise HTTP415('application/hal+json required')
+
+    members = _read_members(read_request_body(environ, length))
+
+    store = environ['tiddlyweb.store']
+    bag = Bag(get_route_value(environ, 'bag_name'))
+    try:
+        bag = store.get(bag)
+    except NoBagError, exc:
+        raise HTTP404('Unable to post tiddlers, no bag %s: %s'
+                % (bag.name, exc))
+    allowed = _allowed(environ, bag)
+
+    results = [_put_member(environ, bag, member, allowed)
+            for member in members]
+
+    written = len([result for result in results if result['status'] == 204])
+    document = emitter.document({
+        'self': emitter.link('%s/tiddlers' % bag_url(environ, bag)),
+        'curie': emitter.CURIE,
+    }, {'written': written, 'failed': len(results) - written},
+        {'tiddlyweb:tiddler': results})
+
+    start_response('200 OK', [
+        ('Content-Type', 'application/hal+json; charset=UTF-8'),
+        ('Cache-Control', 'no-cache')])
+    return [emitter.to_json(document)]
+
+
+def _allowed(environ, bag):
+    """
+    Which of the create, write and accept constraints of the policy
+    of bag the current user passes. If neither create nor write,
+    nothing can be written so raise the error for create.
+    """
+    usersign = environ['tiddlyweb.usersign']
+    allowed = {}
+    for constraint in ['create', 'write', 'accept']:
+        try:
+            allowed[constraint] = bag.policy.allows(usersign, constraint)
+        except PermissionsError, exc:
+            allowed[constraint] = False
+            if constraint == 'create':
+                denied = exc
+    if not (allowed['create'] or allowed['write']):
+        raise denied.__class__('for bag %s: %s' % (bag.name, denied))
+    return allowed
+
+
+def _exists(store, tiddler):
+    """
+    True if tiddler is already in the store.
+    """
+    try:
+        store.get(Tiddler(tiddler.title, tiddler.bag))
+        return True
+    except NoTiddlerError:
+        return False
+
+
+def _put_member(environ, bag, member, allowed):
+    """
+    Write one embedded tiddler, returning its result.
+    """
+    title = member.get('title') if isinstance(member, dict) else None
+    if not title or not isinstance(title, basestring):
+        return {'status': 400, 'message': 'title required'}
+    result = {'title': title}
+    message = _member_error(member)
+    if message:
+        result.update(status=400, message=message)
+        return result
+
+    store = environ['tiddlyweb.store']
+    tiddler = Tiddler(title, bag.name)
+    for key in ACCEPTED_KEYS:
+        if member.get(key) is not None:
+            setattr(tiddler, key, member[key])
+    if binary_tiddler(tiddler):
+        try:
+            tiddler.text = b64decode(tiddler.text)
+        except (TypeError, ValueError), exc:
+            result.update(status=400,
+                    message='unable to decode base64 text: %s' % exc)
+            return result
+
+    if not (allowed['create'] and allowed['write']):
+        constraint = 'write' if _exists(store, tiddler) else 'create'
+        if not allowed[constraint]:
+            result.update(status=403,
+                    message='%s not allowed in bag %s'
+                    % (constraint, bag.name))
+            return result
+
+    tiddler.modifier = environ['tiddlyweb.usersign']['name']
+    tiddler.modified = current_timestring()
+    try:
+        if not allowed['accept']:
+            validate_tiddler(tiddler, environ)
+        store.put(tiddler)
+    except InvalidTiddlerError, exc:
+        result.update(status=409, message='Tiddler content is invalid: %s'
+                % exc)
+        return result
+    except (TypeError, ValueError), exc:
+        result.update(status=409, message='Unable to put badly formed '
+                'tiddler: %s' % exc)
+        return result
+    except StoreError, exc:
+        result.update(status=500, message='Unable to put tiddler: %s'
+                % exc)
+        return result
+
+    result.update(status=204, etag=tiddler_etag(environ, tiddler),
+            _links={'self': emitter.link(tiddler_url(environ, tiddler))})
+    return result
+
+
+def _member_error(member):
+    """
+    What is wrong with the types of the keys of member, None if
+    nothing, so it is rejected before anything is written.
+    """
+    for key in ACCEPTED_KEYS:
+        value = member.get(key)
+        key_type, type_name = KEY_TYPES[key]
+        if value is not None and not isinstance(value, key_type):
+            return '%s must be a %s' % (key, type_name)
+    for tag in member.get('tags') or []:
+        if not isinstance(tag, basestring):
+            return 'tags must be strings'
+    for name, value in (member.get('fields') or {}).items():
+        if not isinstance(value, basestring):
+            return 'field %s must be a string' % name
+    return None
+
+
+def _read_members(content):
+    """
+    The list of tiddlers embedded in the request body.
+    """
+    try:
+        document = json.loads(content.decode('utf-8'))
+        members = document['_embedded']['tiddlyweb:tiddler']
+    except UnicodeDecodeError, exc:
+        raise HTTP400('unable to decode tiddlers, utf-8 expected: %s' % exc)
+    except ValueError, exc:
+        raise HTTP400('unable to parse tiddlers as JSON: %s' % exc)
+    except (KeyError, TypeError):
+        raise HTTP400('tiddlers required in _embedded tiddlyweb:tiddler')
+    if not isinstance(members, list):
+        raise HTTP400('_embedded tiddlyweb:tiddler must be a list')
+    return members
@@ -0,0 +1,282 @@
+"""
+A response cache for HAL collections.
+
+When hal.cache_size is set in config, the HalCache filter keeps up
+to that many rendered HAL listings of bags, recipes, tiddlers,
+revisions and search results, most recently used first. Entries are
+keyed on the request URI, the negotiated type (and any profile asked
+for in Accept) and the user and roles making the request, and are
+dropped by store HOOKS when a bag, recipe or tiddler they depend on
+is put or deleted.
+
+Invalidation is by tag: a bag's tiddlers and revisions are tagged
+with the bag, listings of bags and recipes with 'bags' and 'recipes',
+and recipe tiddlers and search results, which could include anything,
+with 'all'.
+
+When hal.compress is set, a cached response is also kept compressed
+in each encoding it is sent in, see compress.
+
+A hit is answered with a 304 when If-None-Match names the cached
+ETag, compared weakly and in a list as HTTP has it, with the ETag,
+Vary and other validator headers of the cached response.
+
+The cache is per process, so with several processes serving the same
+store, a write made through one will not invalidate the others.
+"""
+
+import re
+import threading
+
+from collections import OrderedDict
+
+from tiddlyweb.fixups import unquote
+from tiddlyweb.store import HOOKS
+
+from . import compress
+from .dispatch import wants_hal
+
+
+COLLECTION_ROUTES = [
+        (re.compile(r'^/bags(?:\.[^/]+)?$'), lambda match: ['bags']),
+        (re.compile(r'^/recipes(?:\.[^/]+)?$'), lambda match: ['recipes']),
+        (re.compile(r'^/bags/([^/]+)/tiddlers(?:\.[^/]+)?$'),
+            lambda match: [('bag', _route_name(match.group(1)))]),
+        (re.compile(r'^/bags/([^/]+)/tiddlers/[^/]+/revisions(?:\.[^/]+)?$'),
+            lambda match: [('bag', _route_name(match.group(1)))]),
+        (re.compile(r'^/recipes/[^/]+/tiddlers'
+            r'(?:/[^/]+/revisions)?(?:\.[^/]+)?$'), lambda match: ['all']),
+        (re.compile(r'^/search(?:\.[^/]+)?$'), lambda match: ['all']),
+]
+
+# The headers of a cached response sent again with a 304.
+NOT_MODIFIED_HEADERS = ['etag', 'vary', 'cache-control', 'last-modified',
+        'content-location', 'expires']
+
+# An entity tag, weak or strong, or *, in If-None-Match.
+ETAG_PATTERN = re.compile(r'\*|(?:W/)?"[^"]*"')
+
+
+class ResponseCache(object):
+    """
+    An LRU of (status, headers, body, encoded) keyed responses, each
+    with a set of tags by which it can be invalidated. encoded holds
+    the body compressed in each encoding it has been sent in.
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                'invalidations': 0}
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        The response stored at key, or None, counting the hit or miss.
+        """
+        with self._lock:
+            try:
+                entry = self._entries.pop(key)
+            except KeyError:
+                self.stats['misses'] += 1
+                return None
+            self._entries[key] = entry
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, tags, response, generation):
+        """
+        Store response at key, unless the cache has been invalidated
+        since generation, when the response was started.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (frozenset(tags), response)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, tags):
+        """
+        Drop every response tagged with any of tags.
+        """
+        tags = frozenset(tags)
+        with self._lock:
+            self.generation += 1
+            for key in [key for key in self._entries
+                    if self._entries[key][0] & tags]:
+                del self._entries[key]
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        """
+        Drop everything.
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+CACHE = ResponseCache()
+
+
+class HalCache(object):
+    """
+    WSGI filter which answers GETs of HAL collections from CACHE
+    and fills it. Requests for other types pass by uncounted.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'GET' or not wants_hal(environ):
+            return self.application(environ, start_response)
+        tags = _cache_tags(environ)
+        if tags is None:
+            return self.application(environ, start_response)
+
+        key = _cache_key(environ)
+        response = CACHE.get(key)
+        if response:
+            status, headers, body, encoded = response
+            etag = dict([(name.lower(), value)
+                for name, value in headers]).get('etag')
+            if etag and _none_match(environ, etag):
+                start_response('304 Not Modified', [(name, value)
+                    for name, value in headers
+                    if name.lower() in NOT_MODIFIED_HEADERS])
+                return []
+            encoding = compress.negotiate(environ)
+            if encoding:
+                try:
+                    body = encoded[encoding]
+                except KeyError:
+                    body = encoded[encoding] = compress.compress(body,
+                            encoding)
+                headers = compress.encoded_headers(headers, encoding)
+            start_response(status, list(headers))
+            return [body]
+
+        generation = CACHE.generation
+        captured = []
+
+        def capturing_start_response(status, headers, exc_info=None):
+            captured[:] = [status, list(headers)]
+            return start_response(status, headers, exc_info)
+
+        output = self.application(environ, capturing_start_response)
+        return self._capture(output, captured, key, tags, generation)
+
+    def _capture(self, output, captured, key, tags, generation):
+        """
+        Pass the output through, then cache it if it is a complete
+        200 HAL response.
+        """
+        chunks = []
+        try:
+            for chunk in output:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+        if captured and captured[0].startswith('200'):
+            headers = dict([(name.lower(), value)
+                for name, value in captured[1]])
+            if ('application/hal+json' in headers.get('content-type', '')
+                    and 'content-encoding' not in headers):
+                body = ''.join([chunk.encode('utf-8')
+                    if isinstance(chunk, unicode) else chunk
+                    for chunk in chunks])
+                CACHE.put(key, tags, (captured[0], captured[1], body, {}),
+                        generation)
+
+
+def init_cache(config):
+    """
+    Size CACHE from config and hook it to the store.
+    """
+    CACHE.size = int(config.get('hal.cache_size', 0))
+    for entity in ['bag', 'recipe', 'tiddler']:
+        for method in ['put', 'delete']:
+            if _invalidate not in HOOKS[entity][method]:
+                HOOKS[entity][method].append(_invalidate)
+
+
+def _cache_key(environ):
+    """
+    The request URI, negotiated type and user context. Accept is
+    included when it asks for a profile, which changes the listing.
+    """
+    usersign = environ.get('tiddlyweb.usersign', {})
+    accept = environ.get('HTTP_ACCEPT', '')
+    return (environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', ''),
+            tuple(environ.get('tiddlyweb.type', [])),
+            accept if 'profile' in accept else '',
+            environ.get('tiddlyweb.extension'),
+            usersign.get('name'), tuple(sorted(usersign.get('roles', []))))
+
+
+def _cache_tags(environ):
+    """
+    The tags for the collection at the request path, None if it
+    is not a collection that is cached.
+    """
+    path = environ.get('PATH_INFO', '')
+    prefix = environ['tiddlyweb.config'].get('server_prefix', '')
+    if prefix and path.startswith(prefix):
+        path = path[len(prefix):]
+    for pattern, tagger in COLLECTION_ROUTES:
+        match = pattern.match(path)
+        if match:
+            return tagger(match)
+    return None
+
+
+def _invalidate(store, entity):
+    """
+    Store hook: drop the responses which could include entity.
+    """
+    name = entity.__class__.__name__
+    if name == 'Tiddler':
+        CACHE.invalidate([('bag', entity.bag), 'all'])
+    elif name == 'Bag':
+        CACHE.invalidate([('bag', entity.name), 'bags', 'all'])
+    elif name == 'Recipe':
+        CACHE.invalidate(['recipes', 'all'])
+
+
+def _none_match(environ, etag):
+    """
+    True if If-None-Match in environ names etag, or is *. Weak
+    tags match their strong form, as a GET compares weakly.
+    """
+    incoming = environ.get('HTTP_IF_NONE_MATCH', '')
+    if not incoming:
+        return False
+    etag = _strong(etag)
+    for tag in ETAG_PATTERN.findall(incoming):
+        if tag == '*' or _strong(tag) == etag:
+            return True
+    return False
+
+
+def _strong(etag):
+    """
+    etag without any weak indicator.
+    """
+    if etag.startswith('W/'):
+        return etag[2:]
+    return etag
+
+
+def _route_name(segment):
+    """
+    A bag name from the request path, as get_route_value gets it.
+    """
+    return unquote(segment).replace('%2F', '/')
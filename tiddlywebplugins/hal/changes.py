@@ -0,0 +1,203 @@
+"""
+Change feeds for tiddler collections.
+
+A since parameter in the query, either a modified timestamp
+(YYYYMMDDHHMMSS, or a leading part of one) or the token from a
+next-sync link, limits a collection of tiddlers, but not of
+revisions, to the tiddlers modified at or after it. The document
+then has a next-sync link with the token from which to get the
+changes after these.
+
+A token also names the tiddlers already sent which were modified
+in its last second, so changes made in the same second as a sync
+are neither missed nor sent twice. When there are more than
+SENT_LIMIT of them, as after a bulk import, the token has their
+count and a digest of their keys instead, to keep the next-sync
+URL short. If the tiddlers of that second still match the digest
+they are skipped, otherwise they are all sent again. Deleted
+tiddlers are not reported, as the store keeps no record of them.
+
+Choosing the changed tiddlers needs the modified time of each.
+With hal.since_index set in config, INDEX, filled from the store
+for a bag the first time it is asked about and then kept current
+by store HOOKS, provides these so only changed tiddlers are loaded.
+The index is per process, so only set hal.since_index when one
+process writes to the store. Without it, each tiddler is loaded.
+Either way the modified time of every tiddler in the collection is
+looked at, so a poll costs in proportion to the size of the
+collection, not to the number of changes; the index only makes
+each look a dictionary lookup rather than a store read.
+"""
+
+import threading
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS, StoreError
+from tiddlyweb.util import sha
+
+from .paging import encode_cursor, decode_cursor
+
+
+# The most keys of tiddlers already sent named in a since token.
+SENT_LIMIT = 50
+
+
+class ModifiedIndex(object):
+    """
+    The modified time of each tiddler in the bags asked about,
+    by bag and title.
+    """
+
+    def __init__(self):
+        self._bags = {}
+        self._lock = threading.Lock()
+
+    def modified(self, store, tiddler):
+        """
+        The modified time of tiddler, None if it does not exist.
+        """
+        with self._lock:
+            try:
+                bag = self._bags[tiddler.bag]
+            except KeyError:
+                bag = self._bags[tiddler.bag] = self._load_bag(store,
+                        tiddler.bag)
+            return bag.get(tiddler.title)
+
+    def put(self, store, tiddler):
+        """
+        Store hook: note the modified time of a put tiddler.
+        """
+        with self._lock:
+            if tiddler.bag in self._bags:
+                self._bags[tiddler.bag][tiddler.title] = tiddler.modified
+
+    def delete(self, store, entity):
+        """
+        Store hook: forget a deleted tiddler or bag.
+        """
+        with self._lock:
+            if entity.__class__.__name__ == 'Bag':
+                self._bags.pop(entity.name, None)
+            elif entity.bag in self._bags:
+                self._bags[entity.bag].pop(entity.title, None)
+
+    def clear(self):
+        """
+        Forget every bag.
+        """
+        with self._lock:
+            self._bags.clear()
+
+    def _load_bag(self, store, bag_name):
+        """
+        Read the modified time of each tiddler in the named bag.
+        """
+        modified = {}
+        try:
+            for tiddler in store.list_bag_tiddlers(Bag(bag_name)):
+                tiddler = store.get(Tiddler(tiddler.title, bag_name))
+                modified[tiddler.title] = tiddler.modified
+        except StoreError:
+            pass
+        return modified
+
+
+INDEX = ModifiedIndex()
+
+
+def changed(members, since, modified):
+    """
+    Select those of members modified since, a timestamp and
+    the keys, or their count and digest, of the tiddlers already
+    sent from its last second, using the callable modified to get
+    the modified time of each. Return them and the token for the
+    next sync.
+    """
+    timestamp, sent = since
+    digested = not isinstance(sent, frozenset)
+    selected = []
+    boundary = set()
+    latest = timestamp
+    for member in members:
+        member_modified = modified(member)
+        if member_modified is None:
+            continue
+        member_modified = str(member_modified).ljust(14, '0')
+        key = (member.bag, member.title)
+        if member_modified < timestamp:
+            continue
+        if member_modified == timestamp:
+            boundary.add(key)
+            if not digested and key in sent:
+                continue
+        selected.append((member, member_modified, key))
+        latest = max(latest, member_modified)
+
+    if digested and sent == _digest(boundary):
+        selected = [entry for entry in selected if entry[1] != timestamp]
+    if latest == timestamp:
+        latest_keys = boundary if digested else boundary | sent
+    else:
+        latest_keys = set([key for _, member_modified, key in selected
+            if member_modified == latest])
+    return ([member for member, _, _ in selected],
+            since_token(latest, latest_keys))
+
+
+def init_index(config):
+    """
+    Hook INDEX to the store.
+    """
+    hooks = [('tiddler', 'put', INDEX.put), ('tiddler', 'delete',
+        INDEX.delete), ('bag', 'delete', INDEX.delete)]
+    for entity, method, hook in hooks:
+        if hook not in HOOKS[entity][method]:
+            HOOKS[entity][method].append(hook)
+
+
+def parse_since(value):
+    """
+    The timestamp and already sent keys, or their count and
+    digest, in a since parameter, a timestamp or token. Raise
+    ValueError if it is neither.
+    """
+    if value.isdigit() and len(value) <= 14:
+        return value.ljust(14, '0'), frozenset()
+    token = decode_cursor(value)
+    try:
+        if len(token) == 3:
+            timestamp, count, digest = token
+            sent = (int(count), str(digest))
+        else:
+            timestamp, sent = token
+            sent = frozenset([(bag, title) for bag, title in sent])
+        timestamp = str(timestamp)
+    except (TypeError, ValueError):
+        raise ValueError('invalid since: %s' % value)
+    if not timestamp.isdigit() or len(timestamp) != 14:
+        raise ValueError('invalid since: %s' % value)
+    return timestamp, sent
+
+
+def since_token(timestamp, keys):
+    """
+    The token for timestamp and the keys of the tiddlers sent
+    which were modified then, or their count and digest if there
+    are more than SENT_LIMIT.
+    """
+    if len(keys) > SENT_LIMIT:
+        count, digest = _digest(keys)
+        return encode_cursor([timestamp, count, digest])
+    return encode_cursor([timestamp, sorted([list(key) for key in keys])])
+
+
+def _digest(keys):
+    """
+    The count of keys and a digest of them.
+    """
+    digest = sha()
+    for bag, title in sorted(keys):
+        digest.update(('%s\x00%s\x00' % (bag, title)).encode('utf-8'))
+    return len(keys), digest.hexdigest()[:16]
@@ -0,0 +1,285 @@
+"""
+Compressed HAL responses.
+
+HAL documents repeat the same URL prefixes, curie and rels throughout,
+so they compress well. When hal.compress is set in config, the
+HalCompress filter sends HAL responses with a Content-Encoding of br,
+if brotli is installed, or gzip, whichever the client prefers in
+Accept-Encoding. Streamed responses are compressed as they are
+generated, each chunk given to the compressor as it comes, so neither
+the whole body nor its compressed form is held. The compressor is
+flushed after the first chunk and then every FLUSH_BYTES, so the
+start of the document goes out as soon as it is made, as it does
+uncompressed.
+
+Bodies which are sent again and again are kept compressed: the root
+document, in fixups.ROOT_CACHE, and cached collections, in
+cache.CACHE, are compressed once for each encoding asked for, at
+STORED_LEVEL, so repeated hits cost no compression.
+
+A compressed response has its encoding appended to its ETag, as it
+is a different representation. The filter removes that suffix from
+the tags in If-None-Match before the ETag is checked, and puts it
+back on a 304.
+"""
+
+import re
+import zlib
+
+from httpexceptor import HTTP304
+
+
+# Compression levels for bodies compressed as they are sent and for
+# those compressed once and kept.
+STREAM_LEVEL = {'gzip': 6, 'br': 5}
+STORED_LEVEL = {'gzip': 9, 'br': 11}
+
+# The order in which encodings are chosen when equally acceptable.
+PREFERENCE = ['br', 'gzip']
+
+HAL_TYPES = ['application/hal+json', 'application/hal+x-ndjson']
+
+# Bytes given to a streaming compressor between flushes.
+FLUSH_BYTES = 16384
+
+
+class _BrotliCompressor(object):
+    """
+    A streaming brotli compressor with the interface of a zlib
+    compressobj.
+    """
+
+    def __init__(self, brotli, level):
+        self._compressor = brotli.Compressor(quality=level)
+        self._process = (getattr(self._compressor, 'process', None)
+                or self._compressor.compress)
+
+    def compress(self, data):
+        return self._process(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def _gzip_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _brotli_compressor(level):
+    import brotli
+    return _BrotliCompressor(brotli, level)
+
+
+# Name to function returning a compressor at a level. The functions
+# raise ImportError if the library is not installed.
+COMPRESSORS = {
+        'gzip': _gzip_compressor,
+        'br': _brotli_compressor,
+}
+
+# Which of COMPRESSORS can be used, found when first wanted.
+AVAILABLE = {}
+
+
+class HalCompress(object):
+    """
+    WSGI filter which compresses HAL responses in the encoding
+    negotiated from Accept-Encoding.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ)
+        if encoding is None or environ['REQUEST_METHOD'] != 'GET':
+            return self.application(environ, start_response)
+
+        # A tag this filter made names the plain representation
+        # when checked below.
+        revalidating = _strip_if_none_match(environ, encoding)
+        state = {}
+
+        def encoding_start_response(status, headers, exc_info=None):
+            state['started'] = True
+            if _compressible(status, headers):
+                state['encoding'] = encoding
+                headers = encoded_headers(headers, encoding)
+            elif revalidating and status.startswith('304'):
+                headers = encoded_headers(headers, encoding, body=False)
+            return start_response(status, headers, exc_info)
+
+        try:
+            output = self.application(environ, encoding_start_response)
+        except HTTP304, exc:
+            if not revalidating:
+                raise
+            headers = dict([(name.lower(), value) for name, value
+                in encoded_headers(exc.headers(), encoding, body=False)])
+            raise HTTP304(etag=headers.get('etag', ''),
+                    vary=headers.get('vary', ''),
+                    cache_control=headers.get('cache-control', ''),
+                    last_modified=headers.get('last-modified', ''),
+                    content_location=headers.get('content-location', ''),
+                    expires=headers.get('expires', ''))
+
+        if state.get('started') and 'encoding' not in state:
+            return output
+        return self._compressed(output, state)
+
+    def _compressed(self, output, state):
+        """
+        Generate output, compressed if the response is, which is
+        known by the time the first chunk comes. The compressor is
+        flushed after the first chunk and every FLUSH_BYTES after.
+        """
+        compressor = None
+        unflushed = 0
+        try:
+            for chunk in output:
+                if 'encoding' not in state:
+                    yield chunk
+                    continue
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('utf-8')
+                if compressor is None:
+                    compressor = compressor_for(state['encoding'])
+                    unflushed = FLUSH_BYTES
+                data = compressor.compress(chunk)
+                unflushed += len(chunk)
+                if unflushed >= FLUSH_BYTES:
+                    data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                    unflushed = 0
+                if data:
+                    yield data
+            if 'encoding' in state:
+                if compressor is None:
+                    compressor = compressor_for(state['encoding'])
+                yield compressor.flush()
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+
+
+def available(encoding):
+    """
+    True if responses can be compressed with encoding.
+    """
+    try:
+        return AVAILABLE[encoding]
+    except KeyError:
+        try:
+            COMPRESSORS[encoding](1)
+            AVAILABLE[encoding] = True
+        except (KeyError, ImportError):
+            AVAILABLE[encoding] = False
+        return AVAILABLE[encoding]
+
+
+def compress(body, encoding):
+    """
+    body compressed with encoding at STORED_LEVEL, to be kept.
+    """
+    compressor = COMPRESSORS[encoding](STORED_LEVEL[encoding])
+    return compressor.compress(body) + compressor.flush()
+
+
+def compressor_for(encoding):
+    """
+    A compressor for a streamed body, at STREAM_LEVEL.
+    """
+    return COMPRESSORS[encoding](STREAM_LEVEL[encoding])
+
+
+def encoded_etag(etag, encoding):
+    """
+    The ETag of the representation of etag compressed with encoding.
+    """
+    if etag.endswith('"'):
+        return '%s-%s"' % (etag[:-1], encoding)
+    return '%s-%s' % (etag, encoding)
+
+
+def encoded_headers(headers, encoding, body=True):
+    """
+    headers for the same response compressed with encoding. If
+    body, the response has one, which is compressed.
+    """
+    encoded = []
+    vary = None
+    for name, value in headers:
+        lower_name = name.lower()
+        if lower_name == 'content-length' and body:
+            continue
+        if lower_name == 'etag' and value:
+            value = encoded_etag(value, encoding)
+        if lower_name == 'vary':
+            vary = value
+            continue
+        encoded.append((name, value))
+    if body:
+        encoded.append(('Content-Encoding', encoding))
+    encoded.append(('Vary', vary and '%s, Accept-Encoding' % vary
+        or 'Accept-Encoding'))
+    return encoded
+
+
+def negotiate(environ):
+    """
+    The encoding to compress a HAL response with, chosen from
+    Accept-Encoding, None if it is not to be compressed.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    if not config.get('hal.compress', False):
+        return None
+    accepted = {}
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        parameters = coding.split(';')
+        name = parameters[0].strip().lower()
+        quality = 1.0
+        for parameter in parameters[1:]:
+            key, _, value = parameter.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in PREFERENCE:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality and available(encoding):
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressible(status, headers):
+    """
+    True if the response is a complete HAL response not already
+    encoded.
+    """
+    if not status.startswith('200'):
+        return False
+    headers = dict([(name.lower(), value) for name, value in headers])
+    if 'content-encoding' in headers:
+        return False
+    content_type = headers.get('content-type', '')
+    return any([hal_type in content_type for hal_type in HAL_TYPES])
+
+
+def _strip_if_none_match(environ, encoding):
+    """
+    Remove the suffix for encoding from each ETag in If-None-Match
+    that has it. True if any did.
+    """
+    incoming = environ.get('HTTP_IF_NONE_MATCH', '')
+    stripped, count = re.subn(r'-%s"' % re.escape(encoding), '"',
+            incoming)
+    if not count:
+        return False
+    environ['HTTP_IF_NONE_MATCH'] = stripped
+    return True
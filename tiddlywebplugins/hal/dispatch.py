@@ -0,0 +1,193 @@
+"""
+Fast paths for dispatching GETs.
+
+Content negotiation parses the Accept header against every serializer
+type on each GET. Clients send the same few Accept headers over and
+over, so HalNegotiate, which takes the place of the core Negotiate
+filter, keeps the types negotiated for each Accept header and
+extension in NEGOTIATIONS, an LRU of hal.negotiate_cache_size
+(default NEGOTIATE_CACHE_SIZE) entries, 0 to turn it off. Only
+extensions in extension_types are part of the key, as others, such
+as the end of a title with a dot in it, do not change the outcome.
+The result is the same as figure_type, so other serializations are
+unaffected. The decisions depend on the serializers, default
+serializer and extension types in config, so init_dispatch empties
+NEGOTIATIONS when they change. A plugin adding serializers after
+this one is initialized should call it again.
+
+HalDispatch answers GET / for HAL, from the negotiated types, with
+fixups._hal_root, before the request reaches the selector. Nothing
+is replaced in the selector, so plugins which replace the handler
+for / keep working for everything but HAL, whenever they are loaded.
+"""
+
+import threading
+
+from collections import OrderedDict
+
+from tiddlyweb.web.negotiate import figure_type
+
+from .fixups import _hal_root
+
+
+NEGOTIATE_CACHE_SIZE = 256
+
+HAL_TYPE = 'application/hal+json'
+
+
+class DecisionCache(object):
+    """
+    An LRU of negotiated types keyed by Accept and extension.
+    """
+
+    def __init__(self, size=NEGOTIATE_CACHE_SIZE):
+        self.size = size
+        self.stats = {'hits': 0, 'misses': 0}
+        self.fingerprint = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        The decision at key, or None, counting the hit or miss.
+        """
+        with self._lock:
+            try:
+                decision = self._entries.pop(key)
+            except KeyError:
+                self.stats['misses'] += 1
+                return None
+            self._entries[key] = decision
+            self.stats['hits'] += 1
+            return decision
+
+    def put(self, key, decision):
+        """
+        Keep decision at key, dropping the least recently used
+        beyond size.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = decision
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop everything.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+NEGOTIATIONS = DecisionCache()
+
+
+class HalNegotiate(object):
+    """
+    WSGI filter which does what Negotiate does, remembering the
+    outcome for GETs in NEGOTIATIONS.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        negotiate(environ)
+        return self.application(environ, start_response)
+
+
+class HalDispatch(object):
+    """
+    WSGI filter which sends the HAL root document for GET / when
+    HAL is wanted, and passes on everything else.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if (environ['REQUEST_METHOD'] == 'GET' and _is_root(environ)
+                and wants_hal(environ)):
+            return _hal_root(environ, start_response)
+        return self.application(environ, start_response)
+
+
+def init_dispatch(config):
+    """
+    Size NEGOTIATIONS from config and empty it if the serializers,
+    default serializer or extension types, on which the types it
+    holds depend, have changed since it was last initialized.
+    """
+    NEGOTIATIONS.size = int(config.get('hal.negotiate_cache_size',
+        NEGOTIATE_CACHE_SIZE))
+    fingerprint = _fingerprint(config)
+    if fingerprint != NEGOTIATIONS.fingerprint:
+        NEGOTIATIONS.clear()
+        NEGOTIATIONS.fingerprint = fingerprint
+
+
+def negotiate(environ):
+    """
+    Set tiddlyweb.type, and tiddlyweb.extension if there is one,
+    as figure_type does, from NEGOTIATIONS when it can.
+    """
+    if environ['REQUEST_METHOD'].upper() != 'GET' or not NEGOTIATIONS.size:
+        figure_type(environ)
+        return
+
+    extension = _extension(environ.get('PATH_INFO'))
+    if extension in environ['tiddlyweb.config']['extension_types']:
+        key = (environ.get('HTTP_ACCEPT'), extension)
+    else:
+        key = (environ.get('HTTP_ACCEPT'), None)
+    decision = NEGOTIATIONS.get(key)
+    if decision is None:
+        figure_type(environ)
+        NEGOTIATIONS.put(key, tuple(environ['tiddlyweb.type']))
+    else:
+        environ['tiddlyweb.type'] = list(decision)
+        if extension is not None:
+            environ['tiddlyweb.extension'] = extension
+
+
+def wants_hal(environ):
+    """
+    True if HAL is the serialization negotiated, as get_serialize_type
+    would choose it when there is no extension.
+    """
+    serializers = environ['tiddlyweb.config']['serializers']
+    for candidate in environ.get('tiddlyweb.type', []):
+        if candidate in serializers:
+            return candidate == HAL_TYPE
+    return False
+
+
+def _extension(path_info):
+    """
+    The extension on the last segment of path_info, as Negotiate
+    finds it, None if there is none.
+    """
+    if not path_info:
+        return None
+    extension = path_info.rsplit('/', 1)[-1].rsplit('.', 1)
+    if len(extension) == 2:
+        return extension[-1]
+    return None
+
+
+def _fingerprint(config):
+    """
+    What negotiation depends on in config.
+    """
+    return (tuple(sorted(config.get('serializers', {}))),
+            config.get('default_serializer'),
+            tuple(sorted(config.get('extension_types', {}).items())))
+
+
+def _is_root(environ):
+    """
+    True if the request is for the root of the server.
+    """
+    prefix = environ['tiddlyweb.config'].get('server_prefix', '')
+    return environ.get('PATH_INFO', '') in ['%s/' % prefix, prefix or '/']
@@ -0,0 +1,159 @@
+"""
+Emit the HAL structures made by the Serialization directly.
+
+simplehal builds a Links, one or more Link and a HalDocument for
+each entity, only to read back its structure. In large collections
+that churn is most of the work, so here links are dicts of rel to
+link structure and documents are dicts made in place, with constant
+parts, like the curie, built once and shared.
+
+simplehal remains as the reference implementation, used by
+reference_document, which makes the same structures.
+
+Structures are encoded by the JSON backend chosen with set_encoder,
+from hal.json_encoder in config, stdlib json by default.
+"""
+
+import json
+import logging
+
+from simplehal import HalDocument, Links, Link
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+CURIE_HREF = 'http://tiddlyweb.com/relations/{rel}'
+
+# Shared by every document.
+CURIE = {'href': CURIE_HREF, 'templated': True, 'name': 'tiddlyweb'}
+
+
+def link(href, **kwargs):
+    """
+    The structure of a link to href.
+    """
+    structure = {'href': href}
+    if kwargs:
+        structure.update(kwargs)
+    return structure
+
+
+def document(links, data=None, embed=None):
+    """
+    The structure of a HAL document with links, a dict of rel
+    to link structure, or list of them, and optional data and
+    embed. data becomes the document, it is not copied.
+    """
+    if data is None:
+        data = {}
+    data['_links'] = links
+    if embed:
+        data['_embedded'] = embed
+    return data
+
+
+def reference_document(links, data=None, embed=None):
+    """
+    The structure of the same document as document(), made
+    by simplehal.
+    """
+    hal_links = Links()
+    for rel in links:
+        rel_links = links[rel]
+        if not isinstance(rel_links, list):
+            rel_links = [rel_links]
+        for rel_link in rel_links:
+            hal_link = Link(rel, rel_link['href'])
+            hal_link.kwargs = dict([(key, value) for key, value
+                in rel_link.items() if key != 'href'])
+            hal_links.add(hal_link)
+    return HalDocument(hal_links, data=data, embed=embed).structure
+
+
+def _json_encoder():
+    return json.dumps, ', '
+
+
+def _simplejson_encoder():
+    import simplejson
+    return simplejson.dumps, ', '
+
+
+def _ujson_encoder():
+    import ujson
+
+    def dumps(structure):
+        return ujson.dumps(structure, escape_forward_slashes=False)
+    return dumps, ','
+
+
+def _rapidjson_encoder():
+    import rapidjson
+
+    def dumps(structure):
+        output = rapidjson.dumps(structure)
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        return output
+    return dumps, ','
+
+
+def _orjson_encoder():
+    import orjson
+    return orjson.dumps, ','
+
+
+# Name to function returning the dumps function and the separator
+# it puts between list items. The functions raise ImportError if
+# the backend is not installed.
+ENCODERS = {
+        'json': _json_encoder,
+        'simplejson': _simplejson_encoder,
+        'ujson': _ujson_encoder,
+        'rapidjson': _rapidjson_encoder,
+        'orjson': _orjson_encoder,
+}
+
+# The order in which 'auto' tries the backends.
+AUTO_ENCODERS = ['orjson', 'rapidjson', 'ujson', 'json']
+
+# The current backend: name, dumps, list item separator.
+ENCODER = ['json', json.dumps, ', ']
+
+
+def set_encoder(name):
+    """
+    Use the JSON backend called name, or the first available of
+    AUTO_ENCODERS if name is 'auto'. If the backend is unknown or
+    not installed fall back to stdlib json. Return the name of the
+    backend in use.
+    """
+    candidates = AUTO_ENCODERS if name == 'auto' else [name, 'json']
+    for candidate in candidates:
+        try:
+            dumps, separator = ENCODERS[candidate]()
+        except KeyError:
+            LOGGER.warn('unknown HAL json encoder: %s', candidate)
+            continue
+        except ImportError, exc:
+            if name != 'auto':
+                LOGGER.warn('unable to use HAL json encoder %s: %s',
+                        candidate, exc)
+            continue
+        ENCODER[:] = [candidate, dumps, separator]
+        return candidate
+
+
+def item_separator():
+    """
+    The separator the current backend puts between list items.
+    """
+    return ENCODER[2]
+
+
+def to_json(structure):
+    """
+    Encode a document structure as JSON.
+    """
+    return ENCODER[1](structure)
@@ -1,18 +1,26 @@
 """
-A replacement root (/) handler that will send HAL
-instead of the default when asked for HAL.
+The HAL root (/) document.
 
-Unfortunately this will not work alongside other
-plugins which _also_ replace the root handler. This
-is, presumably, a bug.
+It is sent by dispatch.HalDispatch, ahead of whatever handles /
+in the selector, so it works alongside other plugins which replace
+the root handler. replacement_root_handler remains for those who
+install it as the handler for / themselves.
+
+The links of the root document are in ROOT_LINKS. Change them with
+set_root_link and remove_root_link, so the cached documents follow.
 """
 
+import threading
+
+from collections import OrderedDict
+
 import tiddlyweb.web.handler
 
-from tiddlyweb.web.util import get_serialize_type, server_base_url
+from tiddlyweb.util import sha
+from tiddlyweb.web.util import (get_serialize_type, server_base_url,
+        check_incoming_etag)
 
-from simplehal import HalDocument, Links, Link
-from .serialization import Serialization
+from . import compress, emitter
 
 ROOT_LINKS = {
         'self': {'href': '/'},
@@ -20,10 +28,18 @@ ROOT_LINKS = {
         'tiddlyweb:bags': {'href': '/bags'},
         'tiddlyweb:recipes': {'href': '/recipes'},
         'tiddlyweb:search': {'href': '/search{?q}', 'templated': True},
+        'tiddlyweb:batch': {'href': '/batch{?uri*}', 'templated': True},
 }
 
 ORIGINAL_ROOT_HANDLER = tiddlyweb.web.handler.root
 
+# Rendered root documents, their ETags and their compressed forms,
+# keyed by server base and ROOT_LINKS, least recently used first.
+# See _hal_root.
+ROOT_CACHE = OrderedDict()
+ROOT_CACHE_SIZE = 16
+ROOT_CACHE_LOCK = threading.Lock()
+
 
 def replacement_root_handler(environ, start_response):
     """
@@ -39,23 +55,88 @@ def replacement_root_handler(environ, start_response):
 
 def _hal_root(environ, start_response):
     """
-    Compose a root HAL document linking to bags and recipes.
-    """
+    Send the root HAL document linking to bags and recipes, with
+    a strong ETag, or a 304 if that ETag is in If-None-Match.
 
+    The document only varies with the server base URL, from
+    config, the JSON encoder and ROOT_LINKS, so it is rendered
+    once for each of those and kept in ROOT_CACHE, along with
+    it compressed in each encoding negotiated by compress.
+    """
     server_base = server_base_url(environ)
-    links = Links()
+    cache_key = (server_base, emitter.ENCODER[0], ROOT_LINKS_KEY[0])
+    with ROOT_CACHE_LOCK:
+        entry = ROOT_CACHE.pop(cache_key, None)
+        if entry is not None:
+            ROOT_CACHE[cache_key] = entry
+    if entry is None:
+        body = _render_root(server_base)
+        entry = (body, '"%s"' % sha(body).hexdigest(), {})
+        with ROOT_CACHE_LOCK:
+            ROOT_CACHE[cache_key] = entry
+            while len(ROOT_CACHE) > ROOT_CACHE_SIZE:
+                ROOT_CACHE.popitem(last=False)
+    body, etag, encoded = entry
+
+    check_incoming_etag(environ, etag)
+
+    headers = [
+        ('Content-Type', 'application/hal+json; charset=UTF-8'),
+        ('Cache-Control', 'no-cache'),
+        ('Vary', 'Accept'),
+        ('ETag', etag)]
+    encoding = compress.negotiate(environ)
+    if encoding:
+        try:
+            body = encoded[encoding]
+        except KeyError:
+            body = encoded[encoding] = compress.compress(body, encoding)
+        headers = compress.encoded_headers(headers, encoding)
+    start_response('200 OK', headers)
+    return [body]
+
+
+def _render_root(server_base):
+    """
+    Compose a root HAL document linking to bags and recipes.
+    """
+    links = {'curie': emitter.CURIE}
     for rel in ROOT_LINKS:
-        link = Link(rel, '%s%s' % (server_base, ROOT_LINKS[rel]['href']))
-        kwargs = {}
-        for key in ROOT_LINKS[rel]:
-            if key is not 'href':
-                kwargs[key] = ROOT_LINKS[rel][key]
-        link.kwargs = kwargs
-        links.add(link)
-    links.add(Serialization.Curie)
-
-    hal = HalDocument(links)
-
-    start_response('200 OK', [('Content-Type',
-        'application/hal+json; charset=UTF-8')])
-    return [hal.to_json()]
+        kwargs = dict([(key, value) for key, value
+            in ROOT_LINKS[rel].items() if key != 'href'])
+        links[rel] = emitter.link('%s%s' % (server_base,
+            ROOT_LINKS[rel]['href']), **kwargs)
+    return emitter.to_json(emitter.document(links))
+
+
+def set_root_link(rel, href, **attributes):
+    """
+    Link the root document to href, a path, with rel, replacing
+    any link with that rel. attributes, such as templated or type,
+    are added to the link.
+    """
+    link = dict(attributes)
+    link['href'] = href
+    ROOT_LINKS[rel] = link
+    ROOT_LINKS_KEY[0] = _root_links_key()
+
+
+def remove_root_link(rel):
+    """
+    Remove the link with rel from the root document.
+    """
+    ROOT_LINKS.pop(rel, None)
+    ROOT_LINKS_KEY[0] = _root_links_key()
+
+
+def _root_links_key():
+    """
+    A hashable form of ROOT_LINKS, so the cache follows changes
+    to it.
+    """
+    return tuple(sorted([(rel, tuple(sorted(ROOT_LINKS[rel].items())))
+        for rel in ROOT_LINKS]))
+
+
+# _root_links_key() of ROOT_LINKS as last set.
+ROOT_LINKS_KEY = [_root_links_key()]
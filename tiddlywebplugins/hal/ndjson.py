@@ -0,0 +1,70 @@
+"""
+A HAL serialization of collections as newline delimited JSON.
+
+The first line is the collection's HAL document without its
+_embedded, holding the _links (including any paging and next-sync
+links). Each line after is one embedded entity, just as it would
+be embedded in the HAL document. A single entity is its HAL
+document on one line.
+
+Collections of tiddlers are generated a line at a time, so neither
+end need hold the whole collection.
+"""
+
+from itertools import chain
+
+from .serialization import Serialization as HAL
+
+
+class Serialization(HAL):
+    """
+    Send HAL collections as a header record then one record
+    per entity.
+    """
+
+    def list_tiddlers(self, tiddlers):
+        """
+        Generate the records of a collection of tiddlers.
+        """
+        tiddlers, sync = self._since_tiddlers(tiddlers)
+        tiddlers, page = self._page_tiddlers(tiddlers)
+        compact = self._compact() and self._tiddlers_templated(tiddlers)
+        return self._tiddler_records(tiddlers, page, compact, sync)
+
+    def _list_collection(self, entities, self_name, embed_name):
+        """
+        The records of a collection of bags or recipes.
+        """
+        entities, page = self._page_entities(entities)
+        compact = self._compact()
+        links = self._collection_links(self_name, embed_name, page, compact)
+        records = [self._document(links)]
+        records.extend(self._embedded_entities(entities, self_name, compact))
+        return ''.join([self._to_json(record) for record in records])
+
+    def _tiddler_records(self, tiddlers, page, compact, sync):
+        """
+        Generate the header record then each tiddler. The collection
+        links are determined from the first tiddler, as when
+        streaming HAL.
+        """
+        tiddlers_iter = iter(self._members(self._prefetched(tiddlers)))
+        info_tiddler = None
+        for info_tiddler in tiddlers_iter:
+            break
+
+        yield self._to_json(self._tiddlers_document(tiddlers, info_tiddler,
+            None, page, compact, sync))
+        if info_tiddler is None:
+            return
+
+        for document in self._embedded_tiddlers(
+                chain([info_tiddler], tiddlers_iter),
+                tiddlers.is_revisions, compact):
+            yield self._to_json(document)
+
+    def _to_json(self, structure):
+        """
+        Encode structure as one line of JSON.
+        """
+        return HAL._to_json(self, structure) + '\n'
@@ -0,0 +1,73 @@
+"""
+Keyset pagination of collections.
+
+A page is the size smallest members of a collection whose key
+sorts after the cursor. Resuming at a cursor costs the same as
+reading the first page, one pass over the collection, as there is
+no offset to count off. As a cursor names a position in the key
+order, not an offset, pages do not shift when members are added
+or removed elsewhere in the collection.
+
+A collection which has an order of its own, such as a sorted one,
+is paged with each member keyed by its position in that order.
+"""
+
+import heapq
+import json
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def encode_cursor(key):
+    """
+    Turn a key into an opaque, URL safe cursor.
+    """
+    return urlsafe_b64encode(json.dumps(key)).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor back into a key. Raise ValueError if it
+    is not one of ours.
+    """
+    try:
+        cursor = str(cursor)
+        cursor += '=' * (-len(cursor) % 4)
+        key = json.loads(urlsafe_b64decode(cursor))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('invalid cursor: %s' % cursor)
+    if not isinstance(key, list):
+        raise ValueError('invalid cursor: %s' % cursor)
+    return tuple(key)
+
+
+def page(members, key, size, after=None):
+    """
+    Return the size members which follow after in key order and
+    the cursor for the next page, None if there is no next page.
+    """
+    if after is not None:
+        members = (member for member in members if key(member) > after)
+    selected = heapq.nsmallest(size + 1, members, key=key)
+    if len(selected) > size:
+        return selected[:size], encode_cursor(key(selected[size - 1]))
+    return selected, None
+
+
+def previous(members, key, size, after):
+    """
+    Return whether there is a page before the page which follows
+    after and, if so, the cursor for it. The cursor is None when
+    the previous page is the first.
+    """
+    preceding = heapq.nlargest(size + 1,
+            (member for member in members if key(member) <= after),
+            key=key)
+    if not preceding:
+        return False, None
+    if len(preceding) > size:
+        return True, encode_cursor(key(preceding[size]))
+    return True, None
@@ -0,0 +1,118 @@
+"""
+Loading the tiddlers of a collection in batches.
+
+A Tiddlers collection holds references, loading each tiddler from
+the store as it is iterated. When a HAL listing includes the text
+of each tiddler (fat=1) and hal.prefetch_threads is set in config,
+the references are instead loaded a batch at a time by a shared pool
+of that many threads, which overlaps the reads of stores, like the
+text store, where loading is mostly waiting on I/O. Tiddlers are
+still produced in the order of the collection. One batch, of
+hal.prefetch_batch (default PREFETCH_BATCH) tiddlers, is loaded
+while the one before is used, so no more than two are held.
+
+There is one pool, made with hal.prefetch_threads threads when first
+wanted. It is closed at exit, or by close_pool, after which the next
+fat listing makes a new one, so a changed hal.prefetch_threads takes
+effect.
+
+The store must be safe to read from several threads at once.
+"""
+
+import atexit
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import StoreError
+
+
+PREFETCH_BATCH = 64
+
+# The shared pool, once made.
+POOL = []
+POOL_LOCK = threading.Lock()
+
+
+def get_pool(size):
+    """
+    The shared pool, made with size threads if there is none.
+    """
+    with POOL_LOCK:
+        if not POOL:
+            POOL.append(ThreadPool(size))
+        return POOL[0]
+
+
+def close_pool():
+    """
+    Close the shared pool, if there is one, once the work given
+    to it is done.
+    """
+    with POOL_LOCK:
+        if not POOL:
+            return
+        pool = POOL.pop()
+    pool.close()
+    pool.join()
+
+
+atexit.register(close_pool)
+
+
+def loaded(store, references, threads, batch_size=PREFETCH_BATCH):
+    """
+    Generate the tiddlers named by references, in order, loading
+    them batch_size at a time with a pool of threads. Tiddlers
+    which are already loaded are passed through, those no longer
+    in the store are skipped.
+    """
+    pool = get_pool(threads)
+
+    def load(tiddler):
+        if tiddler.store:
+            return tiddler
+        try:
+            return store.get(_copy(tiddler))
+        except StoreError:
+            return None
+
+    # Load the next batch while the current one is used.
+    pending = None
+    for batch in _batches(references, batch_size):
+        loading = pool.map_async(load, batch)
+        if pending is not None:
+            for tiddler in pending.get():
+                if tiddler is not None:
+                    yield tiddler
+        pending = loading
+    if pending is not None:
+        for tiddler in pending.get():
+            if tiddler is not None:
+                yield tiddler
+
+
+def _batches(references, batch_size):
+    """
+    Generate lists of batch_size of references.
+    """
+    batch = []
+    for reference in references:
+        batch.append(reference)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy(reference):
+    """
+    A copy of reference to load, so the collection keeps just
+    the reference.
+    """
+    tiddler = Tiddler(reference.title, reference.bag)
+    tiddler.revision = reference.revision
+    tiddler.recipe = reference.recipe
+    return tiddler
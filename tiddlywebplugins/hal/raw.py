@@ -0,0 +1,136 @@
+"""
+The raw content of a tiddler, with support for byte ranges.
+
+GET /bags/{bag_name}/tiddlers/{tiddler_name}/raw, or the same
+below /revisions/{revision}, sends the text of the tiddler as is,
+with its type. A Range header of a single bytes range gets a 206
+of just that range, unless an If-Range does not match the ETag.
+Other ranges get the whole content.
+
+With hal.binary_links set in config, HAL documents of binary
+tiddlers link here with an enclosure rel, in place of including
+their base64 encoded text.
+"""
+
+import re
+
+from httpexceptor import HTTP404
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, NoTiddlerError
+from tiddlyweb.util import binary_tiddler
+from tiddlyweb.web.util import (check_incoming_etag, encode_name,
+        get_route_value, http_date_from_timestamp)
+
+
+RAW_ROUTES = [
+        '/bags/{bag_name:segment}/tiddlers/{tiddler_name:segment}/raw',
+        '/bags/{bag_name:segment}/tiddlers/{tiddler_name:segment}'
+            '/revisions/{revision:segment}/raw',
+]
+
+BYTES_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_raw(environ, start_response):
+    """
+    Send the raw content of the tiddler in the route, or the
+    requested range of it.
+    """
+    tiddler = _get_tiddler(environ)
+    content = tiddler.text or ''
+    if not binary_tiddler(tiddler):
+        content = content.encode('utf-8')
+    length = len(content)
+
+    etag = '"%s/%s/%s:%s"' % (encode_name(tiddler.bag),
+            encode_name(tiddler.title), tiddler.revision, tiddler.modified)
+    last_modified = http_date_from_timestamp(tiddler.modified)
+    check_incoming_etag(environ, etag, last_modified=last_modified)
+
+    headers = [
+        ('Content-Type', tiddler.type or 'text/plain; charset=UTF-8'),
+        ('Accept-Ranges', 'bytes'),
+        ('Cache-Control', 'no-cache'),
+        ('ETag', etag),
+        ('Last-Modified', last_modified)]
+
+    byte_range = _requested_range(environ, etag, length)
+    if byte_range is None:
+        headers.append(('Content-Length', str(length)))
+        start_response('200 OK', headers)
+        return [content]
+
+    if not byte_range:
+        start_response('416 Requested Range Not Satisfiable',
+                [('Content-Range', 'bytes */%s' % length)])
+        return []
+
+    start, end = byte_range
+    headers.extend([('Content-Length', str(end - start + 1)),
+        ('Content-Range', 'bytes %s-%s/%s' % (start, end, length))])
+    start_response('206 Partial Content', headers)
+    return [content[start:end + 1]]
+
+
+def raw_url(tiddler_url, tiddler, is_revision=False):
+    """
+    The URL of the raw content of tiddler, at tiddler_url.
+    """
+    if is_revision:
+        return '%s/revisions/%s/raw' % (tiddler_url,
+                encode_name(unicode(tiddler.revision)))
+    return '%s/raw' % tiddler_url
+
+
+def _get_tiddler(environ):
+    """
+    Load the tiddler in the route, checking the user may read it.
+    """
+    store = environ['tiddlyweb.store']
+    tiddler = Tiddler(get_route_value(environ, 'tiddler_name'),
+            get_route_value(environ, 'bag_name'))
+    try:
+        tiddler.revision = int(get_route_value(environ, 'revision'))
+    except KeyError:
+        pass
+    except ValueError, exc:
+        raise HTTP404('%s not found, bad revision: %s' % (tiddler.title, exc))
+
+    try:
+        bag = store.get(Bag(tiddler.bag))
+        bag.policy.allows(environ['tiddlyweb.usersign'], 'read')
+        return store.get(tiddler)
+    except NoBagError, exc:
+        raise HTTP404('%s not found, no bag %s: %s'
+                % (tiddler.title, tiddler.bag, exc))
+    except NoTiddlerError, exc:
+        raise HTTP404('%s not found: %s' % (tiddler.title, exc))
+
+
+def _requested_range(environ, etag, length):
+    """
+    The first and last byte of the range requested, None to send
+    the whole content or () if the range cannot be satisfied.
+    """
+    match = BYTES_RANGE.match(environ.get('HTTP_RANGE', '').strip())
+    if not match or not any(match.groups()):
+        return None
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if not suffix or not length:
+            return ()
+        return max(length - suffix, 0), length - 1
+    start = int(first)
+    if start >= length:
+        return ()
+    end = min(int(last), length - 1) if last else length - 1
+    if end < start:
+        return None
+    return start, end
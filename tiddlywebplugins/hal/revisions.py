@@ -0,0 +1,140 @@
+"""
+Lazily loaded, range limited collections of revisions.
+
+GET on the revisions of a tiddler, in a bag or through a recipe,
+lists just the revision numbers from the store and makes a collection
+of references to them, so only the revisions which are sent are ever
+loaded. The core handler loads every revision as it makes the
+collection, which for tiddlers with long histories is most of the
+request.
+
+newest and oldest in the query limit the collection to the revisions
+between them, inclusive. In HAL, count (or page_size) sends that many
+revisions, newest first, with next and prev links to the pages either
+side, so ?count=20 is the latest 20.
+"""
+
+from httpexceptor import HTTP400, HTTP404
+
+from tiddlyweb.control import determine_bag_from_recipe
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import (NoBagError, NoRecipeError, NoTiddlerError,
+        StoreError, StoreMethodNotImplemented)
+from tiddlyweb.web.sendtiddlers import send_tiddlers
+from tiddlyweb.web.util import get_route_value, tiddler_url
+
+
+REVISIONS_PATHS = [
+        '/bags/_/tiddlers/_/revisions',
+        '/recipes/_/tiddlers/_/revisions',
+]
+
+
+def get_revisions(environ, start_response):
+    """
+    Send the revisions, in the requested range, of the tiddler
+    in the route.
+    """
+    store = environ['tiddlyweb.store']
+    tiddler = _revisions_tiddler(environ)
+    try:
+        revisions = store.list_tiddler_revisions(tiddler)
+    except NoTiddlerError, exc:
+        raise HTTP404('tiddler %s not found, %s' % (tiddler.title, exc))
+    except NoBagError, exc:
+        raise HTTP404('tiddler %s not found, bag %s does not exist, %s'
+                % (tiddler.title, tiddler.bag, exc))
+    except StoreMethodNotImplemented:
+        raise HTTP400('no revision support')
+    revisions = _in_range(environ, revisions)
+
+    title = 'Revisions of Tiddler %s' % tiddler.title
+    title = environ['tiddlyweb.query'].get('title', [title])[0]
+    container = 'recipes' if tiddler.recipe else 'bags'
+
+    tiddlers = Tiddlers(title=title)
+    tiddlers.is_revisions = True
+    tiddlers.link = '%s/revisions' % tiddler_url(environ, tiddler,
+            container=container, full=False)
+    tiddlers.recipe = tiddler.recipe
+    tiddlers.bag = tiddler.bag
+    for revision in revisions:
+        reference = Tiddler(tiddler.title, tiddler.bag)
+        reference.revision = revision
+        reference.recipe = tiddler.recipe
+        tiddlers.add(reference)
+
+    # The references have no modified time of their own, the newest
+    # revision is the last modified.
+    tiddlers.modified = '0'
+    if revisions:
+        newest = Tiddler(tiddler.title, tiddler.bag)
+        newest.revision = revisions[0]
+        try:
+            tiddlers.modified = str(store.get(newest).modified).ljust(14, '0')
+        except StoreError:
+            pass
+
+    # Set last so the references are loaded as they are iterated.
+    tiddlers.store = store
+    return send_tiddlers(environ, start_response, tiddlers=tiddlers)
+
+
+def _in_range(environ, revisions):
+    """
+    The revisions between newest and oldest in the query, if
+    they are there, in the order listed.
+    """
+    newest = _revision_bound(environ, 'newest')
+    oldest = _revision_bound(environ, 'oldest')
+    return [revision for revision in revisions
+            if (newest is None or int(revision) <= newest)
+            and (oldest is None or int(revision) >= oldest)]
+
+
+def _revision_bound(environ, name):
+    """
+    The revision named by name in the query, None if there is
+    none.
+    """
+    value = environ['tiddlyweb.query'].get(name, [None])[0]
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError, exc:
+        raise HTTP400('unable to select revisions, bad %s: %s'
+                % (name, exc))
+
+
+def _revisions_tiddler(environ):
+    """
+    The tiddler in the route, with its bag found through its
+    recipe if there is one, if the current user may read it.
+    """
+    store = environ['tiddlyweb.store']
+    tiddler = Tiddler(get_route_value(environ, 'tiddler_name'))
+    try:
+        recipe_name = get_route_value(environ, 'recipe_name')
+    except KeyError:
+        tiddler.bag = get_route_value(environ, 'bag_name')
+    else:
+        try:
+            recipe = store.get(Recipe(recipe_name))
+            tiddler.bag = determine_bag_from_recipe(recipe, tiddler,
+                    environ).name
+        except (NoRecipeError, NoBagError), exc:
+            raise HTTP404('%s not found via recipe, %s'
+                    % (tiddler.title, exc))
+        tiddler.recipe = recipe_name
+
+    try:
+        bag = store.get(Bag(tiddler.bag))
+    except NoBagError, exc:
+        raise HTTP404('tiddler %s not found, bag %s does not exist, %s'
+                % (tiddler.title, tiddler.bag, exc))
+    bag.policy.allows(environ['tiddlyweb.usersign'], 'read')
+    return tiddler
@@ -3,17 +3,43 @@ A HAL Serialization for bags, recipes, tiddlers, composition only.
 """
 
 from base64 import b64encode
+from difflib import SequenceMatcher
+from itertools import chain
+from urllib import quote
+
+from httpexceptor import HTTP400
 
 from tiddlyweb.model.bag import Bag
 from tiddlyweb.model.collections import Tiddlers
-from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.policy import PermissionsError, Policy
 from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import NoBagError, NoRecipeError, StoreError
 from tiddlyweb.serializations.json import Serialization as JSON
-from tiddlyweb.web.util import (bag_url, recipe_url, tiddler_url,
-        encode_name, server_base_url, get_route_value)
-from tiddlyweb.util import binary_tiddler
+from tiddlyweb.web.util import (encode_name, server_base_url,
+        server_host_url, get_route_value)
+from tiddlyweb.util import binary_tiddler, renderable
+from tiddlyweb.web.handler.tiddler import CANONICAL_URI_FIELD
+from tiddlyweb.wikitext import render_wikitext
+
+from simplehal import Link
+
+from . import changes, emitter, paging, prefetch
+from .emitter import CURIE, CURIE_HREF, link
+from .raw import raw_url
+
 
-from simplehal import HalDocument, Links, Link
+# The profile, in Accept or the document, for collections whose
+# embedded items have no _links of their own.
+COMPACT_PROFILE = 'http://tiddlyweb.com/profiles/compact'
+
+# The profile for revision collections where each revision after the
+# first is embedded as the changes from the one before it.
+DELTA_PROFILE = 'http://tiddlyweb.com/profiles/delta'
+
+# Stands in for the embedded entities when splitting an encoded
+# document into its head and tail.
+STREAM_MARKER = '__tiddlywebplugins.hal.stream__'
 
 
 class Serialization(JSON):
@@ -26,125 +52,444 @@ class Serialization(JSON):
     the as_* methods, for handling writes
     """
 
-    # To, eventually, have some discoverability.
-    Curie = Link('curie', 'http://tiddlyweb.com/relations/{rel}',
-            templated=True, name='tiddlyweb')
+    # To, eventually, have some discoverability. The simplehal
+    # form of emitter.CURIE, for those building simplehal documents.
+    Curie = Link('curie', CURIE_HREF, templated=True, name='tiddlyweb')
+
+    def __init__(self, environ=None):
+        JSON.__init__(self, environ)
+        config = self.environ.get('tiddlyweb.config', {})
+        if config.get('hal.emitter') == 'simplehal':
+            self._make_document = emitter.reference_document
+        else:
+            self._make_document = emitter.document
+        timing = self.environ.get('tiddlyweb.hal.timing')
+        if timing is not None:
+            timing.instrument(self)
 
     def list_bags(self, bags):
         """
         Create a list of (embedded) bags.
         """
-        return self._list_collection(bags, 'bags', 'bag', bag_url)
+        return self._list_collection(bags, 'bags', 'bag')
 
     def list_recipes(self, recipes):
         """
         Create a list of embedded recipes.
         """
-        return self._list_collection(recipes, 'recipes', 'recipe', recipe_url)
+        return self._list_collection(recipes, 'recipes', 'recipe')
 
     def list_tiddlers(self, tiddlers):
         """
         Create a list of embedded tiddlers. What link rels are needed
         is dependent on context, which we have to...guess.
-        """
 
-        hal_entities, embed_name, info_tiddler = self._embedded_tiddlers(
-                tiddlers)
-
-        tiddler_links = self._tiddlers_links(tiddlers, info_tiddler)
+        If hal.stream is set in config, return a generator of
+        chunks instead of a single string. See _stream_tiddlers.
+        Otherwise the same chunks are joined, so each embedded
+        tiddler is encoded as soon as it is made and only its JSON
+        is kept until the end.
 
-        links = Links()
-        for rel in tiddler_links:
-            links.add(Link(rel, tiddler_links[rel]))
-        links.add(self.Curie)
+        Revisions in the delta profile (DELTA_PROFILE) are the
+        newest in full, with its text, then each of the others as
+        the changes from the one before it.
+        """
+        tiddlers, sync = self._since_tiddlers(tiddlers)
+        tiddlers, page = self._page_tiddlers(tiddlers)
+        compact = self._compact() and self._tiddlers_templated(tiddlers)
 
-        hal_doc = HalDocument(links, embed={embed_name: hal_entities})
-        return hal_doc.to_json()
+        chunks = self._stream_tiddlers(tiddlers, page, compact, sync)
+        config = self.environ.get('tiddlyweb.config', {})
+        if config.get('hal.stream', False):
+            return chunks
+        return ''.join(chunks)
 
     def bag_as(self, bag):
         """
         A single bag as HAL
         """
-        bag_uri = bag_url(self.environ, bag, full=True)
+        return self._to_json(self._bag_document(bag))
+
+    def recipe_as(self, recipe):
+        return self._to_json(self._recipe_document(recipe))
+
+    def tiddler_as(self, tiddler):
+        """
+        A single tiddler or revision as HAL. If hal.binary_links
+        is set in config, a binary tiddler has an enclosure link
+        to its raw content instead of its text. If embed in the
+        query lists bag or recipe, they are embedded.
+        """
+        return self._to_json(self._tiddler_document(tiddler))
+
+    def _bag_document(self, bag):
+        """
+        The structure of the HAL document of a bag.
+        """
+        bag_uri = self._container_url('bags', bag.name)
         entity_structure = dict(policy=self._get_policy(bag.policy),
                 desc=bag.desc, name=bag.name)
-        return self._entity_as(entity_structure, bag_uri, 'bags')
+        return self._entity_document(entity_structure, bag_uri, 'bags')
 
-    def recipe_as(self, recipe):
-        recipe_uri = recipe_url(self.environ, recipe, full=True)
+    def _recipe_document(self, recipe):
+        """
+        The structure of the HAL document of a recipe.
+        """
+        recipe_uri = self._container_url('recipes', recipe.name)
         entity_structure = dict(policy=self._get_policy(recipe.policy),
                 desc=recipe.desc, name=recipe.name, recipe=recipe.get_recipe())
-        return self._entity_as(entity_structure, recipe_uri, 'recipes')
+        return self._entity_document(entity_structure, recipe_uri, 'recipes')
 
-    def tiddler_as(self, tiddler):
-        links = Links()
-        links.add(self.Curie)
-
-        if 'revision' in self.environ['wsgiorg.routing_args'][1]:
-            for link in self._revision_links(tiddler):
-                links.add(link)
+    def _tiddler_document(self, tiddler):
+        """
+        The structure of the HAL document of a tiddler, or of a
+        revision if there is one in the route.
+        """
+        is_revision = 'revision' in self.environ['wsgiorg.routing_args'][1]
+        if is_revision:
+            links = self._revision_links(tiddler)
         else:
-            for link in self._tiddler_links(tiddler):
-                links.add(link)
+            links = self._tiddler_links(tiddler)
+        links['curie'] = CURIE
+
+        fat = True
+        if self._binary_links(tiddler):
+            links['enclosure'] = self._enclosure_link(tiddler, is_revision)
+            fat = False
+
+        return self._document(links, data=self._tiddler_dict(tiddler,
+            fat=fat, render=self._render()),
+            embed=self._tiddler_embed(tiddler))
+
+    def _tiddler_embed(self, tiddler):
+        """
+        The documents of the bag and recipe of tiddler, if listed
+        in embed in the query and readable by the current user.
+        """
+        query = self.environ.get('tiddlyweb.query', {})
+        wanted = set([name.strip() for value in query.get('embed', [])
+            for name in value.split(',')])
+        embed = {}
+        if 'bag' in wanted:
+            bag = self._readable_entity(Bag, tiddler.bag)
+            if bag is not None:
+                embed['tiddlyweb:bag'] = self._bag_document(bag)
+        if 'recipe' in wanted and tiddler.recipe:
+            recipe = self._readable_entity(Recipe, tiddler.recipe)
+            if recipe is not None:
+                embed['tiddlyweb:recipe'] = self._recipe_document(recipe)
+        return embed
+
+    def _readable_entity(self, entity_class, name):
+        """
+        The bag or recipe, according to entity_class, called name,
+        if it exists and the current user may read it, otherwise
+        None. Each is loaded from the store at most once a request.
+        """
+        entities = self.environ.setdefault('tiddlyweb.hal.entities', {})
+        key = (entity_class.__name__, name)
+        try:
+            entity = entities[key]
+        except KeyError:
+            try:
+                entity = self.environ['tiddlyweb.store'].get(
+                        entity_class(name))
+            except (NoBagError, NoRecipeError):
+                entity = None
+            entities[key] = entity
+        if entity is None:
+            return None
+        try:
+            entity.policy.allows(self.environ['tiddlyweb.usersign'], 'read')
+        except PermissionsError:
+            return None
+        return entity
+
+    def _container_url(self, container, name):
+        """
+        The URL of the bag or recipe (according to container) called
+        name. Remembered for the life of the serialization, which is
+        one request, as most tiddlers in a collection share one.
+        """
+        if not hasattr(self, '_container_url_cache'):
+            self._container_url_cache = {}
+        try:
+            return self._container_url_cache[(container, name)]
+        except KeyError:
+            url = '%s/%s/%s' % (self._server_base(), container,
+                    encode_name(name))
+            self._container_url_cache[(container, name)] = url
+            return url
+
+    def _document(self, links, data=None, embed=None):
+        """
+        Make the structure of a HAL document. If hal.emitter is
+        'simplehal' in config use simplehal, the reference
+        implementation, otherwise emit the structure directly.
+        Which is read once, when the serialization is made.
+        """
+        return self._make_document(links, data, embed)
+
+    def _compact(self):
+        """
+        True if the compact profile is wanted, by compact=1 in the
+        query or COMPACT_PROFILE in the profile parameter of a HAL
+        type in Accept.
+        """
+        return self._profile_wanted('compact', COMPACT_PROFILE)
+
+    def _delta(self):
+        """
+        True if the delta profile is wanted, by delta=1 in the query
+        or DELTA_PROFILE in the profile parameter of a HAL type in
+        Accept.
+        """
+        return self._profile_wanted('delta', DELTA_PROFILE)
 
-        hal_entity = HalDocument(links, data=self._tiddler_dict(
-            tiddler, fat=True))
-        return hal_entity.to_json()
+    def _profile_wanted(self, parameter, profile):
+        """
+        True if parameter is 1 or true in the query or profile is
+        in the profile parameter of a HAL type in Accept.
+        """
+        query = self.environ.get('tiddlyweb.query', {})
+        if query.get(parameter, [''])[0] in ['1', 'true']:
+            return True
+        for media_range in self.environ.get('HTTP_ACCEPT', '').split(','):
+            parameters = media_range.split(';')
+            if parameters[0].strip() != 'application/hal+json':
+                continue
+            for parameter in parameters[1:]:
+                name, _, value = parameter.partition('=')
+                if (name.strip() == 'profile' and profile
+                        in value.strip().strip('"').split()):
+                    return True
+        return False
 
-    def _embedded_entities(self, entities, url_maker):
+    def _embedded_entities(self, entities, container, compact=False):
         """
-        Calculate the entities embedded in bags or recipes.
+        Generate the entities embedded in bags or recipes.
         """
+        if compact:
+            return ({'name': entity.name}
+                    for entity in self._members(entities))
+
         def make_document(entity):
-            links = Links()
-            links.add(Link('self',
-                url_maker(self.environ, entity, full=True)))
-            return HalDocument(links, data={'name': entity.name}).structure
+            links = {'self': link(
+                self._container_url(container, entity.name))}
+            return self._document(links, data={'name': entity.name})
+
+        return (make_document(entity) for entity in self._members(entities))
+
+    def _embedded_tiddlers(self, members, is_revisions, compact=False):
+        """
+        Generate the embedded form of each of members. In the delta
+        profile each revision but the first is embedded as a delta
+        against the one before it.
+        """
+        if not (is_revisions and self._delta()):
+            for tiddler in members:
+                yield self._embedded_tiddler(tiddler, is_revisions, compact)
+            return
+        neighbour = None
+        for tiddler in members:
+            yield self._embedded_tiddler(tiddler, True, compact, neighbour)
+            neighbour = tiddler
+
+    def _embedded_tiddler(self, tiddler, is_revision, compact=False,
+            neighbour=None):
+        """
+        A single tiddler or revision, as embedded in a collection.
+        If compact, just the data, without the uri, which the
+        templated link of the collection gives. If fat, or a
+        revision in the delta profile, with the text, or the
+        enclosure link for a binary tiddler when hal.binary_links
+        is set. If neighbour, the revision embedded before this
+        one, the data is the delta from it.
+        """
+        fat = self._fat() or (is_revision and self._delta())
+        wanted = self._wanted_fields()
+        with_text = fat if wanted is None else 'text' in wanted
+        enclosure = with_text and self._binary_links(tiddler)
+        if neighbour is not None:
+            data = self._delta_dict(tiddler, neighbour, text=not enclosure)
+        else:
+            data = self._tiddler_dict(tiddler, fat=fat and not enclosure,
+                    render=self._render(), uri=not compact)
+        if compact:
+            return data
+        tiddler_link = self._tiddler_url(tiddler)
+        if is_revision:
+            tiddler_link += '/revisions/%s' % encode_name(
+                    unicode(tiddler.revision))
+        links = {'self': link(tiddler_link)}
+        if enclosure:
+            links['enclosure'] = self._enclosure_link(tiddler, is_revision)
+        return self._document(links, data=data)
+
+    def _delta_dict(self, tiddler, neighbour, text=True):
+        """
+        The revision tiddler as the changes from neighbour: its
+        revision and those attributes which differ. If text, and
+        the text differs, the text is a text_delta, a list of
+        [start, end, text] meaning replace the lines of the
+        neighbour's text from start up to end with text. Applied
+        last first the line numbers of the rest are not changed.
+        The text of binary tiddlers is given whole.
+        """
+        wanted = self._wanted_fields()
+        data = {'revision': tiddler.revision}
+        for attribute in tiddler.slots:
+            if attribute in ['text', 'store', 'revision']:
+                continue
+            if wanted is not None and attribute not in wanted:
+                continue
+            value = getattr(tiddler, attribute, None)
+            if value != getattr(neighbour, attribute, None):
+                data[attribute] = value
+        if not text or (wanted is not None and 'text' not in wanted):
+            return data
+        if tiddler.text == neighbour.text and tiddler.type == neighbour.type:
+            return data
+        if binary_tiddler(tiddler) or binary_tiddler(neighbour):
+            data['text'] = _text_value(tiddler)
+        else:
+            data['text_delta'] = _text_delta(neighbour.text or '',
+                    tiddler.text or '')
+        return data
 
-        return [make_document(entity) for entity in entities]
+    def _tiddlers_embed_name(self, tiddlers):
+        """
+        The rel under which the members of tiddlers are embedded.
+        """
+        if tiddlers.is_revisions:
+            return 'tiddlyweb:revision'
+        return 'tiddlyweb:tiddler'
 
-    def _embedded_tiddlers(self, tiddlers):
+    def _tiddlers_document(self, tiddlers, info_tiddler, embed,
+            page=None, compact=False, sync=None):
         """
-        Calculate the embedded tiddlers, return them, a
-        embed rel and if appropriate a single tiddler
-        holding bag and/or recipe information.
+        The HAL document for a tiddlers collection, with embed
+        as its embedded entities. If compact, add the profile
+        and the templates which stand in for the item links. If
+        sync, a since token, add the next-sync link. When paged,
+        that is only on the last page, so a client that follows
+        it has followed next through all of the changes first.
         """
-        hal_entities = []
-        tiddler = None
-        embed_name = 'tiddlyweb:tiddler'
-        for tiddler in tiddlers:
-            links = Links()
-            tiddler_link = tiddler_url(self.environ, tiddler, full=True)
+        tiddler_links = self._tiddlers_links(tiddlers, info_tiddler)
+        if page:
+            tiddler_links.update(self._page_links(
+                tiddler_links.get('self'), page))
+        if sync and 'next' not in tiddler_links:
+            tiddler_links['next-sync'] = self._query_uri(
+                    tiddler_links.get('self'), ['since', 'cursor'],
+                    [('since', sync)])
+        if compact:
+            tiddler_links['profile'] = COMPACT_PROFILE
             if tiddlers.is_revisions:
-                tiddler_link += '/revisions/%s' % encode_name(
-                        unicode(tiddler.revision))
-                embed_name = 'tiddlyweb:revision'
-            links.add(Link('self', tiddler_link))
-            hal_entity = HalDocument(links,
-                    data=self._tiddler_dict(tiddler))
-            hal_entities.append(hal_entity.structure)
-        return (hal_entities, embed_name, tiddler)
+                tiddler_links['tiddlyweb:revision'] = (
+                        tiddler_links['self'] + '/{revision}')
+
+        links = {}
+        for rel in tiddler_links:
+            if '{' in tiddler_links[rel]:
+                links[rel] = link(tiddler_links[rel], templated=True)
+            else:
+                links[rel] = link(tiddler_links[rel])
+        links['curie'] = CURIE
+        if tiddlers.is_revisions and self._delta():
+            if compact:
+                links['profile'] = [links['profile'], link(DELTA_PROFILE)]
+            else:
+                links['profile'] = link(DELTA_PROFILE)
+
+        return self._document(links, embed=embed)
 
-    def _entity_as(self, entity_structure, entity_uri, container):
+    def _stream_tiddlers(self, tiddlers, page=None, compact=False,
+            sync=None):
         """
-        A single bag or recipe.
+        Generate the list_tiddlers document in chunks: first
+        everything before the embedded tiddlers (including the
+        _links), then each embedded tiddler, then the rest.
+
+        The collection links are determined from the first tiddler,
+        which is the same as any other for the single container
+        collections where they are used.
+        """
+        tiddlers_iter = iter(self._members(self._prefetched(tiddlers)))
+        info_tiddler = None
+        for info_tiddler in tiddlers_iter:
+            break
+        embed_name = self._tiddlers_embed_name(tiddlers)
+
+        skeleton = self._tiddlers_document(tiddlers, info_tiddler,
+                {embed_name: [STREAM_MARKER]}, page, compact, sync)
+
+        def encoded_tiddlers():
+            if info_tiddler is None:
+                return
+            for document in self._embedded_tiddlers(
+                    chain([info_tiddler], tiddlers_iter),
+                    tiddlers.is_revisions, compact):
+                yield self._to_json(document)
+
+        return self._spliced(skeleton, encoded_tiddlers())
+
+    def _spliced(self, skeleton, items):
+        """
+        Generate skeleton, a document structure with [STREAM_MARKER]
+        as its embedded list, as JSON in chunks, with items, each
+        already encoded, in place of the marker.
+        """
+        head, tail = self._to_json(skeleton).split('"%s"' % STREAM_MARKER, 1)
+        separator = emitter.item_separator()
+        chunk = head
+        for item in items:
+            yield chunk + item
+            chunk = separator
+        if chunk == separator:
+            yield tail
+        else:
+            yield head + tail
+
+    def _binary_links(self, tiddler):
+        """
+        True if tiddler is binary and hal.binary_links is set in
+        config, so it gets an enclosure link in place of its text.
+        """
+        config = self.environ.get('tiddlyweb.config', {})
+        return config.get('hal.binary_links', False) and binary_tiddler(
+                tiddler)
+
+    def _enclosure_link(self, tiddler, is_revision=False):
+        """
+        The link to the raw content of a binary tiddler, with its
+        type and length, or to its canonical URI if it has one.
+        """
+        if CANONICAL_URI_FIELD in tiddler.fields:
+            return link(tiddler.fields[CANONICAL_URI_FIELD],
+                    type=tiddler.type)
+        return link(raw_url(self._tiddler_url(tiddler), tiddler,
+            is_revision), type=tiddler.type, length=len(tiddler.text or ''))
+
+    def _entity_document(self, entity_structure, entity_uri, container):
+        """
+        The structure of the HAL document of a bag or recipe.
         """
         links = self._entity_links(entity_uri, container)
-        hal_entity = HalDocument(links, data=entity_structure)
-        return hal_entity.to_json()
+        return self._document(links, data=entity_structure)
 
     def _entity_links(self, entity_uri, container):
         """
         Links for a bag or recipe entity.
         """
-        server_base = server_base_url(self.environ)
-        links = Links()
-        links.add(self.Curie)
-        links.add(Link('tiddlyweb:%s' % container,
-            '%s/%s' % (server_base, container)))
-        links.add(Link('tiddlyweb:tiddlers', entity_uri + '/tiddlers'))
-        links.add(Link('self', entity_uri))
-        return links
+        server_base = self._server_base()
+        return {
+            'curie': CURIE,
+            'tiddlyweb:%s' % container: link('%s/%s' % (server_base,
+                container)),
+            'tiddlyweb:tiddlers': link(entity_uri + '/tiddlers'),
+            'self': link(entity_uri),
+        }
 
     def _get_policy(self, policy):
         """
@@ -152,51 +497,307 @@ class Serialization(JSON):
         """
         return dict([(key, getattr(policy, key)) for key in Policy.attributes])
 
-    def _list_collection(self, entities, self_name, embed_name, url_maker):
+    def _list_collection(self, entities, self_name, embed_name):
         """
         Make a collection of either bags or recipes and returns as
         HAL JSON.
         """
-        server_base = server_base_url(self.environ)
-        hal_entities = self._embedded_entities(entities, url_maker)
+        entities, page = self._page_entities(entities)
+        compact = self._compact()
+        links = self._collection_links(self_name, embed_name, page, compact)
+        skeleton = self._document(links, embed={
+            'tiddlyweb:%s' % embed_name: [STREAM_MARKER]})
+        return ''.join(self._spliced(skeleton, (self._to_json(entity)
+            for entity in self._embedded_entities(entities, self_name,
+                compact))))
 
-        links = Links()
-        links.add(Link('self', '%s/%s' % (server_base, self_name)))
-        links.add(Link('tiddlyweb:%s' % embed_name, '%s/%s/{%s}'
-            % (server_base, self_name, embed_name), templated=True))
-        links.add(self.Curie)
+    def _collection_links(self, self_name, embed_name, page=None,
+            compact=False):
+        """
+        The links of a collection of bags or recipes.
+        """
+        server_base = self._server_base()
+        self_uri = '%s/%s' % (server_base, self_name)
+        links = {
+            'self': link(self_uri),
+            'tiddlyweb:%s' % embed_name: link('%s/%s/{%s}'
+                % (server_base, self_name, embed_name), templated=True),
+            'curie': CURIE,
+        }
+        if page:
+            page_links = self._page_links(self_uri, page)
+            for rel in page_links:
+                links[rel] = link(page_links[rel])
+        if compact:
+            links['profile'] = link(COMPACT_PROFILE)
+        return links
 
-        hal_doc = HalDocument(links, embed={
-            'tiddlyweb:%s' % embed_name: hal_entities})
-        return hal_doc.to_json()
+    def _page_entities(self, entities):
+        """
+        If paging is requested, select the requested page of
+        bags or recipes, and return it with the paging state.
+        """
+        page_size, after = self._page_query()
+        if not page_size:
+            return entities, None
+        return self._page(list(entities), _entity_key, page_size, after,
+                self._ordered())
+
+    def _page(self, members, key, page_size, after, ordered=False):
+        """
+        Select the page of members following after. Return it and
+        the state of the paging: the cursor for the next page, if
+        there is a previous page and the cursor for that.
+
+        If ordered, the members are in an order of their own, which
+        is kept, and the cursor is a position in it, not a key.
+        """
+        if ordered:
+            if after is not None and not _is_position(after):
+                raise HTTP400('unable to page collection: '
+                        'cursor is not a position')
+            members = list(enumerate(members))
+            key = _position_key
+        selected, next_cursor = paging.page(members, key, page_size, after)
+        has_previous, previous_cursor = False, None
+        if after is not None:
+            has_previous, previous_cursor = paging.previous(members, key,
+                    page_size, after)
+        if ordered:
+            selected = [member for _, member in selected]
+        return selected, (next_cursor, has_previous, previous_cursor)
+
+    def _ordered(self, tiddlers=None):
+        """
+        True if the collection has an order of its own, given by
+        a sort filter in the query or by search relevance, which
+        paging must keep.
+        """
+        if tiddlers is not None and tiddlers.is_search:
+            return True
+        return any(arguments[0] == 'sort' for _, arguments, _
+                in self.environ.get('tiddlyweb.filters', []))
+
+    def _page_links(self, self_uri, page):
+        """
+        The first, next and prev links for a page of a collection.
+        These are self_uri, or the request URI if there is no self,
+        with the current query but for the cursor.
+        """
+        next_cursor, has_previous, previous_cursor = page
+
+        def page_uri(cursor):
+            parameters = []
+            if cursor:
+                parameters.append(('cursor', cursor))
+            return self._query_uri(self_uri, ['cursor'], parameters)
+
+        links = {'first': page_uri(None)}
+        if next_cursor:
+            links['next'] = page_uri(next_cursor)
+        if has_previous:
+            links['prev'] = page_uri(previous_cursor)
+        return links
+
+    def _page_query(self, revisions=False):
+        """
+        Get the page size and the key to start after from the
+        request. The page size is from page_size in the query,
+        or count for revisions, or hal.page_size in config. None
+        means do not page.
+        """
+        query = self.environ.get('tiddlyweb.query', {})
+        config = self.environ.get('tiddlyweb.config', {})
+        cursor = query.get('cursor', [None])[0]
+        page_size = query.get('page_size', [None])[0]
+        if not page_size and revisions:
+            page_size = query.get('count', [None])[0]
+        if not page_size:
+            page_size = config.get('hal.page_size', None)
+        if not page_size and cursor:
+            page_size = paging.DEFAULT_PAGE_SIZE
+        if not page_size:
+            return None, None
+
+        try:
+            page_size = int(page_size)
+            if page_size < 1:
+                raise ValueError('page_size must be positive')
+            after = None
+            if cursor:
+                after = paging.decode_cursor(cursor)
+        except ValueError, exc:
+            raise HTTP400('unable to page collection: %s' % exc)
+        return page_size, after
+
+    def _query_uri(self, self_uri, replaced, parameters):
+        """
+        self_uri, or the request URI if there is no self, with
+        the current query but for the parameters named in replaced,
+        and with parameters, a list of name and value pairs, added.
+        """
+        if not self_uri:
+            self_uri = '%s%s%s' % (server_host_url(self.environ),
+                    quote(self.environ.get('SCRIPT_NAME', '')),
+                    quote(self.environ.get('PATH_INFO', '')))
+
+        query_string = self.environ.get('QUERY_STRING', '')
+        separator = ';' if ';' in query_string else '&'
+        query = [parameter for parameter in query_string.split(separator)
+                if parameter
+                and parameter.split('=', 1)[0] not in replaced]
+        query.extend(['%s=%s' % (name, value)
+            for name, value in parameters])
+        if query:
+            return '%s?%s' % (self_uri, separator.join(query))
+        return self_uri
+
+    def _page_tiddlers(self, tiddlers):
+        """
+        If paging is requested, make a tiddlers collection of
+        just the requested page, and return it with the paging
+        state. The page is chosen from the references held in
+        the collection, so only those tiddlers on the page are
+        ever loaded from the store.
+
+        Revisions are paged newest first. Tiddlers are paged by
+        title and bag, unless the collection is ordered, see
+        _ordered, when its order is kept.
+        """
+        page_size, after = self._page_query(tiddlers.is_revisions)
+        if not page_size:
+            return tiddlers, None
+
+        key = _revision_key if tiddlers.is_revisions else _tiddler_key
+        ordered = not tiddlers.is_revisions and self._ordered(tiddlers)
+        references = _references(tiddlers)
+        if references is None:
+            references = list(tiddlers)
+        selected, page = self._page(references, key, page_size, after,
+                ordered)
+        return self._sub_collection(tiddlers, selected), page
+
+    def _since_query(self):
+        """
+        The timestamp and sent keys of since in the query, None
+        if it is not there.
+        """
+        query = self.environ.get('tiddlyweb.query', {})
+        since = query.get('since', [None])[0]
+        if not since:
+            return None
+        try:
+            return changes.parse_since(since)
+        except ValueError, exc:
+            raise HTTP400('unable to get changes: %s' % exc)
+
+    def _since_tiddlers(self, tiddlers):
+        """
+        If since is in the query, make a tiddlers collection of
+        just the tiddlers changed since then, and return it with
+        the token for the next sync. With hal.since_index in config
+        the changes are found from changes.INDEX, and only the
+        changed tiddlers are loaded from the store.
+        """
+        since = self._since_query()
+        if since is None or tiddlers.is_revisions:
+            return tiddlers, None
+
+        references = _references(tiddlers)
+        if references is None:
+            references = list(tiddlers)
+        selected, sync = changes.changed(references, since, self._modified)
+        return self._sub_collection(tiddlers, selected), sync
+
+    def _modified(self, tiddler):
+        """
+        The modified time of tiddler, which may be a reference,
+        None if it is no longer in the store.
+        """
+        if tiddler.store:
+            return tiddler.modified
+        store = self.environ['tiddlyweb.store']
+        config = self.environ.get('tiddlyweb.config', {})
+        if config.get('hal.since_index', False):
+            return changes.INDEX.modified(store, tiddler)
+        try:
+            return store.get(Tiddler(tiddler.title, tiddler.bag)).modified
+        except StoreError:
+            return None
+
+    def _sub_collection(self, tiddlers, members):
+        """
+        A tiddlers collection like tiddlers holding just members.
+        """
+        collection = Tiddlers(title=tiddlers.title)
+        for attribute in ['link', 'is_search', 'is_revisions', 'bag',
+                'recipe']:
+            setattr(collection, attribute, getattr(tiddlers, attribute,
+                getattr(collection, attribute, None)))
+        for tiddler in members:
+            collection.add(tiddler)
+        collection.store = tiddlers.store
+        return collection
 
     def _revision_links(self, tiddler):
         """
-        The links to provide with a single revision.
+        The links to provide with a single revision, including
+        those to the revisions either side of it. The older is
+        predecessor-version and next, as in the listing, which
+        is newest first, the newer successor-version and prev.
+        """
+        tiddler_link = self._tiddler_url(tiddler)
+        links = {
+            'latest-version': link(tiddler_link),
+            'tiddlyweb:tiddler': link(tiddler_link),
+            'collection': link(tiddler_link + '/revisions'),
+            'tiddlyweb:revisions': link(tiddler_link + '/revisions'),
+        }
+        older, newer = self._revision_neighbours(tiddler)
+        if older is not None:
+            links['predecessor-version'] = links['next'] = link(
+                    '%s/revisions/%s' % (tiddler_link, older))
+        if newer is not None:
+            links['successor-version'] = links['prev'] = link(
+                    '%s/revisions/%s' % (tiddler_link, newer))
+        return links
+
+    def _revision_neighbours(self, tiddler):
+        """
+        The revisions just older and newer than the revision
+        tiddler, None where there is none or the store cannot
+        list revisions.
         """
-        tiddler_link = tiddler_url(self.environ, tiddler, full=True)
-        return [
-            Link('latest-version', tiddler_link),
-            Link('tiddlyweb:tiddler', tiddler_link),
-            Link('collection', tiddler_link + '/revisions'),
-            Link('tiddlyweb:revisions', tiddler_link + '/revisions')
-        ]
+        store = self.environ['tiddlyweb.store']
+        try:
+            revisions = [int(revision) for revision in
+                    store.list_tiddler_revisions(Tiddler(tiddler.title,
+                        tiddler.bag))]
+            index = revisions.index(int(tiddler.revision))
+        except (StoreError, ValueError):
+            return None, None
+        older = newer = None
+        if index + 1 < len(revisions):
+            older = revisions[index + 1]
+        if index > 0:
+            newer = revisions[index - 1]
+        return older, newer
 
     def _tiddler_links(self, tiddler):
         """
         The links to provide with a single tiddler.
         """
-        links = []
-        tiddler_link = tiddler_url(self.environ, tiddler, full=True)
+        tiddler_link = self._tiddler_url(tiddler)
         collection_link = self._tiddlers_links(Tiddlers(), tiddler)['self']
-        links.append(Link('tiddlyweb:tiddlers', collection_link))
-        links.append(Link('collection', collection_link))
-        links.append(Link('tiddlyweb:bag', bag_url(self.environ,
-            Bag(tiddler.bag), full=True)))
+        links = {
+            'tiddlyweb:tiddlers': link(collection_link),
+            'collection': link(collection_link),
+            'tiddlyweb:bag': link(self._container_url('bags', tiddler.bag)),
+            'self': link(tiddler_link),
+        }
         if tiddler.recipe:
-            links.append(Link('tiddlyweb:recipe', recipe_url(self.environ,
-                Recipe(tiddler.recipe), full=True)))
-        links.append(Link('self', tiddler_link))
+            links['tiddlyweb:recipe'] = link(
+                    self._container_url('recipes', tiddler.recipe))
         return links
 
     def _tiddlers_links(self, tiddlers, tiddler):
@@ -214,8 +815,7 @@ class Serialization(JSON):
             links['self'] = '%s/%s/revisions' % (
                     self._tiddlers_collection_uri(),
                     encode_name(tiddler.title))
-            links['tiddlyweb:tiddler'] = tiddler_url(self.environ,
-                    tiddler, full=True)
+            links['tiddlyweb:tiddler'] = self._tiddler_url(tiddler)
             return links
 
         links = {}
@@ -229,6 +829,111 @@ class Serialization(JSON):
 
         return links
 
+    def _server_base(self):
+        """
+        server_base_url, calculated once per serialization.
+        """
+        if not hasattr(self, '_server_base_cache'):
+            self._server_base_cache = server_base_url(self.environ)
+        return self._server_base_cache
+
+    def _tiddler_url(self, tiddler):
+        """
+        The same as tiddler_url, but only the title is encoded
+        for each tiddler.
+        """
+        return '%s/tiddlers/%s' % (self._container_url('bags', tiddler.bag),
+                encode_name(tiddler.title))
+
+    def _fat(self):
+        """
+        True if fat is set in the query, to include the text of
+        each tiddler in a collection.
+        """
+        if not hasattr(self, '_fat_cache'):
+            query = self.environ.get('tiddlyweb.query', {})
+            try:
+                self._fat_cache = bool(int(query.get('fat', [0])[0]))
+            except ValueError:
+                self._fat_cache = False
+        return self._fat_cache
+
+    def _render(self):
+        """
+        True if render is set in the query, to include the rendering
+        of the text of each renderable tiddler, as the JSON
+        serialization does.
+        """
+        if not hasattr(self, '_render_cache'):
+            query = self.environ.get('tiddlyweb.query', {})
+            try:
+                self._render_cache = bool(int(query.get('render', [0])[0]))
+            except ValueError:
+                self._render_cache = False
+        return self._render_cache
+
+    def _prefetched(self, tiddlers):
+        """
+        The tiddlers of the collection, loaded in batches by
+        prefetch if the listing is fat and hal.prefetch_threads
+        is set in config, otherwise the collection itself.
+        """
+        config = self.environ.get('tiddlyweb.config', {})
+        threads = config.get('hal.prefetch_threads', 0)
+        references = _references(tiddlers)
+        if not (threads and self._fat() and tiddlers.store
+                and references is not None):
+            return tiddlers
+        return prefetch.loaded(tiddlers.store, references, threads,
+                config.get('hal.prefetch_batch', prefetch.PREFETCH_BATCH))
+
+    def _members(self, collection):
+        """
+        The members of a collection, to be iterated. Replaced
+        when timing, to time loading them.
+        """
+        return collection
+
+    def _to_json(self, structure):
+        """
+        Encode a document structure as JSON.
+        """
+        return emitter.to_json(structure)
+
+    def _tiddler_dict(self, tiddler, fat=False, render=False, uri=True):
+        """
+        Select fields from a tiddler to create a dictionary, as
+        the JSON serialization does.
+
+        If there is a fields parameter in the query, only the
+        tiddler attributes (or permissions, uri or render) it
+        lists are included, and the others are never calculated.
+        text is included when listed, whether fat or not, unless
+        the tiddler is binary and linked to as an enclosure instead.
+        Without uri, the uri is only included when listed.
+        """
+        wanted = self._wanted_fields()
+        if wanted is not None:
+            fat = 'text' in wanted and not self._binary_links(tiddler)
+            render = render and 'render' in wanted
+
+        wanted_info = {}
+        for attribute in tiddler.slots:
+            if attribute in ['text', 'store']:
+                continue
+            if wanted is None or attribute in wanted:
+                wanted_info[attribute] = getattr(tiddler, attribute, None)
+        if wanted is None or 'permissions' in wanted:
+            wanted_info['permissions'] = self._tiddler_permissions(tiddler)
+        if (uri and wanted is None) or (wanted is not None
+                and 'uri' in wanted):
+            wanted_info['uri'] = self._tiddler_url(tiddler)
+        if fat:
+            wanted_info['text'] = _text_value(tiddler)
+        if render and renderable(tiddler, self.environ):
+            wanted_info['render'] = render_wikitext(tiddler, self.environ)
+        return wanted_info
+
     def _tiddlers_collection_uri(self):
         """
         Calculate the uri of the current tiddler collection.
@@ -245,11 +950,35 @@ class Serialization(JSON):
                 return None
 
         if recipe_name:
-            base = recipe_url(self.environ, Recipe(recipe_name), full=True)
+            base = self._container_url('recipes', recipe_name)
         else:
-            base = bag_url(self.environ, Bag(bag_name), full=True)
+            base = self._container_url('bags', bag_name)
         return base + '/tiddlers'
 
+    def _wanted_fields(self):
+        """
+        The set of tiddler attributes listed, one per parameter or
+        comma separated, in the fields query parameter. None if
+        there are none.
+        """
+        if not hasattr(self, '_wanted_fields_cache'):
+            query = self.environ.get('tiddlyweb.query', {})
+            wanted = None
+            if query.get('fields'):
+                wanted = frozenset([field.strip()
+                    for value in query['fields']
+                    for field in value.split(',') if field.strip()])
+            self._wanted_fields_cache = wanted
+        return self._wanted_fields_cache
+
+    def _tiddlers_templated(self, tiddlers):
+        """
+        True if the tiddlers collection has a link template for
+        its members, from which clients can make the item links.
+        """
+        return (not tiddlers.is_search
+                and self._tiddlers_collection_uri() is not None)
+
     def _tiddlers_self(self, tiddler):
         """
         Given a single tiddler from a collection determine the
@@ -257,11 +986,97 @@ class Serialization(JSON):
         """
         links = {}
         if tiddler.recipe:
-            tiddlers_container = recipe_url(self.environ,
-                    Recipe(tiddler.recipe), full=True)
+            tiddlers_container = self._container_url('recipes',
+                    tiddler.recipe)
             links['tiddlyweb:recipe'] = tiddlers_container
         else:
-            tiddlers_container = bag_url(self.environ, Bag(tiddler.bag),
-                    full=True)
+            tiddlers_container = self._container_url('bags',
+                    tiddler.bag)
             links['tiddlyweb:bag'] = tiddlers_container
         return links
+
+
+def _entity_key(entity):
+    """
+    Order bags and recipes by name.
+    """
+    return (entity.name,)
+
+
+def _is_position(cursor):
+    """
+    True if cursor, decoded, is a position made by _position_key.
+    """
+    return (len(cursor) == 1 and isinstance(cursor[0], int)
+            and cursor[0] >= 0)
+
+
+def _position_key(member):
+    """
+    Order members, paired with their position, by position.
+    """
+    return (member[0],)
+
+
+def _references(tiddlers):
+    """
+    The tiddlers held by a Tiddlers collection, as they were added,
+    without loading them from the store, None if they cannot be had.
+
+    Iterating a Tiddlers collection with a store loads each tiddler,
+    and there is no public way to get at what it holds without that,
+    so this reads the collection's _container, the list in which
+    tiddlyweb.model.collections.Collection keeps what is added.
+    Without it every tiddler would be loaded to be paged, checked
+    for changes or prefetched.
+    """
+    return getattr(tiddlers, '_container', None)
+
+
+def _revision_key(tiddler):
+    """
+    Order revisions newest first.
+    """
+    return (-int(tiddler.revision),)
+
+
+def _text_value(tiddler):
+    """
+    The text of tiddler as sent, base64 encoded if it is binary.
+    """
+    if not tiddler.text:
+        return ''
+    if binary_tiddler(tiddler):
+        return b64encode(tiddler.text)
+    return tiddler.text
+
+
+def _text_delta(old, new):
+    """
+    The changes making the text new from old, as the lines to
+    replace in old. See Serialization._delta_dict.
+    """
+    old_lines = _lines(old)
+    new_lines = _lines(new)
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [[start, end, ''.join(new_lines[new_start:new_end])]
+            for tag, start, end, new_start, new_end
+            in matcher.get_opcodes() if tag != 'equal']
+
+
+def _lines(text):
+    """
+    Split text after each newline, keeping the newlines.
+    """
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def _tiddler_key(tiddler):
+    """
+    Order tiddlers by title, then bag.
+    """
+    return (tiddler.title, tiddler.bag or u'')
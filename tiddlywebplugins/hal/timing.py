@@ -0,0 +1,194 @@
+"""
+Optional timing of the phases of HAL rendering.
+
+When hal.timing is set in config, the HalTiming filter puts a Timing
+in the environ of each request. A Serialization made with that
+environ has its methods wrapped, as instance attributes, so the time
+spent reading the store, building links, building dicts and encoding
+JSON is recorded, along with the number of items and bytes emitted.
+These are sent in a Server-Timing header and, when the response is
+complete, passed to the callable hal.stats_hook in config, if set,
+with the environ and the stats. The environ has PATH_INFO and
+SCRIPT_NAME as the request came in.
+
+When hal.timing is not set nothing is wrapped.
+
+A streamed response has its headers sent before the collection is
+read, so its Server-Timing header only covers what came before. The
+stats hook gets the whole request.
+"""
+
+import time
+
+
+PHASES = ['store', 'links', 'dict', 'encode']
+
+# The Serialization methods timed as each phase.
+TIMED_METHODS = {
+        'links': ['_tiddler_url', '_container_url', '_tiddlers_links',
+            '_tiddler_links', '_revision_links', '_entity_links',
+            '_page_links'],
+        'dict': ['_tiddler_dict', '_get_policy'],
+        'encode': ['_to_json'],
+}
+
+# The Serialization methods whose output is counted as bytes.
+OUTPUT_METHODS = ['list_tiddlers', 'list_bags', 'list_recipes',
+        'tiddler_as', 'bag_as', 'recipe_as']
+
+
+class Timing(object):
+    """
+    The phase times and counters for one request. Time in a phase
+    entered from another is counted only in the inner one.
+    """
+
+    def __init__(self):
+        self.times = dict([(phase, 0.0) for phase in PHASES])
+        self.counts = {'items': 0, 'bytes': 0}
+        self.used = False
+        self._stack = []
+        self._mark = None
+
+    def enter(self, phase):
+        """
+        Start timing phase, pausing the current phase.
+        """
+        now = time.time()
+        if self._stack:
+            self.times[self._stack[-1]] += now - self._mark
+        self._stack.append(phase)
+        self._mark = now
+
+    def leave(self):
+        """
+        Stop timing the current phase, resuming the one before.
+        """
+        now = time.time()
+        self.times[self._stack.pop()] += now - self._mark
+        self._mark = now
+
+    def header(self):
+        """
+        The value of a Server-Timing header, durations in ms.
+        """
+        metrics = ['hal-%s;dur=%.3f' % (phase, self.times[phase] * 1000)
+                for phase in PHASES]
+        metrics.extend(['hal-%s;desc="%s"' % (name, self.counts[name])
+            for name in sorted(self.counts)])
+        return ', '.join(metrics)
+
+    def instrument(self, serialization):
+        """
+        Wrap the methods of serialization to record timings.
+        """
+        self.used = True
+        for name in OUTPUT_METHODS:
+            setattr(serialization, name,
+                    self._counted(getattr(serialization, name)))
+        for phase in TIMED_METHODS:
+            for name in TIMED_METHODS[phase]:
+                setattr(serialization, name,
+                        self._timed(phase, getattr(serialization, name)))
+        serialization._members = self._members
+
+    def stats(self):
+        """
+        The times, in seconds, and counters as a dict.
+        """
+        stats = dict(self.counts)
+        stats.update(self.times)
+        return stats
+
+    def _counted(self, func):
+        """
+        Wrap func, a serialization method, to count the bytes of
+        its output, a string or chunks.
+        """
+        def counted_func(*args, **kwargs):
+            output = func(*args, **kwargs)
+            if isinstance(output, basestring):
+                self.counts['bytes'] += len(output)
+                return output
+            return self._counted_chunks(output)
+        return counted_func
+
+    def _counted_chunks(self, output):
+        """
+        Pass chunks of output through, counting them.
+        """
+        for chunk in output:
+            self.counts['bytes'] += len(chunk)
+            yield chunk
+
+    def _members(self, collection):
+        """
+        Iterate collection, timing as store as this is when
+        tiddlers are loaded, and counting.
+        """
+        iterator = iter(collection)
+        while True:
+            self.enter('store')
+            try:
+                member = iterator.next()
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+            self.counts['items'] += 1
+            yield member
+
+    def _timed(self, phase, func):
+        """
+        Wrap func to be timed as phase.
+        """
+        def timed_func(*args, **kwargs):
+            self.enter(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.leave()
+        return timed_func
+
+
+class HalTiming(object):
+    """
+    WSGI filter which establishes a Timing for each request and
+    reports it when a HAL serialization has used it.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        timing = Timing()
+        environ['tiddlyweb.hal.timing'] = timing
+        # The selector moves PATH_INFO into SCRIPT_NAME on its way
+        # to the handler, so keep them as they came for the hook.
+        paths = dict([(name, environ.get(name, ''))
+            for name in ['PATH_INFO', 'SCRIPT_NAME']])
+
+        def timed_start_response(status, headers, exc_info=None):
+            if timing.used:
+                headers.append(('Server-Timing', timing.header()))
+            return start_response(status, headers, exc_info)
+
+        output = self.application(environ, timed_start_response)
+        return self._report(environ, paths, timing, output)
+
+    def _report(self, environ, paths, timing, output):
+        """
+        Pass the output through, then give the stats to the hook,
+        with the environ's paths as they were when the request came.
+        """
+        try:
+            for chunk in output:
+                yield chunk
+        finally:
+            if hasattr(output, 'close'):
+                output.close()
+        hook = environ['tiddlyweb.config'].get('hal.stats_hook')
+        if hook and timing.used:
+            environ = dict(environ)
+            environ.update(paths)
+            hook(environ, timing.stats())